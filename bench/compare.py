@@ -0,0 +1,55 @@
+"""Ikki benchmark natijasini (bench/run.py) solishtirish.
+
+    python bench/compare.py bench/results/old.json bench/results/new.json --threshold 0.10
+
+Har bir fixture/bosqich uchun median vaqtlar nisbati chiqariladi. Biror bosqich
+``--threshold`` dan ko'proq sekinlashsa, chiqish kodi 1 bo'ladi.
+"""
+import argparse
+import json
+import sys
+
+# Juda qisqa bosqichlarda o'lchov shovqini nisbatdan katta — ular regressiya hisoblanmaydi
+MIN_SECONDS = 0.005
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return {result["fixture"]: result for result in report["results"]}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="ruxsat etilgan sekinlashish (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    base, new = load(args.base), load(args.new)
+    regressions = 0
+    print(f"{'fixture':<24} {'stage':<15} {'base ms':>10} {'new ms':>10} {'ratio':>7}")
+    for fixture in sorted(base.keys() & new.keys()):
+        old_stages, new_stages = base[fixture]["stages"], new[fixture]["stages"]
+        for stage in old_stages:
+            if stage not in new_stages:
+                continue
+            old_s, new_s = old_stages[stage]["median"], new_stages[stage]["median"]
+            ratio = new_s / old_s if old_s else float("inf") if new_s else 1.0
+            flag = ""
+            if ratio > 1 + args.threshold and max(old_s, new_s) >= MIN_SECONDS:
+                flag = "  ❌"
+                regressions += 1
+            print(f"{fixture:<24} {stage:<15} {old_s * 1000:>10.1f} {new_s * 1000:>10.1f} {ratio:>7.2f}{flag}")
+
+        old_peak, new_peak = base[fixture]["peak_traced_bytes"], new[fixture]["peak_traced_bytes"]
+        print(f"{fixture:<24} {'peak MB':<15} {old_peak / 2**20:>10.1f} {new_peak / 2**20:>10.1f} "
+              f"{(new_peak / old_peak if old_peak else 1.0):>7.2f}")
+
+    for fixture in sorted(base.keys() ^ new.keys()):
+        print(f"⚠️ {fixture}: faqat bitta natijada bor")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
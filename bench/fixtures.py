@@ -0,0 +1,201 @@
+"""Benchmark uchun sintetik DOCX fixture'lar generatori (python-docx orqali).
+
+Fixture — /parse-docx/ kutadigan 6 ustunli jadval (savol, to'g'ri, noto'g'ri x3,
+author). Parametrlar: qatorlar soni, rasm zichligi, rasm o'lchami, crop (srcRect),
+VML ``v:imagedata`` rasmlar va takroriy media ulushi. Bir xil seed — bir xil fayl.
+
+    python bench/fixtures.py --out bench/fixtures            # standart to'plam
+    python bench/fixtures.py --out /tmp/x --rows 5000 --image-density 0.5
+"""
+import argparse
+import io
+import json
+import random
+import sys
+from pathlib import Path
+
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.image.image import Image as DocxImage
+from docx.opc.packuri import PackURI
+from docx.oxml.shape import CT_Inline
+from docx.parts.image import ImagePart
+from docx.shared import Emu, Inches
+from PIL import Image, ImageDraw
+
+# Standart to'plam: qatorlar soni (10–5000) va rasm xususiyatlari bo'yicha variantlar
+DEFAULT_MATRIX = [
+    {"name": "rows10_text", "rows": 10, "image_density": 0.0},
+    {"name": "rows100_mixed", "rows": 100, "image_density": 0.3, "crop_ratio": 0.3, "vml_ratio": 0.1},
+    {"name": "rows1000_text", "rows": 1000, "image_density": 0.0},
+    {"name": "rows1000_mixed", "rows": 1000, "image_density": 0.3, "crop_ratio": 0.3, "vml_ratio": 0.1,
+     "dup_ratio": 0.3},
+    {"name": "rows1000_dense_dup", "rows": 1000, "image_density": 1.0, "dup_ratio": 0.8},
+    {"name": "rows200_large_images", "rows": 200, "image_density": 0.5, "image_size": [1600, 1200],
+     "crop_ratio": 0.5},
+    {"name": "rows5000_mixed", "rows": 5000, "image_density": 0.2, "crop_ratio": 0.2, "vml_ratio": 0.1,
+     "dup_ratio": 0.5},
+]
+
+
+def make_image(rng: random.Random, size: tuple, fmt: str) -> bytes:
+    """Har xil (lekin deterministik) rasm: gradient fon va tasodifiy shakllar."""
+    w, h = size
+    img = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        x1, y1 = min(w, x0 + rng.randrange(1, w)), min(h, y0 + rng.randrange(1, h))
+        draw.rectangle((x0, y0, x1, y1), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class _MediaWriter:
+    """Rasm part'lari va inline'larni hisoblagich bilan qo'shish.
+
+    python-docx ``add_picture`` har safar barcha part nomlari va shape id'larini
+    qayta ko'rib chiqadi (qatorlar soniga nisbatan kvadratik) — 5000 qatorli
+    fixture uchun juda sekin. Bu yerda nomlar va id'lar ketma-ket beriladi.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.image_parts = doc.part.package.image_parts
+        self.next_number = len(self.image_parts) + 1
+        self.next_shape_id = 1000
+
+    def add_part(self, blob: bytes) -> tuple:
+        """Yangi media part (bir xil baytlar bo'lsa ham alohida). Qaytaradi: (rId, part)."""
+        image = DocxImage.from_blob(blob)
+        partname = PackURI(f"/word/media/image{self.next_number}.{image.ext}")
+        self.next_number += 1
+        part = ImagePart.from_image(image, partname)
+        self.image_parts.append(part)
+        return self.doc.part.relate_to(part, RT.IMAGE), part
+
+    def add_inline(self, run, r_id: str, part):
+        image = DocxImage.from_blob(part.blob)
+        width = Inches(1)
+        height = Emu(int(width * image.px_height / image.px_width))
+        self.next_shape_id += 1
+        inline = CT_Inline.new_pic_inline(self.next_shape_id, r_id, part.partname.filename, width, height)
+        run._r.add_drawing(inline)
+
+
+def _add_vml_picture(paragraph, r_id: str):
+    paragraph._p.append(parse_xml(
+        f'<w:r {nsdecls("w", "r")} xmlns:v="urn:schemas-microsoft-com:vml">'
+        f'<w:pict><v:shape style="width:72pt;height:48pt"><v:imagedata r:id="{r_id}"/></v:shape></w:pict>'
+        f'</w:r>'
+    ))
+
+
+def _add_src_rect(run, rng: random.Random):
+    blip_fill = next(run._r.iter(qn("pic:blipFill")))
+    sides = {side: str(rng.randrange(0, 25000)) for side in ("l", "t", "r", "b") if rng.random() < 0.7}
+    attrs = " ".join(f'{k}="{v}"' for k, v in sides.items()) or 'l="10000"'
+    blip_fill.insert(1, parse_xml(f'<a:srcRect {nsdecls("a")} {attrs}/>'))
+
+
+def make_fixture(
+    path,
+    rows: int = 100,
+    image_density: float = 0.3,
+    image_size=(120, 80),
+    crop_ratio: float = 0.0,
+    vml_ratio: float = 0.0,
+    dup_ratio: float = 0.0,
+    seed: int = 1,
+    **_,
+) -> dict:
+    """Fixture yaratish. Qaytaradi: yaratilgan rasmlar statistikasi."""
+    rng = random.Random(seed)
+    doc = Document()
+    doc.add_paragraph("Benchmark fixture")
+    table = doc.add_table(rows=rows, cols=6)
+    media = _MediaWriter(doc)
+    image_rids = []  # (rId, image part) — takroriy media uchun manba
+    stats = {"images": 0, "cropped": 0, "vml": 0, "duplicate_refs": 0, "duplicate_parts": 0}
+
+    for i, row in enumerate(table.rows):
+        cells = row.cells
+        for j in range(5):
+            # Savol ustunida rasm zichligi to'liq, javoblarda yarmi
+            if rng.random() < (image_density if j == 0 else image_density / 2):
+                paragraph = cells[j].paragraphs[0]
+                if j == 0:
+                    paragraph.add_run(f"Savol {i}: ")
+
+                if image_rids and rng.random() < dup_ratio:
+                    r_id, part = rng.choice(image_rids)
+                    if rng.random() < 0.5:
+                        r_id, _ = media.add_part(part.blob)
+                        stats["duplicate_parts"] += 1
+                    else:
+                        stats["duplicate_refs"] += 1
+                    _add_vml_picture(paragraph, r_id)
+                elif rng.random() < vml_ratio:
+                    r_id, part = media.add_part(make_image(rng, tuple(image_size), "PNG"))
+                    image_rids.append((r_id, part))
+                    _add_vml_picture(paragraph, r_id)
+                    stats["vml"] += 1
+                else:
+                    r_id, part = media.add_part(make_image(rng, tuple(image_size), rng.choice(("PNG", "JPEG"))))
+                    image_rids.append((r_id, part))
+                    run = paragraph.add_run()
+                    media.add_inline(run, r_id, part)
+                    if rng.random() < crop_ratio:
+                        _add_src_rect(run, rng)
+                        stats["cropped"] += 1
+                stats["images"] += 1
+            else:
+                cells[j].text = f"Savol {i} matni" if j == 0 else f"Javob {i}.{j}"
+        cells[5].text = "Bench Muallif" if i == 1 else ""
+
+    doc.save(path)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench/fixtures", help="fixture'lar papkasi")
+    parser.add_argument("--name", help="bitta fixture nomi (berilmasa — standart to'plam)")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--image-density", type=float, default=0.3)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[120, 80], metavar=("W", "H"))
+    parser.add_argument("--crop-ratio", type=float, default=0.0)
+    parser.add_argument("--vml-ratio", type=float, default=0.0)
+    parser.add_argument("--dup-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.name or any(a.startswith("--rows") or a.startswith("--image") for a in (argv or sys.argv[1:])):
+        matrix = [{
+            "name": args.name or f"rows{args.rows}_custom",
+            "rows": args.rows,
+            "image_density": args.image_density,
+            "image_size": args.image_size,
+            "crop_ratio": args.crop_ratio,
+            "vml_ratio": args.vml_ratio,
+            "dup_ratio": args.dup_ratio,
+            "seed": args.seed,
+        }]
+    else:
+        matrix = DEFAULT_MATRIX
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for spec in matrix:
+        path = out / f"{spec['name']}.docx"
+        stats = make_fixture(path, **{k: v for k, v in spec.items() if k != "name"})
+        # Parametrlar fixture yonida saqlanadi — natijalar bilan birga yoziladi
+        (out / f"{spec['name']}.json").write_text(json.dumps({**spec, "stats": stats}, indent=2))
+        print(f"🧪 {path} ({path.stat().st_size / 1024:.0f} KB): {stats}")
+
+
+if __name__ == "__main__":
+    main()
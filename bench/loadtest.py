@@ -0,0 +1,302 @@
+"""/parse-docx/ va /api/tests uchun yuklama testi: o'tkazuvchanlik, p50/p95/p99 kechikish va xatoliklar ulushi.
+
+Ishlab turgan ilovaga qarshi:
+
+    python bench/loadtest.py --url http://127.0.0.1:8000 --duration 60 --concurrency 8 \\
+        --mix parse=1,tests=4 bench/fixtures/rows100_mixed.docx
+
+Mock upstream (bench/mock_upstream.py) va ilovani o'zi ishga tushirib:
+
+    python bench/loadtest.py --spawn --workers 2 --mock-args "--latency 0.05 --error-rate 0.02" \\
+        --duration 30 bench/fixtures/*.docx --out bench/results/load.json
+
+Yopiq sikl (default): ``--concurrency`` ta virtual mijoz javobni kutib, keyingi
+so'rovni yuboradi. Ochiq sikl (``--rate``): so'rovlar belgilangan tezlikda
+yuboriladi (bir vaqtda ko'pi bilan ``--concurrency`` tasi), kechikish esa
+rejalashtirilgan vaqtdan hisoblanadi — server sekinlashsa, navbatda kutish ham
+natijaga kiradi (coordinated omission bo'lmaydi).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH = Path(__file__).resolve().parent
+
+ENDPOINTS = ("parse", "tests")
+# "queued" — fayl outbox'ga tushdi va keyinroq yuboriladi, bu so'rov xatoligi emas
+SUCCESS_OUTCOMES = ("ok", "queued")
+
+
+def parse_mix(value: str) -> dict:
+    """"parse=1,tests=4" → {"parse": 1.0, "tests": 4.0}."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"noma'lum endpoint: {name} ({', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentil (ro'yxat saralangan bo'lishi kerak)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Har bir endpoint uchun kechikishlar va natijalar (ok, http_<status>, failed, <exception>)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.questions = 0
+
+    def record(self, endpoint: str, latency: float, outcome: str):
+        self.latencies[endpoint].append(latency)
+        self.outcomes[endpoint][outcome] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        report = {}
+        for endpoint, values in self.latencies.items():
+            values = sorted(values)
+            outcomes = self.outcomes[endpoint]
+            errors = sum(count for outcome, count in outcomes.items() if outcome not in SUCCESS_OUTCOMES)
+            report[endpoint] = {
+                "requests": len(values),
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+                "error_rate": errors / len(values) if values else 0.0,
+                "latency": {
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                    "max": values[-1] if values else 0.0,
+                },
+                "outcomes": dict(outcomes),
+            }
+        if "parse" in report:
+            report["parse"]["questions"] = self.questions
+            report["parse"]["questions_per_second"] = self.questions / elapsed if elapsed else 0.0
+        return report
+
+
+class LoadDriver:
+    def __init__(self, args: argparse.Namespace, url: str):
+        self.args = args
+        self.url = url.rstrip("/")
+        self.rng = random.Random(args.seed)
+        self.fixtures = [(path.name, path.read_bytes()) for path in args.fixtures]
+        self.recorder = Recorder()
+        names = list(args.mix)
+        if "parse" in names and not self.fixtures:
+            raise SystemExit("❌ parse uchun kamida bitta DOCX fixture kerak")
+        self._names = names
+        self._weights = [args.mix[name] for name in names]
+
+    def pick(self) -> str:
+        return self.rng.choices(self._names, self._weights)[0]
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str, scheduled: float):
+        outcome = "ok"
+        try:
+            if endpoint == "tests":
+                response = await client.get(f"{self.url}/api/tests")
+                if response.status_code != 200:
+                    outcome = f"http_{response.status_code}"
+            else:
+                filename, content = self.rng.choice(self.fixtures)
+                response = await client.post(
+                    f"{self.url}/parse-docx/",
+                    files={"files": (filename, content)},
+                    data={"test": "1", "language": "uz", "class_id": "1", "subject": "1"},
+                )
+                if response.status_code != 200:
+                    outcome = f"http_{response.status_code}"
+                else:
+                    report = response.json()
+                    self.recorder.questions += report.get("total_questions", 0)
+                    if not report.get("success"):
+                        outcome = "failed"
+                    elif report.get("files_queued"):
+                        outcome = "queued"
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        self.recorder.record(endpoint, time.perf_counter() - scheduled, outcome)
+
+    async def run(self) -> float:
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(timeout=self.args.timeout, limits=limits) as client:
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            if self.args.rate:
+                await self._open_loop(client, started, deadline)
+            else:
+                await asyncio.gather(*(self._closed_loop(client, deadline) for _ in range(self.args.concurrency)))
+            return time.perf_counter() - started
+
+    async def _closed_loop(self, client: httpx.AsyncClient, deadline: float):
+        while time.perf_counter() < deadline:
+            await self.request(client, self.pick(), time.perf_counter())
+
+    async def _open_loop(self, client: httpx.AsyncClient, started: float, deadline: float):
+        slots = asyncio.Semaphore(self.args.concurrency)
+        interval = 1.0 / self.args.rate
+        tasks = []
+
+        async def fire(endpoint: str, scheduled: float):
+            async with slots:
+                await self.request(client, endpoint, scheduled)
+
+        n = 0
+        while True:
+            scheduled = started + n * interval
+            if scheduled >= deadline:
+                break
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            tasks.append(asyncio.create_task(fire(self.pick(), scheduled)))
+            n += 1
+        await asyncio.gather(*tasks)
+
+
+def wait_ready(url: str, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit(f"❌ {url} {timeout:.0f}s ichida javob bermadi")
+
+
+@contextmanager
+def spawned_stack(args: argparse.Namespace):
+    """Mock upstream va ilovani (uvicorn) alohida process'larda ishga tushirish."""
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    workdir = tempfile.TemporaryDirectory(prefix="docx-load-")
+    env = {
+        **os.environ,
+        "API_URL": f"{mock_url}/api/public/tests",
+        "QUESTIONS_API_URL": f"{mock_url}/api/questions",
+        # Yuklama testi outbox'i repo'dagi haqiqiy navbatga aralashmaydi
+        "OUTBOX_PATH": str(Path(workdir.name) / "outbox.sqlite3"),
+        # Har bir yugurish sovuq rasm keshidan boshlanadi (oldingi yugurishlar natijasiga ta'sir qilmasin)
+        "IMAGE_CACHE_BACKEND": os.environ.get("IMAGE_CACHE_BACKEND", "memory"),
+    }
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    # Ilova loglari hisobotga aralashmasin; parse pool process'lari ham shu faylga yozadi
+    app_log = open(args.app_log or os.devnull, "ab")
+    processes = [
+        subprocess.Popen(
+            [sys.executable, str(BENCH / "mock_upstream.py"), "--port", str(args.mock_port), *shlex.split(args.mock_args)]
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=app_log, stderr=subprocess.STDOUT,
+        ),
+    ]
+    try:
+        wait_ready(f"{mock_url}/_stats")
+        wait_ready(f"{app_url}/health")
+        yield app_url, mock_url
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        app_log.close()
+        workdir.cleanup()
+
+
+def print_report(report: dict, elapsed: float):
+    print(f"⏱️ {elapsed:.1f}s")
+    print(f"{'endpoint':<8} {'req':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for endpoint, stats in report.items():
+        latency = stats["latency"]
+        print(
+            f"{endpoint:<8} {stats['requests']:>7} {stats['throughput']:>8.2f} {latency['p50'] * 1000:>9.1f} "
+            f"{latency['p95'] * 1000:>9.1f} {latency['p99'] * 1000:>9.1f} {latency['max'] * 1000:>9.1f} "
+            f"{stats['error_rate']:>7.1%}"
+        )
+        outcomes = ", ".join(f"{outcome}={count}" for outcome, count in sorted(stats["outcomes"].items()))
+        print(f"{'':<8} {outcomes}")
+    if "parse" in report:
+        print(f"📄 {report['parse']['questions']} ta savol ({report['parse']['questions_per_second']:.1f}/s)")
+
+
+def run(args: argparse.Namespace, url: str, mock_url: str = None) -> dict:
+    if mock_url:
+        httpx.post(f"{mock_url}/_stats/reset")
+    driver = LoadDriver(args, url)
+    elapsed = asyncio.run(driver.run())
+    report = driver.recorder.summary(elapsed)
+    print_report(report, elapsed)
+    upstream = httpx.get(f"{mock_url}/_stats").json() if mock_url else None
+    if upstream:
+        print(f"🛰️ upstream: {', '.join(f'{k}={v}' for k, v in sorted(upstream.items()))}")
+    return {"elapsed": elapsed, "endpoints": report, "upstream": upstream}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="*", type=Path, help="/parse-docx/ ga yuboriladigan DOCX fayllar")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="ishlab turgan ilova manzili")
+    parser.add_argument("--mock-url", help="ishlab turgan mock upstream (statistika uchun)")
+    parser.add_argument("--duration", type=float, default=30.0, help="test davomiyligi (s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual mijozlar / bir vaqtdagi so'rovlar soni")
+    parser.add_argument("--rate", type=float, help="ochiq sikl: soniyasiga so'rovlar")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("parse=1,tests=4"), help="endpoint og'irliklari")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="natija JSON")
+    spawn = parser.add_argument_group("--spawn: mock upstream va ilovani shu yerda ishga tushirish")
+    spawn.add_argument("--spawn", action="store_true")
+    spawn.add_argument("--workers", type=int, default=1, help="uvicorn worker'lari soni")
+    spawn.add_argument("--app-port", type=int, default=8765)
+    spawn.add_argument("--mock-port", type=int, default=9100)
+    spawn.add_argument("--mock-args", default="", help='mock_upstream.py parametrlari, masalan "--error-rate 0.05"')
+    spawn.add_argument("--app-log", type=Path, help="ilova stdout/stderr yoziladigan fayl (default: tashlab yuboriladi)")
+    spawn.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="ilova uchun env")
+    args = parser.parse_args(argv)
+
+    if args.spawn:
+        with spawned_stack(args) as (url, mock_url):
+            result = run(args, url, mock_url)
+    else:
+        result = run(args, args.url, args.mock_url)
+
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        params = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items() if k != "fixtures"}
+        result["params"] = {**params, "fixtures": [str(path) for path in args.fixtures]}
+        args.out.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+        print(f"📄 Natija: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Upstream (Laravel API) ning lokal o'rinbosari: testlar katalogi va savollar POST'i.
+
+    python bench/mock_upstream.py --port 9100 --latency 0.05 --jitter 0.02 \\
+        --error-rate 0.05 --redirect-rate 0.02 --redirect-mode login
+
+Ilovani unga yo'naltirish:
+
+    API_URL=http://127.0.0.1:9100/api/public/tests \\
+    QUESTIONS_API_URL=http://127.0.0.1:9100/api/questions uvicorn main:app
+
+Redirect rejimlari ``_post_chunk`` dagi 3xx holatlarini takrorlaydi:
+  temporary — 307 → /api/questions/accepted (POST saqlanadi, savollar qabul qilinadi)
+  login     — 302 → /login (Laravel auth kabi; GET HTML qaytaradi → "JSON emas" xatoligi)
+  bare      — Location'siz 302 (ilovada "Server redirect" xatoligi)
+  loop      — cheksiz redirect (httpx TooManyRedirects → qayta urinish)
+
+Statistika: GET /_stats, nolga qaytarish: POST /_stats/reset.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+from collections import Counter
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+
+REDIRECT_MODES = ("temporary", "login", "bare", "loop")
+LANGUAGES = ("uz", "ru", "en")
+
+
+def make_catalogue(count: int, seed: int = 0) -> list:
+    """API_URL javobidagi ``data`` massivi: testlar, ularning fanlari (til bilan) va sinflari."""
+    rng = random.Random(seed)
+    tests = []
+    for test_id in range(1, count + 1):
+        subjects = [
+            {"id": test_id * 100 + i, "name": f"Fan {i}", "language": rng.choice(LANGUAGES)}
+            for i in range(1, rng.randint(2, 8))
+        ]
+        grades = [{"id": grade, "name": f"{grade}-sinf"} for grade in range(rng.randint(1, 5), 12)]
+        tests.append({"id": test_id, "name": f"Test {test_id}", "subjects": subjects, "grades": grades})
+    return tests
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Mock upstream")
+    rng = random.Random(args.seed)
+    catalogue = make_catalogue(args.tests, args.seed)
+    stats = Counter()
+    # Idempotency-Key → birinchi muvaffaqiyatli javob (qayta yuborilgan bo'lak ikki marta sanalmaydi)
+    accepted = {}
+
+    async def delay(body_bytes: int = 0):
+        seconds = args.latency + rng.uniform(-args.jitter, args.jitter) + body_bytes / 2**20 * args.latency_per_mb
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def injected_error() -> Optional[Response]:
+        if rng.random() >= args.error_rate:
+            return None
+        status = rng.choice(args.error_statuses)
+        stats[f"injected_{status}"] += 1
+        headers = {"Retry-After": str(args.retry_after)} if status in (429, 503) else {}
+        return JSONResponse({"success": False, "message": "Injected error"}, status_code=status, headers=headers)
+
+    @app.get("/api/public/tests")
+    async def tests():
+        stats["catalogue_requests"] += 1
+        await delay()
+        error = injected_error() if args.catalogue_errors else None
+        return error or JSONResponse({"success": True, "data": catalogue})
+
+    async def accept(request: Request) -> Response:
+        body = await request.body()
+        stats["posts"] += 1
+        stats["bytes"] += len(body)
+        await delay(len(body))
+        if request.headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        try:
+            payload = json.loads(body)
+            questions = len(payload["questions"])
+        except (ValueError, KeyError, TypeError):
+            stats["invalid"] += 1
+            return JSONResponse({"success": False, "message": "Invalid payload"}, status_code=422)
+
+        key = request.headers.get("idempotency-key")
+        if key and key in accepted:
+            stats["duplicates"] += 1
+            return JSONResponse(accepted[key])
+        result = {"success": True, "created": questions}
+        if key:
+            accepted[key] = result
+        stats["questions"] += questions
+        stats["accepted"] += 1
+        return JSONResponse(result)
+
+    @app.post("/api/questions")
+    async def questions(request: Request):
+        error = injected_error()
+        if error is not None:
+            await request.body()
+            await delay()
+            return error
+        if rng.random() < args.redirect_rate:
+            await request.body()
+            stats[f"redirect_{args.redirect_mode}"] += 1
+            if args.redirect_mode == "temporary":
+                return Response(status_code=307, headers={"Location": "/api/questions/accepted"})
+            if args.redirect_mode == "login":
+                return Response(status_code=302, headers={"Location": "/login"})
+            if args.redirect_mode == "loop":
+                return Response(status_code=302, headers={"Location": "/api/questions/loop"})
+            return Response(status_code=302)
+        return await accept(request)
+
+    @app.post("/api/questions/accepted")
+    async def questions_after_redirect(request: Request):
+        return await accept(request)
+
+    @app.api_route("/api/questions/loop", methods=["GET", "POST"])
+    async def redirect_loop():
+        stats["loop_hops"] += 1
+        return Response(status_code=302, headers={"Location": "/api/questions/loop"})
+
+    @app.get("/login")
+    async def login():
+        return HTMLResponse("<html><body>Login</body></html>")
+
+    @app.get("/_stats")
+    async def get_stats():
+        return JSONResponse(dict(stats))
+
+    @app.post("/_stats/reset")
+    async def reset_stats():
+        stats.clear()
+        accepted.clear()
+        return JSONResponse({"success": True})
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tests", type=int, default=50, help="katalogdagi testlar soni")
+    parser.add_argument("--latency", type=float, default=0.02, help="har bir javobning bazaviy kechikishi (s)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="kechikishga ± tasodifiy qo'shimcha (s)")
+    parser.add_argument("--latency-per-mb", type=float, default=0.0, help="POST tanasining har bir MB i uchun kechikish (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="xatolik qaytariladigan so'rovlar ulushi (0..1)")
+    parser.add_argument(
+        "--error-statuses", type=lambda v: [int(s) for s in v.split(",")], default=[500, 502, 503, 429],
+        help="vergul bilan ajratilgan xatolik statuslari",
+    )
+    parser.add_argument("--retry-after", type=int, default=1, help="429/503 dagi Retry-After (s)")
+    parser.add_argument("--catalogue-errors", action="store_true", help="xatoliklarni katalog GET'iga ham qo'llash")
+    parser.add_argument("--redirect-rate", type=float, default=0.0, help="3xx qaytariladigan POST'lar ulushi (0..1)")
+    parser.add_argument("--redirect-mode", choices=REDIRECT_MODES, default="temporary")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    cli_args = parse_args()
+    uvicorn.run(create_app(cli_args), host=cli_args.host, port=cli_args.port, log_level="warning")
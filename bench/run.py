@@ -0,0 +1,308 @@
+"""Parse pipeline benchmark: har bir bosqich vaqti va xotira cho'qqisi (JSON natija).
+
+Bosqichlar:
+  load            — DocxPackage (ZIP indeks) + python-docx Document
+  table_walk      — har bir jadval uchun TableArrays (cell matni, rasm rId va crop)
+  image_extract   — rasmli barcha cell'lar uchun TableArrays.image (crop/normalize/base64 ni ham o'z ichiga oladi)
+  crop, normalize, base64 — image_extract ichidagi ulushlar
+  parse_docx, parse_stream — parse_docx_content (ikkala engine) to'liq
+  payload_build   — build_questions_payload
+  serialize       — split_payload + iter_body (oqimli JSON tanalari)
+  end_to_end      — _parse_and_send_one_file: parse + payload + stub upstream'ga POST
+
+Upstream POST'lari lokal stub'ga (httpx MockTransport) yuboriladi; ``--upstream URL``
+bilan haqiqiy lokal serverga yuborish mumkin. Natijalarni commit'lar orasida
+``bench/compare.py`` bilan solishtiring.
+
+    python bench/fixtures.py --out bench/fixtures
+    python bench/run.py bench/fixtures/*.docx --repeat 5 --out bench/results/base.json
+"""
+import argparse
+import asyncio
+import base64
+import gc
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource  # faqat Unix
+except ImportError:
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Bosqichlarni o'lchash uchun parse shu process'da, keshlarsiz va outbox'siz ishlaydi
+os.environ.setdefault("PARSE_WORKERS", "0")
+os.environ.setdefault("OUTBOX_ENABLED", "0")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+os.environ.setdefault("IMAGE_CACHE_BACKEND", "memory")
+
+import httpx  # noqa: E402
+from docx import Document  # noqa: E402
+
+import main  # noqa: E402
+
+SETTINGS_KEYS = (
+    "PARSE_ENGINE", "PAYLOAD_IMAGE_MODE", "IMAGE_MAX_DIM", "IMAGE_FORMAT", "IMAGE_QUALITY",
+    "IMAGE_STRIP_METADATA", "SUBMIT_BATCH_QUESTIONS", "SUBMIT_BATCH_BYTES", "SUBMIT_GZIP",
+)
+
+
+class StageTimer:
+    """Ichki funksiyalar (crop, normalize, base64) ga sarflangan vaqtni yig'ish."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.totals[name] += time.perf_counter() - started
+                self.calls[name] += 1
+        return timed
+
+
+class _Base64Proxy:
+    def __init__(self, timer: StageTimer):
+        self.b64encode = timer.wrap("base64", base64.b64encode)
+
+    def __getattr__(self, name):
+        return getattr(base64, name)
+
+
+@contextmanager
+def instrumented(timer: StageTimer):
+    originals = (main.crop_image, main.normalize_image, main.base64)
+    main.crop_image = timer.wrap("crop", main.crop_image)
+    main.normalize_image = timer.wrap("normalize", main.normalize_image)
+    main.base64 = _Base64Proxy(timer)
+    try:
+        yield timer
+    finally:
+        main.crop_image, main.normalize_image, main.base64 = originals
+
+
+def reset_caches():
+    """Har bir takrorlash sovuq keshdan boshlanadi."""
+    main.image_cache = main.MemoryCacheBackend(main.IMAGE_CACHE_BYTES)
+    main.document_cache = main.DocumentCache(main.DOC_CACHE_BYTES, None)
+
+
+def make_stub_client(received: dict) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        request.read()
+        received["posts"] += 1
+        received["bytes"] += len(request.content)
+        return httpx.Response(200, json={"success": True})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def run_stages(path: Path, upstream: bool) -> tuple:
+    """Bitta takrorlash: bosqich → soniya, va hisoblagichlar."""
+    timings = {}
+    counts = {}
+    reset_caches()
+    gc.collect()
+
+    started = time.perf_counter()
+    package = main.DocxPackage(str(path))
+    doc = Document(str(path))
+    timings["load"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    tables = [main.TableArrays(table._tbl) for table in doc.tables]
+    timings["table_walk"] = time.perf_counter() - started
+    counts.update(
+        cells=sum(len(arrays.cells) for arrays in tables),
+        text_chars=sum(len(text) for arrays in tables for text in arrays.texts),
+    )
+
+    with instrumented(StageTimer()) as timer:
+        started = time.perf_counter()
+        images = sum(
+            1
+            for arrays in tables
+            for i, rel_id in enumerate(arrays.image_rids)
+            if rel_id and arrays.image(i, package)
+        )
+        timings["image_extract"] = time.perf_counter() - started
+    for name in ("crop", "normalize", "base64"):
+        timings[name] = timer.totals[name]
+    counts.update(cells_with_image=images, unique_images=len(package.images), crops=timer.calls["crop"])
+    package.close()
+
+    reset_caches()
+    started = time.perf_counter()
+    main.parse_docx_content(str(path), engine="stream")
+    timings["parse_stream"] = time.perf_counter() - started
+
+    reset_caches()
+    started = time.perf_counter()
+    questions, author, images_table = main.parse_docx_content(str(path), engine="docx")
+    timings["parse_docx"] = time.perf_counter() - started
+    counts["questions"] = len(questions)
+
+    started = time.perf_counter()
+    payload = main.build_questions_payload(questions, images_table, author, "1", "uz", "1", "1")
+    timings["payload_build"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chunks = main.split_payload(payload)
+    for chunk in chunks:
+        for _ in chunk.iter_body():
+            pass
+    timings["serialize"] = time.perf_counter() - started
+    counts.update(chunks=len(chunks), payload_bytes=sum(c.size for c in chunks))
+
+    reset_caches()
+    received = {"posts": 0, "bytes": 0}
+    timings["end_to_end"], success = asyncio.run(_end_to_end(path, received, upstream))
+    counts.update(posts=received["posts"], posted_bytes=received["bytes"], submitted=success)
+    return timings, counts
+
+
+async def _end_to_end(path: Path, received: dict, upstream: bool) -> tuple:
+    main._http_client = httpx.AsyncClient() if upstream else make_stub_client(received)
+    try:
+        upload = main.SpooledUpload(path.name, path, path.stat().st_size, _sha256(path))
+        started = time.perf_counter()
+        success, _, error, _ = await main._parse_and_send_one_file(upload, "1", "uz", "1", "1")
+        elapsed = time.perf_counter() - started
+        if not success:
+            print(f"⚠️ {path.name}: {error}")
+        return elapsed, success
+    finally:
+        await main._http_client.aclose()
+        main._http_client = None
+
+
+def peak_memory(path: Path) -> int:
+    """parse_docx_content + payload qurish davomidagi Python ajratmalari cho'qqisi (bayt)."""
+    reset_caches()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        questions, author, images = main.parse_docx_content(str(path))
+        for chunk in main.split_payload(main.build_questions_payload(questions, images, author, "1", "uz", "1", "1")):
+            for _ in chunk.iter_body():
+                pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def max_rss_kb():
+    """Process RSS cho'qqisi (KB): Unix'da ``resource``, boshqa joyda ``psutil`` (o'rnatilgan bo'lsa).
+
+    Ikkalasi ham bo'lmasa None — fixture'lar bo'yicha ``peak_traced_bytes`` (tracemalloc)
+    baribir har qanday platformada o'lchanadi.
+    """
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux'da KB, macOS'da bayt
+        return rss // 1024 if sys.platform == "darwin" else rss
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    # Windows'da peak_wset — ishchi to'plam cho'qqisi; boshqa joyda joriy RSS
+    return getattr(info, "peak_wset", info.rss) // 1024
+
+
+def _sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return ""
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+    }
+
+
+def bench_fixture(path: Path, repeat: int, upstream: bool) -> dict:
+    samples = defaultdict(list)
+    counts = {}
+    for _ in range(repeat):
+        timings, counts = run_stages(path, upstream)
+        for stage, seconds in timings.items():
+            samples[stage].append(seconds)
+
+    params_path = path.with_suffix(".json")
+    return {
+        "fixture": path.stem,
+        "params": json.loads(params_path.read_text()) if params_path.exists() else None,
+        "size_bytes": path.stat().st_size,
+        "counts": counts,
+        "stages": {stage: summarize(values) for stage, values in samples.items()},
+        "peak_traced_bytes": peak_memory(path),
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="+", type=Path, help="DOCX fixture'lar")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=Path, help="natija JSON (default: bench/results/<commit>.json)")
+    parser.add_argument("--upstream", help="stub o'rniga shu QUESTIONS_API_URL ga yuborish")
+    args = parser.parse_args(argv)
+
+    if args.upstream:
+        main.QUESTIONS_API_URL = args.upstream
+
+    revision = _git_revision()
+    results = []
+    for path in args.fixtures:
+        result = bench_fixture(path, max(1, args.repeat), bool(args.upstream))
+        medians = ", ".join(f"{k}={v['median'] * 1000:.1f}ms" for k, v in result["stages"].items())
+        print(f"⏱️ {path.stem}: {medians}, peak={result['peak_traced_bytes'] / 1024 / 1024:.1f} MB")
+        results.append(result)
+
+    report = {
+        "meta": {
+            **revision,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "settings": {key: getattr(main, key) for key in SETTINGS_KEYS},
+            "max_rss_kb": max_rss_kb(),
+        },
+        "results": results,
+    }
+    out = args.out or ROOT / "bench" / "results" / f"{(revision['commit'] or 'unknown')[:12]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"📄 Natija: {out}")
+
+
+if __name__ == "__main__":
+    main_cli()
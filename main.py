@@ -1,21 +1,113 @@
-from fastapi import FastAPI, UploadFile, File, Request, Form
-from fastapi.responses import JSONResponse, HTMLResponse
+from __future__ import annotations
+
+import time
+
+# Ishga tushish bosqichlari vaqti uchun (modul importi ham bosqich sifatida hisoblanadi)
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from docx import Document
+from python_multipart.multipart import MultipartParser, parse_options_header
 import base64
 import io
 import zipfile
-import re
 import os
-import httpx
-from typing import Optional, List
+import sys
+import logging
+import importlib
+from typing import Optional, List, Callable, Awaitable, Collection, Iterable, Iterator
 from pathlib import Path
 import uuid
+import math
 import shutil
-from PIL import Image
+import hashlib
+import mmap
+import json
+import zlib
+import random
+import sqlite3
+import asyncio
+import threading
+import concurrent.futures
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from xml.etree import ElementTree
+from lxml import etree
+
+
+class _LazyModule:
+    """Og'ir modul proksisi: modul birinchi atributga murojaat qilinganda import qilinadi.
+
+    STARTUP_MODE=lazy da ilova (va health check) bu modullarni yuklamasdan
+    ishga tushadi; STARTUP_MODE=warm da ular lifespan'da oldindan yuklanadi.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+
+docx = _LazyModule("docx")
+httpx = _LazyModule("httpx")
+Image = _LazyModule("PIL.Image")
+ImageOps = _LazyModule("PIL.ImageOps")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ilova hayot sikli: outbox drainer'ni (STARTUP_MODE=warm da parser'lar, upstream pool
+    va katalogni ham) tayyorlash, to'xtashda yopish. Har bir bosqich vaqti ``startup_phases`` da.
+    """
+    started = time.perf_counter()
+    startup_phases["import"] = started - _IMPORT_STARTED
+    with startup_phase("dirs"):
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        cleanup_spool_dir()
+    drainer = None
+    if outbox is not None:
+        with startup_phase("outbox"):
+            await asyncio.to_thread(outbox.init)
+        drainer = asyncio.create_task(outbox.run_drainer())
+    with startup_phase("jobs"):
+        await asyncio.to_thread(job_store.init)
+    if STARTUP_MODE == "warm":
+        await warm_up()
+    startup_phases["startup"] = time.perf_counter() - started
+    logger.info(
+        f"🚀 Ishga tushdi (STARTUP_MODE={STARTUP_MODE}): "
+        + ", ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in startup_phases.items())
+    )
+    try:
+        yield
+    finally:
+        if drainer is not None:
+            drainer.cancel()
+            try:
+                await drainer
+            except asyncio.CancelledError:
+                pass
+        await close_http_client()
+        shutdown_parse_pool()
 
-app = FastAPI(title="MilliyTest DOCX Parser API (Stable)")
+
+app = FastAPI(title="MilliyTest DOCX Parser API (Stable)", lifespan=lifespan)
 
 # CORS sozlamasi
 app.add_middleware(
@@ -34,9 +126,360 @@ templates = Jinja2Templates(directory="templates")
 API_URL = os.getenv("API_URL", "https://reyting.ideal-study.uz/api/public/tests")
 QUESTIONS_API_URL = os.getenv("QUESTIONS_API_URL", "https://reyting.ideal-study.uz/api/questions")
 
+# Upstream HTTP pool sozlamalari (barcha so'rovlar uchun bitta umumiy client)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "10"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "0").lower() in ("1", "true", "yes")
+UPSTREAM_VERIFY_SSL = os.getenv("UPSTREAM_VERIFY_SSL", "1").lower() in ("1", "true", "yes")
+
+# Timeout profillari: arzon metadata GET'lar va katta savollar POST'i
+METADATA_TIMEOUT = float(os.getenv("UPSTREAM_METADATA_TIMEOUT", "10"))
+# (connect, read, write, pool) — httpx.Timeout(SUBMIT, connect=10) bilan bir xil
+_SUBMIT_TIMEOUT = float(os.getenv("UPSTREAM_SUBMIT_TIMEOUT", "120"))
+SUBMIT_TIMEOUT = (10.0, _SUBMIT_TIMEOUT, _SUBMIT_TIMEOUT, _SUBMIT_TIMEOUT)
+
+# Ishga tushish: "lazy" — docx/Pillow/httpx birinchi kerak bo'lganda yuklanadi (tez start),
+# "warm" — lifespan'da parse worker'lari tayyorlanadi, upstream pool ochiladi va katalog
+# olinadi. STARTUP_WARM_TIMEOUT (s) dan keyin tayyorlash fonda davom etadi, start kutmaydi
+STARTUP_MODE = os.getenv("STARTUP_MODE", "warm").lower()
+STARTUP_WARM_TIMEOUT = float(os.getenv("STARTUP_WARM_TIMEOUT", "30"))
+
+# Savollarni yuborish: bo'lak chegaralari (savollar soni / JSON baytlari, 0 — cheklovsiz),
+# gzip siqish va vaqtinchalik xatoliklarda exponential backoff bilan qayta urinishlar
+SUBMIT_BATCH_QUESTIONS = int(os.getenv("SUBMIT_BATCH_QUESTIONS", "0"))
+SUBMIT_BATCH_BYTES = int(os.getenv("SUBMIT_BATCH_BYTES", "0"))
+SUBMIT_GZIP = os.getenv("SUBMIT_GZIP", "0").lower() in ("1", "true", "yes")
+SUBMIT_GZIP_LEVEL = int(os.getenv("SUBMIT_GZIP_LEVEL", "6"))
+SUBMIT_RETRIES = int(os.getenv("SUBMIT_RETRIES", "3"))
+SUBMIT_BACKOFF = float(os.getenv("SUBMIT_BACKOFF", "1"))
+SUBMIT_BACKOFF_MAX = float(os.getenv("SUBMIT_BACKOFF_MAX", "30"))
+SUBMIT_RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# Testlar katalogi keshi: TTL ichida yangi, STALE_TTL ichida eskisi qaytariladi va fonda yangilanadi
+CATALOGUE_TTL = float(os.getenv("CATALOGUE_TTL", "60"))
+CATALOGUE_STALE_TTL = float(os.getenv("CATALOGUE_STALE_TTL", "600"))
+CATALOGUE_CACHE_BYTES = int(os.getenv("CATALOGUE_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+# Rasmlarni payload'da yuborish usuli: "inline" — har bir savolda to'liq data URI
+# (eski upstream uchun), "dedup" — savollarda digest, rasmlar alohida "images" jadvalida
+PAYLOAD_IMAGE_MODE = os.getenv("PAYLOAD_IMAGE_MODE", "inline").lower()
+
+# Rasm normalizatsiyasi: IMAGE_MAX_DIM — eng katta tomon (px, 0 — cheklovsiz),
+# IMAGE_FORMAT — webp/jpeg/png (bo'sh — asl format), IMAGE_QUALITY — webp/jpeg sifati
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "0"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_STRIP_METADATA = os.getenv("IMAGE_STRIP_METADATA", "0").lower() in ("1", "true", "yes")
+IMAGE_SETTINGS = (IMAGE_MAX_DIM, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_STRIP_METADATA)
+# Tayyorlangan rasmlar keshining chegarasi (baytlarda)
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Parse natijasi formatini o'zgartiruvchi har qanday o'zgarishda oshiriladi (eski kesh yozuvlari bekor bo'ladi)
+PARSER_VERSION = "1"
+
+# Parse engine: "docx" — python-docx obyekt modeli, "stream" — lxml iterparse (natija bir xil)
+PARSE_ENGINE = os.getenv("PARSE_ENGINE", "docx").lower()
+
+# Parse process pool sozlamalari (0 — alohida process'siz, thread'da ishlash)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", "300"))
+
+# /parse-docx/ da bir vaqtda qayta ishlanadigan fayllar soni
+FILE_CONCURRENCY = int(os.getenv("FILE_CONCURRENCY", "4"))
+
+# Admission: bir vaqtdagi parse'lar soni va ularning taxminiy xotirasi (0 — cheklovsiz) byudjeti,
+# navbat chegaralari (umumiy va bitta mijoz uchun). Xotira taxmini: fayl + XML × XML_FACTOR + media × MEDIA_FACTOR
+ADMISSION_MAX_RUNNING = int(os.getenv("ADMISSION_MAX_RUNNING", str(max(1, PARSE_WORKERS))))
+ADMISSION_MEMORY_BYTES = int(os.getenv("ADMISSION_MEMORY_BYTES", str(1024 * 1024 * 1024)))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "64"))
+ADMISSION_MAX_QUEUED_PER_CLIENT = int(os.getenv("ADMISSION_MAX_QUEUED_PER_CLIENT", "16"))
+ADMISSION_XML_FACTOR = int(os.getenv("ADMISSION_XML_FACTOR", "12"))
+ADMISSION_MEDIA_FACTOR = int(os.getenv("ADMISSION_MEDIA_FACTOR", "6"))
+ADMISSION_TRUST_FORWARDED = os.getenv("ADMISSION_TRUST_FORWARDED", "0").lower() in ("1", "true", "yes")
+
+# Fon ishlari (/jobs/...): bir vaqtda bajariladigan ishlar soni, tugagan natijani saqlash muddati (s) va soni
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "2"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", "200"))
+# Ishlar holati va hodisalari SQLite'da — boshqa uvicorn worker'iga tushgan GET /jobs/{id}
+# va SSE so'rovlari ham ishni ko'radi (SSE u yerda JOB_POLL_INTERVAL bilan so'raydi)
+JOB_STORE_PATH = Path(os.getenv("JOB_STORE_PATH", "uploads/jobs.sqlite3"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
 # Rasmlar uchun vaqtinchalik papka
 UPLOAD_DIR = Path("uploads/images")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# Yuklangan fayllar diskka spool qilinadigan papka va hajm chegaralari
+SPOOL_DIR = Path("uploads/tmp")
+SPOOL_CHUNK_BYTES = 1024 * 1024
+# Ishga tushishda faqat shundan eski spool fayllar o'chiriladi — SPOOL_DIR barcha
+# worker'lar uchun umumiy, yangi fayllar boshqa worker'ning ishlanayotgan yuklamalari
+SPOOL_STALE_AFTER = float(os.getenv("SPOOL_STALE_AFTER", "86400"))
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(100 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(500 * 1024 * 1024)))
+# ZIP arxiv (/parse-docx-zip/): arxiv hajmi va undagi DOCX fayllar soni chegarasi
+ZIP_MAX_ARCHIVE_BYTES = int(os.getenv("ZIP_MAX_ARCHIVE_BYTES", str(MAX_UPLOAD_REQUEST_BYTES)))
+ZIP_MAX_MEMBERS = int(os.getenv("ZIP_MAX_MEMBERS", "2000"))
+
+# Parse natijalari keshi: xotira (LRU) va umumiy qatlam (CACHE_BACKEND) chegaralari
+DOC_CACHE_BYTES = int(os.getenv("DOC_CACHE_BYTES", str(128 * 1024 * 1024)))
+DOC_CACHE_DISK = os.getenv("DOC_CACHE_DISK", "0").lower() in ("1", "true", "yes")
+DOC_CACHE_SHARED_BYTES = int(os.getenv("DOC_CACHE_SHARED_BYTES", os.getenv("DOC_CACHE_DISK_BYTES", str(1024 * 1024 * 1024))))
+
+# Keshlar qatlami (katalog, parse natijalari, tayyor rasmlar, preview rasmlari):
+# "memory" — har bir process'da alohida, "sqlite" — CACHE_PATH dagi SQLite (WAL),
+# "disk" — CACHE_PATH papkasidagi fayllar; oxirgi ikkisi barcha worker'lar uchun umumiy.
+# DOC_CACHE_DISK=1 — eski sozlama, "disk" bilan bir xil
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "disk" if DOC_CACHE_DISK else "memory").lower()
+CACHE_PATH = Path(os.getenv("CACHE_PATH", "uploads/cache.sqlite3" if CACHE_BACKEND == "sqlite" else "uploads/cache"))
+# Tayyor rasmlar keshi alohida qatlamda bo'lishi mumkin; default'da u doim saqlanuvchi (sqlite):
+# savol banklari bir xil rasmlarni ko'p hujjatlarda ishlatadi, parse worker'lari esa
+# qayta ishga tushadi. IMAGE_CACHE_BACKEND=memory — har bir parse process'ida alohida
+IMAGE_CACHE_BACKEND = os.getenv("IMAGE_CACHE_BACKEND", "sqlite" if CACHE_BACKEND == "memory" else CACHE_BACKEND).lower()
+
+# /preview-docx/: bir vaqtda ishlaydigan preview'lar soni va preview rasmlari keshi (baytlarda)
+PREVIEW_CONCURRENCY = int(os.getenv("PREVIEW_CONCURRENCY", "2"))
+PREVIEW_IMAGE_CACHE_BYTES = int(os.getenv("PREVIEW_IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Preview rasmlari GET /preview/images/{digest} orqali olinadi — bu so'rov boshqa uvicorn
+# worker'iga tushishi mumkin, shuning uchun qatlam umumiy bo'lishi shart (default — sqlite).
+# PREVIEW_CACHE_BACKEND=memory faqat bitta worker'da (WEB_CONCURRENCY <= 1) qabul qilinadi
+PREVIEW_CACHE_BACKEND = os.getenv("PREVIEW_CACHE_BACKEND", "sqlite" if CACHE_BACKEND == "memory" else CACHE_BACKEND).lower()
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Outbox: payload'lar yuborishdan oldin SQLite'ga yoziladi, yuborilmaganlari fonda
+# OUTBOX_DRAIN_RATE (payload/s) tezligida, OUTBOX_RETRY_BACKOFF dan boshlab oshib boruvchi
+# oraliqlarda qayta yuboriladi. OUTBOX_LEASE — yozuvni egallab turish muddati (s)
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1").lower() in ("1", "true", "yes")
+OUTBOX_PATH = Path(os.getenv("OUTBOX_PATH", "uploads/outbox.sqlite3"))
+OUTBOX_DRAIN_RATE = float(os.getenv("OUTBOX_DRAIN_RATE", "1"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_RETRY_BACKOFF = float(os.getenv("OUTBOX_RETRY_BACKOFF", "30"))
+OUTBOX_RETRY_BACKOFF_MAX = float(os.getenv("OUTBOX_RETRY_BACKOFF_MAX", "3600"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "50"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "900"))
+# "failed" yozuvlar (payload'lari bilan) shuncha soniyadan keyin drainer tomonidan o'chiriladi (0 — saqlanadi)
+OUTBOX_FAILED_RETENTION = float(os.getenv("OUTBOX_FAILED_RETENTION", str(7 * 24 * 3600)))
+
+
+# Log darajasi: DEBUG — har bir rasm/javob bo'yicha xabarlar ham chiqadi, production uchun INFO yoki WARNING
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("docx_api")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class Counter:
+    """Prometheus counter (label'lar bilan)."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Histogram:
+    """Prometheus histogram: kumulyativ bucket'lar, _sum va _count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels → [bucket hisoblari..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self):
+        for labels, state in self._values.items():
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket", labels + (("le", f"{bound:g}"),), count
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), state[-1]
+            yield f"{self.name}_sum", labels, state[-2]
+            yield f"{self.name}_count", labels, state[-1]
+
+
+class StatsCollector:
+    """Mavjud ``stats`` lug'atlarini (kesh hisoblagichlari) scrape vaqtida o'qish."""
+
+    def __init__(self, name: str, help_text: str, metric_type: str, collect: Callable[[], list]):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self._collect = collect
+
+    def samples(self):
+        for labels, value in self._collect():
+            yield self.name, tuple(sorted(labels.items())), value
+
+
+class MetricsRegistry:
+    """Prometheus text formatidagi metrikalar (event loop ichida yangilanadi)."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "docx_api_stage_seconds",
+    "Pipeline bosqichlari davomiyligi (load, table_walk, image, image_prepare, parse, serialize, compress)",
+    LATENCY_BUCKETS,
+)
+UPSTREAM_SECONDS = metrics.histogram(
+    "docx_api_upstream_request_seconds", "Upstream POST so'rovlari davomiyligi", LATENCY_BUCKETS
+)
+UPSTREAM_RESPONSES = metrics.counter(
+    "docx_api_upstream_responses_total", "Upstream POST javoblari (status kodi yoki 'error')"
+)
+UPSTREAM_RETRIES = metrics.counter("docx_api_upstream_retries_total", "Upstream POST qayta urinishlari")
+QUESTIONS_PER_FILE = metrics.histogram(
+    "docx_api_questions_per_file", "Bitta fayldan olingan savollar soni", (1, 10, 25, 50, 100, 250, 500, 1000, 5000)
+)
+IMAGE_CACHE_EVENTS = metrics.counter("docx_api_image_cache_total", "Tayyor rasmlar keshi (event: hit/miss)")
+IMAGE_CACHE_SAVED = metrics.counter(
+    "docx_api_image_cache_saved_bytes_total", "Kesh hit tufayli qayta ishlanmagan xom media hajmi"
+)
+IMAGE_BYTES = metrics.counter("docx_api_image_bytes_total", "Parse qilingan hujjatlardagi tayyor rasmlar hajmi (data URI)")
+PAYLOAD_BYTES = metrics.histogram("docx_api_payload_bytes", "Upstream'ga yuborilgan bo'lak tanasi hajmi", SIZE_BUCKETS)
+ADMISSION_WAIT = metrics.histogram(
+    "docx_api_admission_wait_seconds", "Parse uchun navbatda kutish vaqti", LATENCY_BUCKETS + (300, 600)
+)
+ADMISSION_REJECTED = metrics.counter("docx_api_admission_rejected_total", "Navbat to'lgani uchun 429 bilan rad etilgan so'rovlar")
+FILES_TOTAL = metrics.counter("docx_api_files_total", "Qayta ishlangan fayllar (result: success/failed/queued/rejected)")
+
+_stage_samples: ContextVar[Optional[dict]] = ContextVar("_stage_samples", default=None)
+
+
+@contextmanager
+def timed_stage(name: str):
+    """Parse bosqichi vaqtini joriy o'lchov to'plamiga yozish (to'plam yo'q bo'lsa — hech narsa)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples = _stage_samples.get()
+        if samples is not None:
+            samples.setdefault(name, []).append(time.perf_counter() - started)
+
+
+# Ishga tushish bosqichlari → soniyalar (/health va /metrics da)
+startup_phases = {}
+
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = time.perf_counter() - started
+
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def open_http_client() -> httpx.AsyncClient:
+    """Umumiy upstream client'ni yaratish (keep-alive pool, ixtiyoriy HTTP/2)."""
+    global _http_client
+    if _http_client is not None:
+        return _http_client
+
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401 — httpx HTTP/2 uchun "h2" paketini talab qiladi
+        except ImportError:
+            logger.warning("⚠️ UPSTREAM_HTTP2 yoqilgan, lekin 'h2' o'rnatilmagan — HTTP/1.1 ishlatiladi")
+            http2 = False
+
+    _http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=METADATA_TIMEOUT,
+        http2=http2,
+        verify=UPSTREAM_VERIFY_SSL,
+    )
+    return _http_client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Umumiy upstream client (lifespan tashqarisida chaqirilsa — shu yerda ochiladi)."""
+    return _http_client or open_http_client()
+
+
+async def close_http_client():
+    """Umumiy client'ni yopish (ilova to'xtaganda)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -45,65 +488,543 @@ async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "api_url": API_URL})
 
 
+class LRUBytesCache:
+    """Umumiy hajmi (baytlarda) bilan chegaralangan LRU kesh.
+
+    Thread-safe: memory backend'dagi image_cache'ga bir vaqtda bir nechta parse
+    thread'idan (PARSE_WORKERS=0) murojaat qilinadi.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[0]
+
+    def put(self, key, value, nbytes: int):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, old_bytes) = self._items.popitem(last=False)
+                self.size -= old_bytes
+                self.stats["evictions"] += 1
+
+
+class CacheBackend(ABC):
+    """Kesh qatlami interfeysi: ``get(key)`` → bytes yoki None, ``set(key, value)``.
+
+    ``shared`` qatlamlar boshqa process'lar (uvicorn worker'lar, parse pool)
+    bilan umumiy va diskka murojaat qiladi — async koddan ``cache_get``/``cache_set``
+    orqali chaqiriladi. Qatlam xatoliklari kesh miss sifatida qaytadi.
+    """
+
+    shared = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes):
+        ...
+
+
+class MemoryCacheBackend(LRUBytesCache, CacheBackend):
+    """Process ichidagi LRU (har bir worker'da alohida)."""
+
+    def set(self, key: str, value: bytes):
+        self.put(key, value, len(value))
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Process'lar orasida umumiy kesh: SQLite (WAL), ``namespace`` bo'yicha hajm chegarasi (LRU).
+
+    Har bir thread o'z ulanishini ishlatadi. ``accessed_at`` har o'qishda emas,
+    TOUCH_INTERVAL dan keyin yangilanadi — o'qishlar yozish qulfini talab qilmaydi.
+    """
+
+    shared = True
+    TOUCH_INTERVAL = 60.0
+    EVICT_BATCH = 64
+
+    def __init__(self, path: Path, namespace: str, max_bytes: int):
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at);
+                CREATE TABLE IF NOT EXISTS cache_usage (
+                    namespace TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _failed(self, action: str, error: Exception):
+        self.stats["errors"] += 1
+        logger.warning(f"⚠️ Kesh ({self.namespace}) {action}da xatolik: {error}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, accessed_at FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            now = time.time()
+            if now - row[1] > self.TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key)
+                )
+        except sqlite3.Error as e:
+            self._failed("o'qish", e)
+            return None
+        self.stats["hits"] += 1
+        return row[0]
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        conn = None
+        try:
+            conn = self._connect()
+            # Yozuv va hajm hisobi bitta tranzaksiyada — boshqa process'lar bilan poyga bo'lmaydi
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT size FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, value, len(value), time.time()),
+            )
+            usage = conn.execute(
+                "SELECT bytes FROM cache_usage WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            total = (usage[0] if usage else 0) + len(value) - (row[0] if row else 0)
+            while total > self.max_bytes:
+                oldest = conn.execute(
+                    "SELECT key, size FROM cache WHERE namespace = ? AND key != ? ORDER BY accessed_at LIMIT ?",
+                    (self.namespace, key, self.EVICT_BATCH),
+                ).fetchall()
+                if not oldest:
+                    break
+                for old_key, size in oldest:
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, old_key))
+                    total -= size
+                    self.stats["evictions"] += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_usage (namespace, bytes) VALUES (?, ?)", (self.namespace, total)
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn is not None and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self._failed("yozish", e)
+
+
+class DiskCacheBackend(CacheBackend):
+    """Process'lar orasida umumiy kesh: papkadagi fayllar (atomar yozish), hajm chegarasi (mtime bo'yicha LRU).
+
+    Band hajm jarayon ichida taxminan hisoblanadi; chegaraga yetganda papka
+    qayta sanaladi (boshqa process'lar yozganlari ham) va eng eskilari o'chiriladi.
+    """
+
+    shared = True
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha256(key.encode()).hexdigest()}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            value = path.read_bytes()
+            os.utime(path)  # LRU uchun oxirgi foydalanish vaqti
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.warning(f"⚠️ Disk keshini o'qishda xatolik ({path.name}): {e}")
+            return None
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)  # atomar — yarim yozilgan fayl o'qilmaydi
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.warning(f"⚠️ Disk keshiga yozishda xatolik: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        if self._size is None or self._size + len(value) > self.max_bytes:
+            self._evict()
+        else:
+            self._size += len(value)
+
+    def _evict(self):
+        """Papka hajmi chegaradan oshsa, eng kam ishlatilgan fayllarni o'chirish."""
+        entries = []
+        total = 0
+        for path in self.directory.glob("*.bin"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+                self.stats["evictions"] += 1
+            except FileNotFoundError:
+                pass
+        self._size = total
+
+
+def open_cache_backend(namespace: str, max_bytes: int, backend: Optional[str] = None) -> CacheBackend:
+    """``backend`` (default — CACHE_BACKEND) bo'yicha ``namespace`` uchun kesh qatlami.
+
+    CACHE_PATH CACHE_BACKEND uchun; boshqa turdagi qatlam standart yo'lda ochiladi.
+    """
+    backend = backend or CACHE_BACKEND
+    if backend == "sqlite":
+        path = CACHE_PATH if CACHE_BACKEND == "sqlite" else Path("uploads/cache.sqlite3")
+        return SQLiteCacheBackend(path, namespace, max_bytes)
+    if backend == "disk":
+        path = CACHE_PATH if CACHE_BACKEND == "disk" else Path("uploads/cache")
+        return DiskCacheBackend(path / namespace, max_bytes)
+    return MemoryCacheBackend(max_bytes)
+
+
+def open_shared_cache_backend(namespace: str, max_bytes: int) -> Optional[CacheBackend]:
+    """Umumiy qatlam (CACHE_BACKEND=memory bo'lsa None — process ichidagi kesh yetarli)."""
+    backend = open_cache_backend(namespace, max_bytes)
+    return backend if backend.shared else None
+
+
+async def cache_get(backend: CacheBackend, key: str) -> Optional[bytes]:
+    if backend.shared:
+        return await asyncio.to_thread(backend.get, key)
+    return backend.get(key)
+
+
+async def cache_set(backend: CacheBackend, key: str, value: bytes):
+    if backend.shared:
+        await asyncio.to_thread(backend.set, key, value)
+    else:
+        backend.set(key, value)
+
+
+class TestsCatalogue:
+    """API_URL katalogi uchun kesh (TTL + stale-while-revalidate).
+
+    Bir vaqtda kelgan kesh miss'lar bitta upstream so'rovini bo'lishadi,
+    testlar esa id bo'yicha lug'atda saqlanadi (O(1) qidirish). ``shared``
+    qatlam bo'lsa, bir worker olgan katalog qolganlariga ham yetib boradi.
+    """
+
+    SHARED_KEY = "tests"
+
+    def __init__(self, ttl: float, stale_ttl: float, shared: Optional[CacheBackend] = None):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.shared = shared
+        self._tests = None
+        self._by_id = {}
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self.stats = {
+            "hits": 0, "shared_hits": 0, "stale_hits": 0, "misses": 0,
+            "coalesced": 0, "refreshes": 0, "refresh_errors": 0,
+        }
+
+    def _set_tests(self, tests: list, fetched_at: float):
+        self._tests = tests
+        self._by_id = {t.get("id"): t for t in tests}
+        self._fetched_at = fetched_at
+
+    async def _fetch(self):
+        """Katalogni upstream dan olib, keshni yangilash."""
+        client = get_http_client()
+        response = await client.get(API_URL, timeout=METADATA_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+
+        self.stats["refreshes"] += 1
+        if not (data.get("success") and data.get("data")):
+            # Bo'sh javob keshlanmaydi
+            return None
+
+        tests = data["data"]
+        self._set_tests(tests, time.time())
+        if self.shared is not None:
+            await cache_set(self.shared, self.SHARED_KEY, json.dumps({"fetched_at": self._fetched_at, "tests": tests}).encode())
+        return tests
+
+    async def _load_shared(self) -> bool:
+        """Boshqa worker olgan katalogni umumiy qatlamdan olish (mahalliysidan yangiroq bo'lsa)."""
+        raw = await cache_get(self.shared, self.SHARED_KEY)
+        if raw is None:
+            return False
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return False
+        if data["fetched_at"] <= self._fetched_at:
+            return False
+        self._set_tests(data["tests"], data["fetched_at"])
+        return True
+
+    def _start_fetch(self) -> asyncio.Task:
+        """Upstream so'rovini boshlash (allaqachon ketayotgan bo'lsa — o'shani qaytarish)."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._fetch())
+        return self._inflight
+
+    def _on_background_done(self, task: asyncio.Task):
+        """Fondagi yangilash xatoligini qayd qilish (so'rovga ta'sir qilmaydi)."""
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["refresh_errors"] += 1
+            logger.warning(f"⚠️ Katalogni fonda yangilashda xatolik: {task.exception()}")
+
+    async def get_tests(self) -> Optional[list]:
+        """Testlar ro'yxati (upstream ``data`` massivi) yoki ma'lumot bo'lmasa None."""
+        age = time.time() - self._fetched_at
+        if self._tests is not None and age < self.ttl:
+            self.stats["hits"] += 1
+            return self._tests
+
+        if self.shared is not None and (self._inflight is None or self._inflight.done()) and await self._load_shared():
+            age = time.time() - self._fetched_at
+            if age < self.ttl:
+                self.stats["shared_hits"] += 1
+                return self._tests
+
+        if self._tests is not None and age < self.stale_ttl:
+            # Eskirgan nusxani darhol qaytarib, fonda yangilash
+            self.stats["stale_hits"] += 1
+            if self._inflight is None or self._inflight.done():
+                self._start_fetch().add_done_callback(self._on_background_done)
+            return self._tests
+
+        self.stats["misses"] += 1
+        if self._inflight is not None and not self._inflight.done():
+            self.stats["coalesced"] += 1
+        # shield — so'rov bekor qilinsa ham umumiy fetch boshqalar uchun davom etadi
+        return await asyncio.shield(self._start_fetch())
+
+    async def get_test(self, test_id: int) -> tuple:
+        """(katalog mavjudmi, test yoki None)."""
+        tests = await self.get_tests()
+        if tests is None:
+            return False, None
+        return True, self._by_id.get(test_id)
+
+
+tests_catalogue = TestsCatalogue(
+    CATALOGUE_TTL, CATALOGUE_STALE_TTL, open_shared_cache_backend("catalogue", CATALOGUE_CACHE_BYTES)
+)
+
+
 @app.get("/api/tests")
 async def get_tests():
-    """Barcha testlarni API dan olish."""
+    """Barcha testlarni (keshlangan) katalogdan olish."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(API_URL, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
+        data = await tests_catalogue.get_tests()
+        
+        if data:
+            # Testlarni qaytarish (faqat id va name)
+            tests = [{"id": test.get("id"), "name": test.get("name")} for test in data]
+            return JSONResponse({
+                "success": True,
+                "tests": tests
+            })
+        else:
+            return JSONResponse({"success": False, "error": "Ma'lumot topilmadi"}, status_code=404)
             
-            if data.get("success") and data.get("data"):
-                # Testlarni qaytarish (faqat id va name)
-                tests = [{"id": test.get("id"), "name": test.get("name")} for test in data["data"]]
-                return JSONResponse({
-                    "success": True,
-                    "tests": tests
-                })
-            else:
-                return JSONResponse({"success": False, "error": "Ma'lumot topilmadi"}, status_code=404)
-                
     except httpx.HTTPError as e:
-        print(f"❌ API xatolik: {e}")
+        logger.error(f"❌ API xatolik: {e}")
         return JSONResponse({"success": False, "error": f"API ga ulanishda xatolik: {str(e)}"}, status_code=500)
     except Exception as e:
-        print(f"❌ Umumiy xatolik: {e}")
+        logger.error(f"❌ Umumiy xatolik: {e}")
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
 
 @app.get("/api/test-data/{test_id}")
 async def get_test_data(test_id: int):
-    """Tanlangan test ma'lumotlarini API dan olish."""
+    """Tanlangan test ma'lumotlarini (keshlangan) katalogdan olish."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(API_URL, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get("success") and data.get("data"):
-                # Tanlangan testni topish
-                test = next((t for t in data["data"] if t.get("id") == test_id), None)
-                
-                if test:
-                    # Fanlar va sinflarni qaytarish
-                    return JSONResponse({
-                        "success": True,
-                        "subjects": test.get("subjects", []),
-                        "grades": test.get("grades", [])
-                    })
-                else:
-                    return JSONResponse({"success": False, "error": "Test topilmadi"}, status_code=404)
+        found, test = await tests_catalogue.get_test(test_id)
+        
+        if found:
+            if test:
+                # Fanlar va sinflarni qaytarish
+                return JSONResponse({
+                    "success": True,
+                    "subjects": test.get("subjects", []),
+                    "grades": test.get("grades", [])
+                })
             else:
-                return JSONResponse({"success": False, "error": "Ma'lumot topilmadi"}, status_code=404)
-                
+                return JSONResponse({"success": False, "error": "Test topilmadi"}, status_code=404)
+        else:
+            return JSONResponse({"success": False, "error": "Ma'lumot topilmadi"}, status_code=404)
+            
     except httpx.HTTPError as e:
-        print(f"❌ API xatolik: {e}")
+        logger.error(f"❌ API xatolik: {e}")
         return JSONResponse({"success": False, "error": f"API ga ulanishda xatolik: {str(e)}"}, status_code=500)
     except Exception as e:
-        print(f"❌ Umumiy xatolik: {e}")
+        logger.error(f"❌ Umumiy xatolik: {e}")
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
+
+def _hit_ratio(stats: dict) -> Optional[float]:
+    lookups = stats["hits"] + stats["misses"]
+    return round(stats["hits"] / lookups, 4) if lookups else None
+
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """Kesh hit/miss hisoblagichlari."""
+    return JSONResponse({
+        "success": True,
+        "backend": CACHE_BACKEND,
+        "images_backend": IMAGE_CACHE_BACKEND,
+        "preview_backend": PREVIEW_CACHE_BACKEND,
+        "catalogue": tests_catalogue.stats,
+        "documents": document_cache.stats,
+        "documents_shared": document_cache.shared.stats if document_cache.shared is not None else None,
+        "images": {**image_cache_totals, "hit_ratio": _hit_ratio(image_cache_totals)},
+        "preview_images": preview_images.stats,
+    })
+
+@app.get("/api/admission")
+async def get_admission():
+    """Admission navbati: ishlayotganlar, band xotira va mijozlar bo'yicha navbat."""
+    return JSONResponse({"success": True, **admission.snapshot()})
+
+
+def _stats_samples(stats: Optional[dict]) -> list:
+    return [({"event": event}, value) for event, value in (stats or {}).items()]
+
+
+def _job_status_samples() -> list:
+    counts = {}
+    for job in job_manager._jobs.values():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    return [({"status": status}, count) for status, count in counts.items()]
+
+
+metrics.register(StatsCollector(
+    "docx_api_catalogue_cache_total", "Testlar katalogi keshi hodisalari", "counter",
+    lambda: _stats_samples(tests_catalogue.stats),
+))
+metrics.register(StatsCollector(
+    "docx_api_document_cache_total", "Parse natijalari keshi hodisalari", "counter",
+    lambda: _stats_samples(document_cache.stats),
+))
+metrics.register(StatsCollector(
+    "docx_api_outbox_total", "Outbox hodisalari (queued/sent/deferred/failed)", "counter",
+    lambda: _stats_samples(outbox.stats if outbox is not None else None),
+))
+metrics.register(StatsCollector(
+    "docx_api_jobs", "Xotiradagi fon ishlari holati bo'yicha", "gauge", _job_status_samples,
+))
+metrics.register(StatsCollector(
+    "docx_api_admission_queue_depth", "Parse uchun navbatda kutayotgan fayllar", "gauge",
+    lambda: [({}, admission.queued)],
+))
+metrics.register(StatsCollector(
+    "docx_api_admission_running", "Byudjet ostida ishlayotgan parse'lar", "gauge",
+    lambda: [({}, admission.running)],
+))
+metrics.register(StatsCollector(
+    "docx_api_admission_memory_bytes", "Ishlayotgan parse'larning taxminiy xotirasi", "gauge",
+    lambda: [({}, admission.memory_in_use)],
+))
+
+
+metrics.register(StatsCollector(
+    "docx_api_startup_seconds", "Ishga tushish bosqichlari davomiyligi", "gauge",
+    lambda: [({"phase": phase}, seconds) for phase, seconds in startup_phases.items()],
+))
+
+
+@app.get("/health")
+async def health():
+    """Health check: ilova ishlayapti; ishga tushish rejimi va bosqichlari vaqti bilan."""
+    return JSONResponse({
+        "success": True,
+        "status": "ok",
+        "startup_mode": STARTUP_MODE,
+        "startup": {phase: round(seconds, 4) for phase, seconds in startup_phases.items()},
+    })
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text formatidagi metrikalar."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 def safe_read_zip(zf, path):
     """Zip ichidan faylni xavfsiz o‘qish (mavjud bo‘lmasa None)."""
     try:
@@ -112,60 +1033,20 @@ def safe_read_zip(zf, path):
         return None
 
 
-def extract_crop_info(run_element):
-    """Rasm elementidan crop ma'lumotlarini olish."""
-    crop_info = None
-    try:
-        # a:srcRect elementini topish (crop ma'lumotlari)
-        # Bir nechta joylarda qidirish
-        src_rect = None
-        
-        # 1. To'g'ridan-to'g'ri a:srcRect
-        src_rect = run_element.find(
-            ".//{http://schemas.openxmlformats.org/drawingml/2006/main}srcRect"
-        )
-        
-        # 2. Agar topilmasa, a:blip ichida qidirish
-        if src_rect is None:
-            blip = run_element.find(
-                ".//{http://schemas.openxmlformats.org/drawingml/2006/main}blip"
-            )
-            if blip is not None:
-                # a:blip parent elementida qidirish
-                parent = blip.getparent()
-                if parent is not None:
-                    src_rect = parent.find(
-                        ".//{http://schemas.openxmlformats.org/drawingml/2006/main}srcRect"
-                    )
-        
-        # 3. Agar hali ham topilmasa, a:pic ichida qidirish
-        if src_rect is None:
-            pic = run_element.find(
-                ".//{http://schemas.openxmlformats.org/drawingml/2006/picture}pic"
-            )
-            if pic is not None:
-                src_rect = pic.find(
-                    ".//{http://schemas.openxmlformats.org/drawingml/2006/main}srcRect"
-                )
-        
-        if src_rect is not None:
-            # Crop koordinatalari (EMU - English Metric Units)
-            # 0-100000 aralig'ida, bu foiz sifatida ishlaydi
-            l = float(src_rect.get("l", "0")) / 100000.0  # left
-            t = float(src_rect.get("t", "0")) / 100000.0  # top
-            r = float(src_rect.get("r", "0")) / 100000.0  # right
-            b = float(src_rect.get("b", "0")) / 100000.0  # bottom
-            
-            # Agar crop mavjud bo'lsa
-            if l > 0 or t > 0 or r > 0 or b > 0:
-                crop_info = {"left": l, "top": t, "right": r, "bottom": b}
-                print(f"📐 Crop ma'lumotlari topildi: l={l:.2%}, t={t:.2%}, r={r:.2%}, b={b:.2%}")
-    except Exception as e:
-        print(f"⚠️ Crop ma'lumotlarini o'qishda xatolik: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    return crop_info
+def crop_from_src_rect(src_rect) -> Optional[dict]:
+    """a:srcRect elementidan crop lug'ati (crop bo'lmasa None)."""
+    # Crop koordinatalari (EMU - English Metric Units)
+    # 0-100000 aralig'ida, bu foiz sifatida ishlaydi
+    l = float(src_rect.get("l", "0")) / 100000.0  # left
+    t = float(src_rect.get("t", "0")) / 100000.0  # top
+    r = float(src_rect.get("r", "0")) / 100000.0  # right
+    b = float(src_rect.get("b", "0")) / 100000.0  # bottom
+
+    # Agar crop mavjud bo'lsa
+    if l > 0 or t > 0 or r > 0 or b > 0:
+        logger.debug("📐 Crop ma'lumotlari topildi: l=%.2f%%, t=%.2f%%, r=%.2f%%, b=%.2f%%", l * 100, t * 100, r * 100, b * 100)
+        return {"left": l, "top": t, "right": r, "bottom": b}
+    return None
 
 
 def crop_image(img_bytes, crop_info):
@@ -200,413 +1081,3171 @@ def crop_image(img_bytes, crop_info):
         cropped_img.save(output, format=img_format)
         cropped_bytes = output.getvalue()
         
-        print(f"✂️ Rasm crop qilindi: {original_width}x{original_height} -> {right-left}x{bottom-top}")
+        logger.debug("✂️ Rasm crop qilindi: %dx%d -> %dx%d", original_width, original_height, right - left, bottom - top)
         
         return cropped_bytes
         
     except Exception as e:
-        print(f"⚠️ Rasmni crop qilishda xatolik: {e}, original rasm qaytarilmoqda")
+        logger.warning(f"⚠️ Rasmni crop qilishda xatolik: {e}, original rasm qaytarilmoqda")
         return img_bytes
 
 
-def extract_image_from_cell(cell, zip_content, image_index):
-    """Cell ichidagi birinchi rasmni base64 qilib olish. a:blip yoki v:imagedata orqali."""
-    try:
-        found_image_ref = None
-        run_element = None
-        
-        for paragraph in cell.paragraphs:
-            for run in paragraph.runs:
-
-                # 1) a:blip orqali rasm izlash
-                blips = run._element.findall(
-                    ".//a:blip",
-                    {"a": "http://schemas.openxmlformats.org/drawingml/2006/main"},
-                )
-                for blip in blips:
-                    embed_id = blip.get(
-                        "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
-                    )
-                    if embed_id:
-                        found_image_ref = embed_id
-                        run_element = run._element
-                        break
+# Tayyor rasmlar keshi: (media digest, crop, sozlamalar) → MIME, tayyor baytlar digest'i va base64.
+# IMAGE_CACHE_BACKEND=sqlite/disk (default) — worker'lar va qayta ishga tushirishlar orasida
+# saqlanadi, memory bo'lsa — har bir parse worker process'ida alohida
+image_cache = open_cache_backend("images", IMAGE_CACHE_BYTES, IMAGE_CACHE_BACKEND)
 
-                # 2) Agar blip topilmasa → v:imagedata orqali VML rasm qidirish
-                if not found_image_ref:
-                    v_imgs = run._element.findall(
-                        ".//v:imagedata",
-                        {"v": "urn:schemas-microsoft-com:vml"}
-                    )
-                    for vimg in v_imgs:
-                        embed_id = vimg.get(
-                            "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
-                        )
-                        if embed_id:
-                            found_image_ref = embed_id
-                            run_element = run._element
-                            break
 
-                if found_image_ref:
-                    break
-            if found_image_ref:
-                break
+def _encode_prepared(prepared: Optional[tuple]) -> bytes:
+    """Tayyor rasm → kesh qiymati ``mime\\ndigest\\nbase64`` (b"" — rasm tayyorlanmadi)."""
+    if prepared is None:
+        return b""
+    mime_type, digest, img_base64 = prepared
+    return f"{mime_type}\n{digest}\n{img_base64}".encode("ascii")
 
-        if not found_image_ref:
-            return None
 
-        # 3) Crop ma'lumotlari
-        crop_info = extract_crop_info(run_element) if run_element else None
+def _decode_prepared(value: bytes) -> Optional[tuple]:
+    """Kesh qiymati → (mime, digest, base64) yoki None."""
+    if not value:
+        return None
+    mime_type, digest, img_base64 = value.decode("ascii").split("\n", 2)
+    return mime_type, digest, img_base64
 
-        # 4) DOCX ZIPdan rasmni chiqarish
-        with zipfile.ZipFile(io.BytesIO(zip_content), "r") as zf:
-            rels_xml = safe_read_zip(zf, "word/_rels/document.xml.rels")
-            if not rels_xml:
-                return None
-            rels_xml = rels_xml.decode("utf-8", errors="ignore")
 
-            match = re.search(f'Id="{found_image_ref}".*?Target="([^"]*)"', rels_xml)
-            if not match:
-                return None
+def encode_image(img_bytes: bytes, part: str, crop_info: Optional[dict]) -> Optional[tuple]:
+    """Xom media → (mime, tayyor baytlar digest'i, base64) — kesh miss'dagi to'liq yo'l."""
+    with timed_stage("image_prepare"):
+        prepared = prepare_image(img_bytes, part, crop_info)
+    if prepared is None:
+        return None
+    mime_type, img_bytes = prepared
+    return mime_type, hashlib.sha256(img_bytes).hexdigest(), base64.b64encode(img_bytes).decode("ascii")
 
-            media_file = f"word/{match.group(1)}"
-            img_bytes = safe_read_zip(zf, media_file)
-            if not img_bytes:
-                return None
 
-            # 5) WMF/EMF → PNG konvertatsiya (Word clipartlar uchun)
-            ext = os.path.splitext(media_file)[1].lower()
-            if ext in [".wmf", ".emf"]:
-                try:
-                    from PIL import Image
-                    img = Image.open(io.BytesIO(img_bytes))
-                    buffer = io.BytesIO()
-                    img.save(buffer, format="PNG")
-                    img_bytes = buffer.getvalue()
-                except:
-                    print("⚠ WMF/EMF konvert qilib bo'lmadi, o‘tkazib yuborildi.")
-                    return None
-
-            # 6) Crop qo‘llash
-            if crop_info:
-                img_bytes = crop_image(img_bytes, crop_info)
-
-            # 7) MIME aniqlash
-            mime_type = "image/png"
-            if img_bytes[:4] == b'\x89PNG':
-                mime_type = "image/png"
-            elif img_bytes[:3] == b'\xFF\xD8\xFF':
-                mime_type = "image/jpeg"
-            else:
-                if ext in [".jpg", ".jpeg"]:
-                    mime_type = "image/jpeg"
-                elif ext == ".gif":
-                    mime_type = "image/gif"
+def detect_mime(img_bytes: bytes, ext: str) -> str:
+    """Rasm baytlari (yoki kengaytmasi) bo'yicha MIME aniqlash."""
+    mime_type = "image/png"
+    if img_bytes[:4] == b'\x89PNG':
+        mime_type = "image/png"
+    elif img_bytes[:3] == b'\xFF\xD8\xFF':
+        mime_type = "image/jpeg"
+    elif img_bytes[:4] == b"RIFF" and img_bytes[8:12] == b"WEBP":
+        mime_type = "image/webp"
+    else:
+        if ext in [".jpg", ".jpeg"]:
+            mime_type = "image/jpeg"
+        elif ext == ".gif":
+            mime_type = "image/gif"
+    return mime_type
 
-            # 8) Base64
-            img_base64 = base64.b64encode(img_bytes).decode()
 
-            return f"data:{mime_type};base64,{img_base64}"
+def normalize_image(img_bytes: bytes) -> bytes:
+    """Rasmni IMAGE_* sozlamalari bo'yicha kichraytirish, qayta siqish va metadata'siz saqlash.
 
-    except Exception as e:
-        print(f"❗ Rasmni o'qishda xatolik: {e}")
-        return None
+    Hech qanday sozlama yoqilmagan bo'lsa yoki rasm o'zgarmasa — asl baytlar qaytadi.
+    """
+    if not (IMAGE_MAX_DIM or IMAGE_FORMAT or IMAGE_STRIP_METADATA):
+        return img_bytes
 
-def build_cell_data(cell, zip_content, image_index):
-    """Cell uchun text/image obyektini tuzadi. 
-    Agar text yo'q bo'lsa bo'sh string, agar image yo'q bo'lsa None qaytaradi."""
-    text = ""
     try:
-        text_val = cell.text.strip()
-        text = text_val if text_val else ""
-    except Exception:
-        text = ""
+        img = Image.open(io.BytesIO(img_bytes))
+        src_format = img.format or "PNG"
+        if src_format == "MPO":
+            # Telefon kameralari JPEG'ni MPO (ko'p kadrli JPEG) qilib saqlaydi —
+            # asosiy (birinchi) kadr oddiy JPEG kabi ishlanadi
+            img.seek(0)
+            src_format = "JPEG"
+        elif getattr(img, "n_frames", 1) > 1:
+            # Animatsiyali rasmlar (GIF, APNG, WebP) o'zgartirilmaydi
+            return img_bytes
 
-    image_base64 = extract_image_from_cell(cell, zip_content, image_index)
+        target_format = IMAGE_FORMAT.upper() if IMAGE_FORMAT else src_format
+        if target_format == "JPG":
+            target_format = "JPEG"
+        too_big = IMAGE_MAX_DIM and max(img.size) > IMAGE_MAX_DIM
 
-    # Agar text ham image yo'q bo'lsa, None qaytarish (butun qatorni tashlash uchun)
-    if not text and not image_base64:
-        return None
+        if not too_big and target_format == src_format and not IMAGE_STRIP_METADATA:
+            return img_bytes
 
-    # Text bo'lsa image null, image bo'lsa text bo'sh string
-    return {
-        "text": text if text else "",
-        "image": image_base64 if image_base64 else None
-    }
+        # EXIF orientatsiyasini qo'llash (metadata olib tashlangach rasm aylanib qolmasligi uchun)
+        img = ImageOps.exif_transpose(img)
+        if too_big:
+            img.thumbnail((IMAGE_MAX_DIM, IMAGE_MAX_DIM), Image.LANCZOS)
 
+        if target_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif target_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
 
-async def _parse_and_send_one_file(
-    content: bytes,
-    test: Optional[str],
-    language: Optional[str],
-    class_id: Optional[str],
-    subject: Optional[str],
-) -> tuple:
-    """Bitta DOCX kontentini parse qilib API ga yuboradi. Qaytaradi: (success, count, error_msg)."""
-    image_files = []
-    try:
-        doc = Document(io.BytesIO(content))
-        questions = []
-        image_index = 0
-        author_for_file = ""  # Ikkinchi savol qatoridan olinadi
+        save_kwargs = {}
+        if target_format in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = IMAGE_QUALITY
+        if target_format == "PNG":
+            save_kwargs["optimize"] = True
+
+        # Yangi rasm exif/pnginfo'siz saqlanadi — metadata tushib qoladi
+        output = io.BytesIO()
+        img.save(output, format=target_format, **save_kwargs)
+        return output.getvalue()
+
+    except Exception as e:
+        logger.warning(f"⚠️ Rasmni normalizatsiya qilishda xatolik: {e}, original rasm qaytarilmoqda")
+        return img_bytes
+
+
+def prepare_image(img_bytes: bytes, part: str, crop_info: Optional[dict]) -> Optional[tuple]:
+    """Xom media → (mime, tayyor baytlar): WMF/EMF konvert, crop, normalizatsiya.
+
+    Konvert qilib bo'lmasa None qaytaradi.
+    """
+    ext = os.path.splitext(part)[1].lower()
+
+    # WMF/EMF → PNG konvertatsiya (Word clipartlar uchun)
+    if ext in [".wmf", ".emf"]:
+        try:
+            img = Image.open(io.BytesIO(img_bytes))
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG")
+            img_bytes = buffer.getvalue()
+        except Exception:
+            logger.warning("⚠ WMF/EMF konvert qilib bo'lmadi, o‘tkazib yuborildi.")
+            return None
+
+    # Crop qo‘llash
+    if crop_info:
+        img_bytes = crop_image(img_bytes, crop_info)
+
+    img_bytes = normalize_image(img_bytes)
+    return detect_mime(img_bytes, ext), img_bytes
+
+
+class _SeekableMmap(mmap.mmap):
+    """mmap'ni zipfile uchun oddiy fayl kabi ko'rsatish.
+
+    zipfile ``seekable()`` ni talab qiladi (mmap da u Python 3.13 dan beri bor)
+    va noto'g'ri seek'da OSError kutadi (mmap ValueError beradi).
+    """
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=0):
+        try:
+            super().seek(pos, whence)
+        except ValueError as e:
+            raise OSError(str(e)) from e
+        return self.tell()
+
+
+class DocxPackage:
+    """DOCX (ZIP) paketining hujjat darajasidagi indeksi.
+
+    ZIP bir marta ochiladi, ``word/_rels/document.xml.rels`` bir marta
+    rId→target lug'atiga o'giriladi, o'qilgan (va kerak bo'lsa PNG ga
+    konvert qilingan) media fayllar esa part nomi bo'yicha saqlab qo'yiladi.
+    """
+
+    RELS_PART = "word/_rels/document.xml.rels"
+    PACKAGE_RELS_PART = "_rels/.rels"
+    OFFICE_DOCUMENT_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+
+    def __init__(self, source):
+        """``source`` — DOCX fayl yo'li (mmap orqali, nusxalanmasdan ochiladi) yoki bytes."""
+        self._mmap = None
+        if isinstance(source, (bytes, bytearray)) or os.path.getsize(source) == 0:
+            stream = io.BytesIO(source if isinstance(source, (bytes, bytearray)) else b"")
+        else:
+            with open(source, "rb") as f:
+                self._mmap = _SeekableMmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stream = self._mmap
+        self._zf = zipfile.ZipFile(stream, "r")
+        self.rels = self._parse_rels()
+        self._media = {}
+        self._media_digests = {}
+        self._refs = {}
+        # digest → data URI (hujjatdagi har bir noyob rasm bir marta)
+        self.images = {}
+        # Shu paketning rasm keshi hisoblagichlari (bytes_saved — hit tufayli qayta
+        # ishlanmagan xom media); parse natijasi bilan qaytariladi
+        self.cache_stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def _parse_rels(self) -> dict:
+        """Relationship'larni rId → Target lug'atiga o'girish."""
+        rels_xml = safe_read_zip(self._zf, self.RELS_PART)
+        if not rels_xml:
+            return {}
+        rels = {}
+        try:
+            root = ElementTree.fromstring(rels_xml)
+        except ElementTree.ParseError as e:
+            logger.warning(f"⚠️ Relationship'larni o'qishda xatolik: {e}")
+            return {}
+        for rel in root:
+            rel_id = rel.get("Id")
+            target = rel.get("Target")
+            if rel_id and target:
+                rels[rel_id] = target
+        return rels
+
+    def main_part(self) -> str:
+        """Asosiy hujjat part nomi (odatda ``word/document.xml``)."""
+        rels_xml = safe_read_zip(self._zf, self.PACKAGE_RELS_PART)
+        if rels_xml:
+            try:
+                for rel in ElementTree.fromstring(rels_xml):
+                    if rel.get("Type") == self.OFFICE_DOCUMENT_REL and rel.get("Target"):
+                        return rel.get("Target").lstrip("/")
+            except ElementTree.ParseError:
+                pass
+        return "word/document.xml"
+
+    def open_part(self, part: str):
+        """Part'ni oqim (stream) sifatida ochish — to'liq xotiraga o'qilmaydi."""
+        return self._zf.open(part)
+
+    def media_part(self, rel_id: str) -> Optional[str]:
+        """rId bo'yicha ZIP ichidagi media part nomini qaytaradi."""
+        target = self.rels.get(rel_id)
+        if not target:
+            return None
+        # Absolyut target ("/word/media/...") paket ildiziga nisbatan
+        if target.startswith("/"):
+            return target.lstrip("/")
+        return f"word/{target}"
+
+    def read_media(self, part: str) -> Optional[bytes]:
+        """Media faylning xom baytlarini o'qish.
+
+        Natija part nomi bo'yicha saqlanadi — bir xil rasm har bir cell uchun
+        ZIP dan qayta o'qilmaydi.
+        """
+        if part not in self._media:
+            self._media[part] = safe_read_zip(self._zf, part)
+        return self._media[part]
+
+    def media_digest(self, part: str) -> Optional[str]:
+        """Xom media baytlarining SHA-256 digest'i (part bo'yicha bir marta)."""
+        if part not in self._media_digests:
+            img_bytes = self.read_media(part)
+            self._media_digests[part] = hashlib.sha256(img_bytes).hexdigest() if img_bytes else None
+        return self._media_digests[part]
+
+    def image_ref(self, part: str, crop_info: Optional[dict]) -> Optional[str]:
+        """Rasmni tayyorlab (konvert, crop, normalizatsiya), data URI ga o'girib, digest'ini qaytarish.
+
+        (part, crop) bo'yicha bir marta hisoblanadi; tayyor natija (MIME va
+        base64) esa ``image_cache`` da (media digest, crop, sozlamalar) bo'yicha
+        hujjatlar orasida ham saqlanadi — takrorlanuvchi rasm bitta hash va
+        bitta kesh so'roviga tushadi. Bir xil baytli rasmlar bitta digest'ga tushadi.
+        """
+        crop_key = tuple(crop_info[k] for k in ("left", "top", "right", "bottom")) if crop_info else None
+        key = (part, crop_key)
+        if key in self._refs:
+            return self._refs[key]
+
+        digest = None
+        with timed_stage("image"):
+            media_digest = self.media_digest(part)
+            if media_digest:
+                cache_key = f"{media_digest}|{crop_key}|{IMAGE_SETTINGS}|b64"
+                cached = image_cache.get(cache_key)
+                if cached is None:
+                    self.cache_stats["misses"] += 1
+                    encoded = encode_image(self.read_media(part), part, crop_info)
+                    image_cache.set(cache_key, _encode_prepared(encoded))
+                else:
+                    self.cache_stats["hits"] += 1
+                    self.cache_stats["bytes_saved"] += len(self.read_media(part))
+                    encoded = _decode_prepared(cached)
+
+                if encoded:
+                    mime_type, digest, img_base64 = encoded
+                    if digest not in self.images:
+                        self.images[digest] = f"data:{mime_type};base64,{img_base64}"
+
+        self._refs[key] = digest
+        return digest
+
+    def close(self):
+        self._zf.close()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# WordprocessingML / DrawingML nomlar fazolari va oldindan kompilyatsiya qilingan XPath'lar
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+XML_NS = {
+    "w": W_NS,
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "v": "urn:schemas-microsoft-com:vml",
+}
+W_BODY = f"{{{W_NS}}}body"
+W_TBL = f"{{{W_NS}}}tbl"
+W_TR = f"{{{W_NS}}}tr"
+W_TC = f"{{{W_NS}}}tc"
+W_P = f"{{{W_NS}}}p"
+W_R = f"{{{W_NS}}}r"
+W_HYPERLINK = f"{{{W_NS}}}hyperlink"
+W_VAL = f"{{{W_NS}}}val"
+
+XP_CELL_RUNS = etree.XPath("./w:p/w:r", namespaces=XML_NS)
+XP_BLIP_EMBED = etree.XPath(".//a:blip/@r:embed", namespaces=XML_NS)
+XP_IMAGEDATA_ID = etree.XPath(".//v:imagedata/@r:id", namespaces=XML_NS)
+XP_SRC_RECT = etree.XPath(".//a:srcRect", namespaces=XML_NS)
+XP_GRID_BEFORE = etree.XPath("./w:trPr/w:gridBefore/@w:val", namespaces=XML_NS)
+XP_GRID_SPAN = etree.XPath("./w:tcPr[1]/w:gridSpan/@w:val", namespaces=XML_NS)
+XP_VMERGE = etree.XPath("./w:tcPr[1]/w:vMerge", namespaces=XML_NS)
+XP_TABLE_CELLS = etree.XPath("./w:tr/w:tc", namespaces=XML_NS)
+XP_TABLE_IMAGE_RUNS = etree.XPath(
+    "./w:tr/w:tc/w:p/w:r[.//a:blip[@r:embed != ''] or .//v:imagedata[@r:id != '']]", namespaces=XML_NS
+)
+
+# Run ichidagi matn elementlari (python-docx dagi CT_R.text bilan bir xil)
+_RUN_TEXT_TAGS = {
+    f"{{{W_NS}}}t": None,
+    f"{{{W_NS}}}tab": "\t",
+    f"{{{W_NS}}}ptab": "\t",
+    f"{{{W_NS}}}cr": "\n",
+    f"{{{W_NS}}}noBreakHyphen": "-",
+    f"{{{W_NS}}}br": "\n",
+}
+_W_T = f"{{{W_NS}}}t"
+_W_BR = f"{{{W_NS}}}br"
+_W_TYPE = f"{{{W_NS}}}type"
+
+
+def _run_text(r) -> str:
+    """w:r elementining matni (python-docx ``Run.text`` bilan bir xil)."""
+    parts = []
+    for child in r:
+        tag = child.tag
+        if tag not in _RUN_TEXT_TAGS:
+            continue
+        if tag == _W_T:
+            parts.append(child.text or "")
+        elif tag == _W_BR:
+            # Faqat oddiy qator uzilishi "\n", sahifa/ustun uzilishi — bo'sh
+            if child.get(_W_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        else:
+            parts.append(_RUN_TEXT_TAGS[tag])
+    return "".join(parts)
+
+
+def _cell_text(tc) -> str:
+    """w:tc elementining matni (python-docx ``_Cell.text`` bilan bir xil)."""
+    paragraphs = []
+    for p in tc.iterchildren(W_P):
+        parts = []
+        for child in p.iterchildren(W_R, W_HYPERLINK):
+            if child.tag == W_R:
+                parts.append(_run_text(child))
+            else:
+                parts.extend(_run_text(r) for r in child.iterchildren(W_R))
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+
+def _cell_image(tc, package: DocxPackage) -> Optional[str]:
+    """w:tc dagi birinchi rasm digest'i (``TableArrays`` bilan bir xil mantiq)."""
+    try:
+        for run in XP_CELL_RUNS(tc):
+            # 1) a:blip, 2) bo'lmasa v:imagedata
+            found_image_ref = next((rid for rid in XP_BLIP_EMBED(run) if rid), None)
+            if not found_image_ref:
+                found_image_ref = next((rid for rid in XP_IMAGEDATA_ID(run) if rid), None)
+            if not found_image_ref:
+                continue
+
+            # 3) Crop ma'lumotlari
+            crop_info = None
+            try:
+                src_rects = XP_SRC_RECT(run)
+                if src_rects:
+                    crop_info = crop_from_src_rect(src_rects[0])
+            except Exception as e:
+                logger.warning(f"⚠️ Crop ma'lumotlarini o'qishda xatolik: {e}")
+
+            # 4) Paket indeksidan rasmni olish
+            media_file = package.media_part(found_image_ref)
+            if not media_file:
+                return None
+            return package.image_ref(media_file, crop_info)
+        return None
+    except Exception as e:
+        logger.error(f"❗ Rasmni o'qishda xatolik: {e}")
+        return None
+
+
+class _StreamCell:
+    """Stream engine cell'i: matn va data birinchi murojaatda hisoblanadi."""
+
+    __slots__ = ("_tc", "_package", "_text", "_data", "_data_ready")
+
+    def __init__(self, tc, package: DocxPackage):
+        self._tc = tc
+        self._package = package
+        self._text = None
+        self._data = None
+        self._data_ready = False
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = _cell_text(self._tc)
+        return self._text
+
+    @property
+    def data(self) -> Optional[dict]:
+        """Cell uchun {"text", "image"} (ikkalasi ham bo'sh bo'lsa None)."""
+        if not self._data_ready:
+            text = self.text.strip()
+            image_digest = _cell_image(self._tc, self._package)
+            if text or image_digest:
+                self._data = {"text": text, "image": image_digest or None}
+            self._data_ready = True
+        return self._data
+
+
+def _resolve_row_cells(tr, make_cell: Callable, prev_row: Optional[dict]) -> tuple:
+    """Qator cell'larini python-docx ``_Row.cells`` qoidalari bo'yicha yig'ish (``make_cell(tc)`` — cell obyekti).
+
+    gridSpan'li cell o'z kengligicha takrorlanadi, vMerge="continue" cell esa
+    yuqoridagi qatorning shu grid offset'idagi cell(lar)ini oladi. Qaytaradi:
+    (cells, grid offset → cell'lar lug'ati) — ikkinchisi keyingi qator uchun.
+    """
+    grid_before = XP_GRID_BEFORE(tr)
+    offset = int(grid_before[0]) if grid_before else 0
+    cells = []
+    row_map = {}
+    for tc in tr.iterchildren(W_TC):
+        span_val = XP_GRID_SPAN(tc)
+        span = int(span_val[0]) if span_val else 1
+        vmerge = XP_VMERGE(tc)
+        if vmerge and vmerge[0].get(W_VAL, "continue") == "continue":
+            if prev_row is None:
+                raise ValueError("no tr above topmost tr in w:tbl")
+            if offset not in prev_row:
+                raise ValueError(f"no `tc` element at grid_offset={offset}")
+            tc_cells = prev_row[offset]
+        else:
+            tc_cells = [make_cell(tc)] * span
+        row_map[offset] = tc_cells
+        cells.extend(tc_cells)
+        offset += span
+    return cells, row_map
+
+
+def iter_stream_rows(package: DocxPackage):
+    """Stream engine: asosiy hujjatni ``lxml.etree.iterparse`` bilan o'qib, qatorlarni birma-bir qaytarish.
+
+    Faqat body'ning bevosita jadvallari olinadi (``Document.tables`` kabi).
+    Qayta ishlangan qator, paragraf va jadvallar daraxtdan olib tashlanadi —
+    xotira hujjat hajmiga emas, bitta jadval qatoriga bog'liq.
+    """
+    with package.open_part(package.main_part()) as source:
+        context = etree.iterparse(source, events=("end",), tag=(W_TR, W_TBL, W_P))
+        row_idx = 0
+        prev_row = None
+        make_cell = partial(_StreamCell, package=package)
+        for _, el in context:
+            parent = el.getparent()
+            if parent is None:
+                continue
+
+            if el.tag == W_TR:
+                grandparent = parent.getparent()
+                if parent.tag != W_TBL or grandparent is None or grandparent.tag != W_BODY:
+                    continue  # ichki jadval qatori
+                cells, prev_row = _resolve_row_cells(el, make_cell, prev_row)
+                yield row_idx, cells
+                row_idx += 1
+                # Oldingi qatorlarni (va tblPr/tblGrid ni) daraxtdan uzish
+                while el.getprevious() is not None:
+                    del parent[0]
+
+            elif parent.tag == W_BODY:
+                # Body darajasidagi jadval yoki paragraf tugadi
+                if el.tag == W_TBL:
+                    row_idx = 0
+                    prev_row = None
+                el.clear()
+                while el.getprevious() is not None:
+                    del parent[0]
+        del context
+
+
+def format_question(question_data, correct_data, wrong1_data, wrong2_data, wrong3_data) -> Optional[dict]:
+    """Qator cell'laridan savol obyektini tuzish (takroriy javoblar bo'shatiladi).
+
+    Savol cell'i bo'sh bo'lsa None qaytaradi — butun qator tashlanadi.
+    """
+    # Savol yo'q bo'lsa — butun qatorni tashlaymiz
+    if question_data is None:
+        return None
+
+    # Javoblarni to'g'ri format qilish (None bo'lsa bo'sh object)
+    def format_answer(answer_data):
+        """Javobni format qilish - None bo'lsa bo'sh object qaytaradi."""
+        if answer_data is None:
+            return {"text": "", "image": None}
+        return {
+            "text": answer_data.get("text", "") or "",
+            "image": answer_data.get("image") or None
+        }
+
+    # Formatlangan savol (rasm digest ko'rinishida)
+    formatted_question = {
+        "question": {
+            "text": question_data.get("text", "") or "",
+            "image": question_data.get("image") or None
+        },
+        "correct": format_answer(correct_data),
+        "wrong1": format_answer(wrong1_data),
+        "wrong2": format_answer(wrong2_data),
+        "wrong3": format_answer(wrong3_data)
+    }
+
+    # Javoblarni tekshirish - agar bir xil javoblar bo'lsa, ularni takrorlamaslik
+    correct_answer = formatted_question["correct"]
+    wrong_answers = [
+        ("wrong1", formatted_question["wrong1"]),
+        ("wrong2", formatted_question["wrong2"]),
+        ("wrong3", formatted_question["wrong3"])
+    ]
+
+    # Correct javobni key sifatida saqlash (rasm — digest, base64 emas)
+    correct_key = f"{correct_answer['text']}|{correct_answer['image']}"
+    seen_answers = [correct_key]
+
+    # Wrong javoblarni tekshirish
+    for wrong_key, wrong_answer in wrong_answers:
+        answer_key = f"{wrong_answer['text']}|{wrong_answer['image']}"
+
+        # Agar bu javob allaqachon ko'rilgan bo'lsa (correct yoki boshqa wrong bilan)
+        if answer_key in seen_answers:
+            # Agar bo'sh bo'lmasa, uni bo'sh qilish
+            if wrong_answer['text'] or wrong_answer['image']:
+                logger.debug("⚠️ Bir xil javob topildi (%s): %s... - bo'sh qilindi", wrong_key, answer_key[:50])
+                formatted_question[wrong_key] = {"text": "", "image": None}
+            else:
+                # Bo'sh bo'lsa ham, key'ni qo'shish (takrorlanishni oldini olish uchun)
+                seen_answers.append(answer_key)
+        else:
+            # Yangi javob, key'ni qo'shish
+            seen_answers.append(answer_key)
+
+    return formatted_question
+
+
+class TableArrays:
+    """Bitta w:tbl bo'yicha ustunli massivlar: har bir w:tc uchun matn, birinchi rasm rId va crop.
+
+    Oldindan kompilyatsiya qilingan XPath'lar jadval bo'yicha bir marta bajariladi,
+    ``texts[i]``, ``image_rids[i]`` va ``crops[i]`` — ``cells[i]`` ga tegishli
+    (qatorlar tartibida). Rasmning o'zi bu yerda tayyorlanmaydi — faqat kerakli
+    cell'lar uchun ``image()`` orqali.
+    """
+
+    __slots__ = ("cells", "index", "texts", "image_rids", "crops")
+
+    def __init__(self, tbl):
+        self.cells = XP_TABLE_CELLS(tbl)
+        self.index = {tc: i for i, tc in enumerate(self.cells)}
+        self.texts = [_cell_text(tc) for tc in self.cells]
+        self.image_rids = [None] * len(self.cells)
+        self.crops = [None] * len(self.cells)
+
+        # Rasmli run'lar hujjat tartibida — har bir cell uchun birinchisi olinadi
+        for run in XP_TABLE_IMAGE_RUNS(tbl):
+            i = self.index[run.getparent().getparent()]
+            if self.image_rids[i] is not None:
+                continue
+            # 1) a:blip, 2) bo'lmasa v:imagedata
+            self.image_rids[i] = next((rid for rid in XP_BLIP_EMBED(run) if rid), None) or next(
+                rid for rid in XP_IMAGEDATA_ID(run) if rid
+            )
+            # 3) Crop ma'lumotlari
+            try:
+                src_rects = XP_SRC_RECT(run)
+                if src_rects:
+                    self.crops[i] = crop_from_src_rect(src_rects[0])
+            except Exception as e:
+                logger.warning(f"⚠️ Crop ma'lumotlarini o'qishda xatolik: {e}")
+
+    def image(self, i: int, package: DocxPackage) -> Optional[str]:
+        """``i``-cell rasmining digest'i (rasm bo'lmasa None)."""
+        rel_id = self.image_rids[i]
+        if rel_id is None:
+            return None
+        try:
+            media_file = package.media_part(rel_id)
+            if not media_file:
+                return None
+            return package.image_ref(media_file, self.crops[i])
+        except Exception as e:
+            logger.error(f"❗ Rasmni o'qishda xatolik: {e}")
+            return None
+
+
+class _TableCell:
+    """``TableArrays`` dagi cell: engine'lar orasidagi umumiy interfeys (.text, .data)."""
+
+    __slots__ = ("_arrays", "_package", "_i")
+
+    def __init__(self, arrays: TableArrays, package: DocxPackage, tc):
+        self._arrays = arrays
+        self._package = package
+        self._i = arrays.index[tc]
+
+    @property
+    def text(self) -> str:
+        return self._arrays.texts[self._i]
+
+    @property
+    def data(self) -> Optional[dict]:
+        """Cell uchun {"text", "image"} (ikkalasi ham bo'sh bo'lsa None)."""
+        text = self.text.strip()
+        image_digest = self._arrays.image(self._i, self._package)
+        if not text and not image_digest:
+            return None
+        return {"text": text, "image": image_digest}
+
+
+def iter_docx_rows(source, package: DocxPackage):
+    """python-docx engine: (row_idx, cells) juftliklari, butun hujjat xotiraga yuklanadi.
+
+    Har bir jadval ``TableArrays`` ga bir marta o'giriladi, qatorlar esa shu
+    massivlar ustidan bir o'tishda yig'iladi (gridSpan/vMerge — ``_Row.cells`` kabi).
+    """
+    with timed_stage("load"):
+        doc = docx.Document(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    for table in doc.tables:
+        make_cell = partial(_TableCell, TableArrays(table._tbl), package)
+        prev_row = None
+        for row_idx, tr in enumerate(table._tbl.iterchildren(W_TR)):
+            cells, prev_row = _resolve_row_cells(tr, make_cell, prev_row)
+            yield row_idx, cells
+
+
+def iter_questions(source, package: DocxPackage, doc_info: dict, engine: Optional[str] = None):
+    """Hujjatdagi savollarni birma-bir qaytaruvchi generator.
+
+    Muallif topilganda ``doc_info["author"]`` ga yoziladi. ``engine`` —
+    "docx" (python-docx) yoki "stream" (lxml iterparse), natijasi bir xil.
+    """
+    engine = engine or PARSE_ENGINE
+    if engine == "stream":
+        rows = iter_stream_rows(package)
+    else:
+        rows = iter_docx_rows(source, package)
+
+    for row_idx, cells in rows:
+        if len(cells) < 6:  # 6 ustun: savol, tog'ri, noto'g'ri x3, author
+            continue
+
+        # Author faqat ikkinchi qatordan (row_idx == 1)
+        if row_idx == 1 and not doc_info.get("author"):
+            doc_info["author"] = (cells[5].text or "").strip()
+
+        # Har bir cell uchun data (ustunlar 0–4: savol, correct, wrong1–3)
+        question = format_question(*(cells[i].data for i in range(5)))
+        if question is not None:
+            yield question
+
+
+def parse_docx_content(source, engine: Optional[str] = None) -> tuple:
+    """DOCX faylini (yo'li yoki bytes) savollar ro'yxatiga o'girish (sof CPU bosqichi).
+
+    Hech qanday tarmoq yoki global holatga tayanmaydi, natijasi picklable —
+    shuning uchun process pool ichida ishlatiladi. Savollardagi ``image``
+    maydonlari rasm digest'ini saqlaydi. Qaytaradi: (questions, author, images),
+    bu yerda images — digest → data URI.
+    """
+    return _parse_docx(source, engine)[0]
+
+
+def _parse_docx(source, engine: Optional[str] = None) -> tuple:
+    """``parse_docx_content`` natijasi va shu parse'ning rasm keshi hisoblagichlari."""
+    doc_info = {"author": ""}  # Ikkinchi savol qatoridan olinadi
+
+    # Paket indeksi bir marta quriladi — barcha cell'lar shu orqali rasm oladi
+    with timed_stage("load"):
+        package = DocxPackage(source)
+    with package:
+        questions = list(iter_questions(source, package, doc_info, engine))
+        images = package.images
+
+    return (questions, doc_info["author"], images), package.cache_stats
+
+
+def parse_docx_instrumented(source) -> tuple:
+    """``parse_docx_content`` + bosqichlar o'lchovlari (worker process'da ishlaydi).
+
+    Metrikalar registri ota process'da, shuning uchun o'lchovlar natija bilan
+    qaytariladi. Qaytaradi: (natija, bosqich → soniyalar ro'yxati, rasm keshi hisoblagichlari).
+    """
+    samples = {}
+    token = _stage_samples.set(samples)
+    started = time.perf_counter()
+    try:
+        result, cache = _parse_docx(source)
+    finally:
+        _stage_samples.reset(token)
+    samples["parse"] = [time.perf_counter() - started]
+    return result, samples, cache
+
+
+# Parse worker'lardan yig'ilgan rasm keshi hisoblagichlari (/api/cache-stats uchun)
+image_cache_totals = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+
+def record_parse_metrics(result: tuple, samples: dict, cache: dict):
+    """Worker qaytargan o'lchovlarni registrga yozish (table_walk — qolgan vaqt)."""
+    load = sum(samples.get("load", ()))
+    images = samples.get("image", ())
+    parse = samples["parse"][0]
+    STAGE_SECONDS.observe(parse, stage="parse")
+    STAGE_SECONDS.observe(load, stage="load")
+    STAGE_SECONDS.observe(max(0.0, parse - load - sum(images)), stage="table_walk")
+    for seconds in images:
+        STAGE_SECONDS.observe(seconds, stage="image")
+    for seconds in samples.get("image_prepare", ()):
+        STAGE_SECONDS.observe(seconds, stage="image_prepare")
+    record_image_cache(cache)
+    IMAGE_BYTES.inc(sum(len(uri) for uri in result[2].values()))
+
+
+def record_image_cache(cache: dict):
+    """Bitta paketning rasm keshi hisoblagichlarini registr va jami'ga qo'shish (event loop'da)."""
+    IMAGE_CACHE_EVENTS.inc(cache["hits"], event="hit")
+    IMAGE_CACHE_EVENTS.inc(cache["misses"], event="miss")
+    IMAGE_CACHE_SAVED.inc(cache["bytes_saved"])
+    for event, value in cache.items():
+        image_cache_totals[event] += value
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Parse uchun process pool (birinchi murojaatda yaratiladi)."""
+    global _parse_pool
+    if _parse_pool is None:
+        # "spawn" — event loop va ochiq socket'lar bolaga nusxalanmaydi
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parse_worker,
+        )
+    return _parse_pool
+
+
+def shutdown_parse_pool():
+    """Process pool'ni yopish (ilova to'xtaganda yoki pool buzilganda)."""
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+
+# Vaqti tugagan parse tufayli ataylab to'xtatilgan pool'lar: ulardagi boshqa parse'lar
+# BrokenProcessPool oladi va yangi pool'da qayta uriniladi
+_recycled_pools: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+
+
+def _kill_pool_workers(pool: ProcessPoolExecutor):
+    """Pool worker process'larini majburan to'xtatib, chiqishini kutish (thread'da ishlaydi)."""
+    # ProcessPoolExecutor qaysi worker qaysi vazifani bajarayotganini ko'rsatmaydi —
+    # osilib qolgan parse'ni to'xtatishning yagona yo'li butun pool'ni almashtirish
+    processes = list((pool._processes or {}).values())
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def recycle_parse_pool(pool: ProcessPoolExecutor):
+    """Osilib qolgan worker'li pool'ni almashtirish: yangi parse'lar darhol yangi pool'ga
+    tushadi, eskisining worker'lari o'ldirilguncha kutiladi."""
+    global _parse_pool
+    if _parse_pool is pool:
+        _parse_pool = None
+    _recycled_pools.add(pool)
+    await asyncio.to_thread(_kill_pool_workers, pool)
+
+
+async def run_parse_stage(source) -> tuple:
+    """``parse_docx_content`` ni event loop'dan tashqarida ishga tushirish.
+
+    PARSE_WORKERS > 0 bo'lsa process pool'da, aks holda thread'da ishlaydi.
+    PARSE_TIMEOUT dan oshsa TimeoutError ko'tariladi. Pool rejimida osilib qolgan
+    worker pool bilan birga to'xtatiladi va bu tugaguncha qaytilmaydi — chaqiruvchining
+    admission o'rni shu vaqtgacha band turadi. Thread rejimida thread'ni to'xtatib
+    bo'lmaydi: u o'z ishini tugatadi, natijasi tashlab yuboriladi.
+    """
+    if PARSE_WORKERS <= 0:
+        try:
+            result, samples, cache = await asyncio.wait_for(
+                asyncio.to_thread(parse_docx_instrumented, source), timeout=PARSE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Parse vaqti tugadi ({PARSE_TIMEOUT:g}s)")
+        record_parse_metrics(result, samples, cache)
+        return result
+
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    # Worker'ga faqat fayl yo'li uzatiladi — kontent pickle qilinmaydi
+    job = loop.run_in_executor(pool, parse_docx_instrumented, source)
+    try:
+        result, samples, cache = await asyncio.wait_for(job, timeout=PARSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"⏱️ Parse {PARSE_TIMEOUT:g}s dan oshdi — parse pool qayta ishga tushiriladi")
+        await recycle_parse_pool(pool)
+        raise TimeoutError(f"Parse vaqti tugadi ({PARSE_TIMEOUT:g}s)")
+    except BrokenProcessPool:
+        if pool in _recycled_pools:
+            # Boshqa parse'ning vaqti tugagani uchun pool to'xtatildi — bu fayl aybsiz
+            return await run_parse_stage(source)
+        # Worker kutilmaganda o'lgan (masalan, OOM) — keyingi so'rov uchun yangi pool
+        if _parse_pool is pool:
+            shutdown_parse_pool()
+        raise RuntimeError("Parse worker kutilmaganda to'xtadi")
+    record_parse_metrics(result, samples, cache)
+    return result
+
+
+def warm_parsers() -> float:
+    """Parse uchun og'ir modullarni yuklash (worker process'da ham ishlaydi). Qaytaradi: soniyalar.
+
+    python-docx/lxml (standart shablon bilan bitta Document), Pillow'ning barcha
+    plaginlari (WMF/EMF, JPEG, PNG, ...) va ImageOps.
+    """
+    started = time.perf_counter()
+    docx.Document()
+    Image.init()
+    ImageOps.load()
+    return time.perf_counter() - started
+
+
+def _init_parse_worker():
+    """Parse pool initializer: har bir worker process ishga tushishida modullarni yuklaydi.
+
+    Xatolik pool'ni buzmasligi uchun yutiladi — modullar keyin birinchi parse'da yuklanadi.
+    """
+    try:
+        warm_parsers()
+    except Exception as e:
+        logger.warning(f"⚠️ Parse worker'ini tayyorlashda xatolik: {e}")
+
+
+# Fonda davom etayotgan tayyorlash (STARTUP_WARM_TIMEOUT dan oshganda) — GC bo'lmasligi uchun havola
+_warm_up_phases: Optional[asyncio.Future] = None
+
+
+def _log_warm_up_results(results: list):
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"⚠️ Tayyorlashda xatolik (so'rovlar baribir ishlaydi): {result}")
+
+
+async def warm_up():
+    """STARTUP_MODE=warm: parse worker'lari va upstream (pool + katalog) parallel tayyorlanadi."""
+
+    async def warm_parse_workers():
+        with startup_phase("parsers"):
+            if PARSE_WORKERS > 0:
+                # Bo'sh worker bo'lmaganda har bir submit yangi process ochadi, shuning uchun
+                # PARSE_WORKERS ta vazifa barcha worker'larni ishga tushiradi; modullarni esa
+                # har birida initializer (_init_parse_worker) yuklaydi
+                loop = asyncio.get_running_loop()
+                pool = get_parse_pool()
+                await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(PARSE_WORKERS)))
+            else:
+                await asyncio.to_thread(warm_parsers)
+
+    async def warm_upstream():
+        with startup_phase("http_pool"):
+            open_http_client()
+        with startup_phase("catalogue"):
+            await tests_catalogue.get_tests()
+
+    global _warm_up_phases
+    phases = _warm_up_phases = asyncio.gather(warm_parse_workers(), warm_upstream(), return_exceptions=True)
+    try:
+        # shield — vaqt tugaganda tayyorlash bekor qilinmaydi, fonda davom etadi
+        results = await asyncio.wait_for(asyncio.shield(phases), timeout=STARTUP_WARM_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"⚠️ Tayyorlash {STARTUP_WARM_TIMEOUT:.0f}s ichida tugamadi — ilova kutmasdan ishga tushadi, "
+            "tayyorlash fonda davom etadi"
+        )
+        phases.add_done_callback(lambda done: done.cancelled() or _log_warm_up_results(done.result()))
+        return
+    _log_warm_up_results(results)
+
+
+ANSWER_KEYS = ("question", "correct", "wrong1", "wrong2", "wrong3")
+
+
+def build_questions_payload(
+    questions: list,
+    images: dict,
+    author: str,
+    test: Optional[str],
+    language: Optional[str],
+    class_id: Optional[str],
+    subject: Optional[str],
+    image_mode: Optional[str] = None,
+) -> dict:
+    """Upstream API uchun JSON payload.
+
+    "dedup" rejimida savollar rasmni digest bilan ko'rsatadi, rasmlarning o'zi
+    esa ``images`` jadvalida bir martadan yuboriladi. "inline" (eski serverlar
+    uchun) rejimida har bir digest o'rniga to'liq data URI qo'yiladi.
+    """
+    image_mode = image_mode or PAYLOAD_IMAGE_MODE
+    payload = {
+        "test_id": int(test) if test else None,
+        "language": language or "uz",
+        "grade_id": int(class_id) if class_id else None,
+        "subject_id": int(subject) if subject else None,
+        "author": author or "",
+    }
+
+    if image_mode == "dedup":
+        used = {q[key]["image"] for q in questions for key in ANSWER_KEYS if q[key]["image"]}
+        payload["questions"] = questions
+        payload["images"] = {digest: images[digest] for digest in used}
+        return payload
+
+    # JSON payload — API questions ni array sifatida qabul qiladi
+    payload["questions"] = [
+        {
+            key: {"text": q[key]["text"], "image": images[q[key]["image"]] if q[key]["image"] else None}
+            for key in ANSWER_KEYS
+        }
+        for q in questions
+    ]
+    return payload
+
+
+def _json_bytes(obj) -> bytes:
+    """Ixcham JSON baytlari (httpx ``json=`` bilan bir xil ko'rinishda)."""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Oqimli JSON tanasining socket/gzip'ga beriladigan bo'lak hajmi
+JSON_BUFFER_BYTES = 64 * 1024
+
+
+def _coalesce(fragments: Iterable[bytes], size: int = JSON_BUFFER_BYTES) -> Iterator[bytes]:
+    """Mayda JSON bo'laklarini ~``size`` baytlik bo'laklarga yig'ish (katta bo'lak nusxalanmasdan o'tadi)."""
+    buffer = bytearray()
+    for fragment in fragments:
+        if len(fragment) >= size:
+            if buffer:
+                yield bytes(buffer)
+                buffer.clear()
+            yield fragment
+            continue
+        buffer += fragment
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _payload_head(payload: dict) -> bytes:
+    """Meta maydonlari va ``"questions":[`` — har bir bo'lak tanasining boshi."""
+    meta = {key: value for key, value in payload.items() if key not in ("questions", "images")}
+    return _json_bytes(meta)[:-1] + (b',"questions":[' if meta else b'"questions":[')
+
+
+def iter_payload_json(
+    payload: dict,
+    start: int = 0,
+    stop: Optional[int] = None,
+    digests: Optional[list] = None,
+) -> Iterator[bytes]:
+    """Payload JSON'ini bo'laklab hosil qilish: meta, ``questions[start:stop]`` va ``digests`` rasmlari.
+
+    Butun tana hech qachon bitta bytes bo'lib yig'ilmaydi — bir vaqtda faqat
+    bitta savol (yoki rasm) serializatsiya qilinadi. ``digests`` berilmasa
+    "dedup" payload'ning barcha rasmlari olinadi.
+    """
+    questions = payload["questions"]
+    stop = len(questions) if stop is None else stop
+    images = payload.get("images")
+    if digests is None and images is not None:
+        digests = list(images)
+
+    yield _payload_head(payload)
+    for i in range(start, stop):
+        if i > start:
+            yield b","
+        yield _json_bytes(questions[i])
+    yield b"]"
+    if digests is not None:
+        yield b',"images":{'
+        for n, digest in enumerate(digests):
+            yield (b"," if n else b"") + _json_bytes(digest) + b":"
+            yield _json_bytes(images[digest])
+        yield b"}"
+    yield b"}"
+
+
+class SubmitChunk:
+    """Upstream'ga bitta POST bilan yuboriladigan payload bo'lagi.
+
+    JSON tanasi xotirada saqlanmaydi: ``iter_body`` uni har bir yuborishda
+    savolma-savol qayta hosil qiladi. ``size`` — tananing aniq hajmi (baytlarda).
+    """
+
+    __slots__ = ("index", "payload", "start", "stop", "digests", "size")
+
+    def __init__(self, index: int, payload: dict, start: int, stop: int, digests: Optional[list], size: int):
+        self.index = index
+        self.payload = payload
+        self.start = start
+        self.stop = stop
+        self.digests = digests
+        self.size = size
+
+    @property
+    def questions(self) -> int:
+        return self.stop - self.start
+
+    def iter_body(self) -> Iterator[bytes]:
+        return iter_payload_json(self.payload, self.start, self.stop, self.digests)
+
+    async def open(self) -> Iterator[bytes]:
+        """Yuborish uchun tana bo'laklari (``StoredChunk`` bilan bir xil interfeys)."""
+        return self.iter_body()
+
+
+def _gzip_fragments(fragments: Iterable[bytes], level: int) -> bytes:
+    """JSON bo'laklarini to'liq tanani yig'masdan gzip qilish."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    blob = b"".join(compressor.compress(piece) for piece in _coalesce(fragments))
+    return blob + compressor.flush()
+
+
+def _gunzip_fragments(blob: bytes) -> Iterator[bytes]:
+    """gzip blob'ini ~JSON_BUFFER_BYTES bo'laklab ochish."""
+    decompressor = zlib.decompressobj(31)
+    for offset in range(0, len(blob), JSON_BUFFER_BYTES):
+        piece = decompressor.decompress(blob[offset:offset + JSON_BUFFER_BYTES])
+        if piece:
+            yield piece
+    piece = decompressor.flush()
+    if piece:
+        yield piece
+
+
+def split_payload(
+    payload: dict,
+    max_questions: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> List[SubmitChunk]:
+    """Payload'ni savollar soni va/yoki JSON hajmi bo'yicha bo'laklarga ajratish.
+
+    Har bir bo'lak meta maydonlari bilan to'liq payload. "dedup" rejimida bo'lak
+    faqat o'z savollari ishlatgan rasmlarni oladi. Bu yerda faqat hajmlar
+    hisoblanadi (savol serializatsiya qilinib, darhol tashlab yuboriladi) —
+    tanalar yuborish paytida ``SubmitChunk.iter_body`` orqali hosil bo'ladi.
+    Chegaradan katta bitta savol alohida bo'lakka tushadi.
+    """
+    started = time.perf_counter()
+    max_questions = SUBMIT_BATCH_QUESTIONS if max_questions is None else max_questions
+    max_bytes = SUBMIT_BATCH_BYTES if max_bytes is None else max_bytes
+    questions = payload["questions"]
+    images = payload.get("images")
+    head_size = len(_payload_head(payload))
+    tail_size = 2 + (len(b',"images":{}') if images is not None else 0)
+    image_sizes = {}
+
+    def image_size(digest: str) -> int:
+        if digest not in image_sizes:
+            image_sizes[digest] = len(_json_bytes(digest)) + 1 + len(_json_bytes(images[digest]))
+        return image_sizes[digest]
+
+    chunks: List[SubmitChunk] = []
+    start = 0
+    chunk_images: dict = {}
+    # Har bir element uchun vergul hisoblanadi — aniq hajmda birinchi elementlarniki ayiriladi
+    size = head_size + tail_size
+
+    def flush(stop: int):
+        exact = size - (stop > start) - bool(chunk_images)
+        digests = None if images is None else list(chunk_images)
+        chunks.append(SubmitChunk(len(chunks), payload, start, stop, digests, exact))
+
+    for i, q in enumerate(questions):
+        fragment_size = len(_json_bytes(q))
+        digests = [] if images is None else list(dict.fromkeys(
+            q[key]["image"] for key in ANSWER_KEYS if q[key]["image"]
+        ))
+        new = [d for d in digests if d not in chunk_images]
+        added = fragment_size + 1 + sum(image_size(d) + 1 for d in new)
+
+        if i > start and (
+            (max_questions and i - start >= max_questions)
+            or (max_bytes and size + added > max_bytes)
+        ):
+            flush(i)
+            start, chunk_images = i, {}
+            size = head_size + tail_size
+            new = digests
+            added = fragment_size + 1 + sum(image_size(d) + 1 for d in new)
+
+        for digest in new:
+            chunk_images[digest] = None
+        size += added
+
+    if len(questions) > start or not chunks:
+        flush(len(questions))
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="serialize")
+    return chunks
+
+
+class _ChunkStream:
+    """httpx uchun bo'lak tanasi (async oqim): JSON bo'laklari, SUBMIT_GZIP bo'lsa — oqimli gzip.
+
+    Har bir iteratsiya tanani boshidan hosil qiladi, shuning uchun httpx 307/308
+    redirect'da tanani qayta yubora oladi. ``bytes`` va ``compress_seconds`` —
+    oxirgi iteratsiya bo'yicha.
+    """
+
+    def __init__(self, chunk, compress: bool):
+        self.chunk = chunk
+        self.compress = compress
+        self.bytes = 0
+        self.compress_seconds = 0.0
+
+    async def __aiter__(self):
+        self.bytes = 0
+        self.compress_seconds = 0.0
+        compressor = zlib.compressobj(SUBMIT_GZIP_LEVEL, zlib.DEFLATED, 31) if self.compress else None
+        for piece in _coalesce(await self.chunk.open()):
+            if compressor is not None:
+                started = time.perf_counter()
+                piece = compressor.compress(piece)
+                self.compress_seconds += time.perf_counter() - started
+                if not piece:
+                    continue
+            self.bytes += len(piece)
+            yield piece
+        if compressor is not None:
+            piece = compressor.flush()
+            self.bytes += len(piece)
+            yield piece
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Exponential backoff (full jitter) yoki server bergan Retry-After (soniyalarda)."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), SUBMIT_BACKOFF_MAX)
+    return random.uniform(0, min(SUBMIT_BACKOFF_MAX, SUBMIT_BACKOFF * (2 ** (attempt - 1))))
+
+
+async def _post_chunk(client: httpx.AsyncClient, chunk, total: int, idempotency_key: str) -> dict:
+    """Bitta bo'lakni yuborish; 429/5xx va tarmoq xatoliklarida qayta urinadi."""
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "User-Agent": "FastAPI-DOCX-Parser/1.0",
+        "Idempotency-Key": idempotency_key,
+    }
+    # Tana oqim bilan yuboriladi; siqilmagan tananing hajmi oldindan ma'lum,
+    # gzip'da esa chunked transfer-encoding ishlatiladi
+    stream = _ChunkStream(chunk, SUBMIT_GZIP)
+    if SUBMIT_GZIP:
+        headers["Content-Encoding"] = "gzip"
+    else:
+        headers["Content-Length"] = str(chunk.size)
+
+    result = {
+        "index": chunk.index,
+        "questions": chunk.questions,
+        "bytes": chunk.size,
+        "attempts": 0,
+        "success": False,
+        "status": None,
+        "error": None,
+        "retryable": False,
+    }
+    label = f"{chunk.index + 1}/{total}-bo'lak"
+    while True:
+        result["attempts"] += 1
+        response = None
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                QUESTIONS_API_URL,
+                content=stream,
+                headers=headers,
+                timeout=SUBMIT_TIMEOUT,  # Base64 katta bo'lishi mumkin
+                follow_redirects=True,  # 302 redirect'larni avtomatik kuzatish
+            )
+            result["status"] = response.status_code
+            result["bytes"] = stream.bytes
+            PAYLOAD_BYTES.observe(stream.bytes)
+            if SUBMIT_GZIP:
+                STAGE_SECONDS.observe(stream.compress_seconds, stage="compress")
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, status=str(response.status_code))
+            UPSTREAM_RESPONSES.inc(status=str(response.status_code))
+
+            # Response statusni tekshirish
+            logger.debug("📡 %s response status: %s", label, response.status_code)
+            logger.debug("📡 Response headers: %s", response.headers)
+
+            # 302 yoki 3xx status kod bo'lsa
+            if response.status_code in [301, 302, 303, 307, 308]:
+                logger.warning(f"⚠️ Redirect detected: {response.headers.get('Location', 'N/A')}")
+                result["error"] = f"Server redirect (Status: {response.status_code})"
+                return result
+
+            response.raise_for_status()
+            response.json()
+            result["success"] = True
+            return result
+        except httpx.HTTPStatusError as e:
+            # HTTP xatolik (4xx, 5xx)
+            error_detail = f"Status: {e.response.status_code}"
+            try:
+                error_body = e.response.json()
+                error_detail += f", Response: {error_body}"
+            except:
+                error_detail += f", Response: {e.response.text[:500]}"
+
+            logger.error(f"❌ API HTTP xatolik ({label}): {error_detail}")
+            result["error"] = f"API xatolik (Status: {e.response.status_code}): {str(e)}"
+            result["retryable"] = e.response.status_code in SUBMIT_RETRY_STATUSES
+        except httpx.RequestError as e:
+            # Network xatolik
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, status="error")
+            UPSTREAM_RESPONSES.inc(status="error")
+            logger.error(f"❌ API ga ulanishda xatolik ({label}): {e}")
+            result["error"] = f"API ga ulanishda xatolik: {str(e)}"
+            result["retryable"] = True
+        except ValueError as e:
+            # 2xx, lekin javob JSON emas
+            logger.error(f"❌ API javobini o'qib bo'lmadi ({label}): {e}")
+            result["error"] = str(e)
+            return result
+
+        if not result["retryable"] or result["attempts"] > SUBMIT_RETRIES:
+            return result
+        delay = _retry_delay(result["attempts"], response)
+        UPSTREAM_RETRIES.inc()
+        logger.info(f"🔁 {label}: {delay:.1f}s dan keyin qayta urinish ({result['attempts']}/{SUBMIT_RETRIES})")
+        await asyncio.sleep(delay)
+
+
+async def submit_chunks(chunks: list, submission_id: Optional[str] = None, done: Collection[int] = ()) -> dict:
+    """Bo'laklarni (``SubmitChunk`` yoki outbox'dagi ``StoredChunk``) upstream'ga ketma-ket yuborish.
+
+    Har bir bo'lak ``Idempotency-Key: <submission_id>-<index>`` bilan yuboriladi —
+    qayta urinishlar (va keyinroq shu submission_id bilan qayta yuborish) bir xil
+    kalitni oladi. Qayta urinishlar tugab ham yuborilmagan bo'lakdan keyin upstream
+    ishlamayapti deb qolganlari yuborilmaydi; 4xx kabi bo'lakka xos xatolikda
+    qolgan bo'laklar yuborilaveradi. ``done`` — avvalroq qabul qilingan bo'laklar
+    (qayta yuborilmaydi).
+    """
+    submission_id = submission_id or uuid.uuid4().hex
+    logger.debug(f"📤 {len(chunks)} ta bo'lak, JSON hajmi: {sum(c.size for c in chunks) / 1024 / 1024:.2f} MB")
+    client = get_http_client()
+
+    results = []
+    upstream_down = False
+    for chunk in chunks:
+        if chunk.index in done:
+            results.append({
+                "index": chunk.index, "questions": chunk.questions, "bytes": chunk.size,
+                "attempts": 0, "success": True, "status": None, "error": None, "retryable": False,
+            })
+            continue
+        if upstream_down:
+            results.append({
+                "index": chunk.index, "questions": chunk.questions, "bytes": chunk.size,
+                "attempts": 0, "success": False, "status": None,
+                "error": "Oldingi bo'lak yuborilmadi", "retryable": True,
+            })
+            continue
+        result = await _post_chunk(client, chunk, len(chunks), f"{submission_id}-{chunk.index}")
+        upstream_down = not result["success"] and result["retryable"]
+        results.append(result)
+
+    failed = [r for r in results if not r["success"]]
+    error = None
+    if failed:
+        error = failed[0]["error"]
+        if len(chunks) > 1:
+            error = f"{len(failed)}/{len(chunks)} bo'lak yuborilmadi; {failed[0]['index'] + 1}-bo'lak: {error}"
+    return {
+        "success": not failed,
+        "submission_id": submission_id,
+        "sent": sum(r["questions"] for r in results if r["success"]),
+        "error": error,
+        "chunks": results,
+    }
+
+
+class StoredChunk:
+    """Outbox'dagi bo'lak: tana bazada gzip ko'rinishida, yuborish paytida bo'laklab o'qiladi."""
+
+    __slots__ = ("outbox", "entry_id", "index", "questions", "size")
+
+    def __init__(self, outbox: "Outbox", entry_id: str, index: int, questions: int, size: int):
+        self.outbox = outbox
+        self.entry_id = entry_id
+        self.index = index
+        self.questions = questions
+        self.size = size
+
+    async def open(self) -> Iterator[bytes]:
+        blob = await asyncio.to_thread(self.outbox._read_chunk, self.entry_id, self.index)
+        return _gunzip_fragments(blob)
+
+
+class Outbox:
+    """Upstream'ga yuboriladigan payload'larning SQLite navbati (restart'da yo'qolmaydi).
+
+    Har bir yozuv id'si submission_id sifatida ishlatiladi, shuning uchun qayta
+    yuborishda bo'laklar avvalgi Idempotency-Key'larni oladi. Yozuvni bir vaqtda
+    faqat bitta yuboruvchi "lease" orqali egallaydi.
+
+    Payload yozilayotganda bo'laklarga ajratiladi va har bir bo'lak tanasi
+    ``outbox_chunks`` da alohida gzip bo'lib saqlanadi — qayta yuborishda hujjat
+    lug'ati qayta tuzilmaydi, bo'lak tanasi bazadan oqim bilan o'qiladi.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Oxirgi yuborish vaqtinchalik xatolik bilan tugagan bo'lsa — yangi payload'lar
+        # darhol yuborilmaydi, navbatga qo'yiladi va drainer tezligida yuboriladi
+        self.upstream_ok = True
+        self.stats = {"queued": 0, "sent": 0, "deferred": 0, "failed": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT,
+                    status TEXT NOT NULL,
+                    questions INTEGER NOT NULL,
+                    done_chunks TEXT NOT NULL DEFAULT '[]',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    next_attempt_at REAL NOT NULL,
+                    lease_until REAL NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_chunks (
+                    entry_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    questions INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    body BLOB NOT NULL,
+                    PRIMARY KEY (entry_id, idx)
+                )
+            """)
+        conn.close()
+
+    def _insert(self, filename: str, chunks: List[SubmitChunk], questions: int) -> str:
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        # Tanalar to'liq JSON bytes sifatida yig'ilmaydi — bo'laklar to'g'ridan-to'g'ri siqiladi
+        rows = [
+            (entry_id, chunk.index, chunk.questions, chunk.size, _gzip_fragments(chunk.iter_body(), 1))
+            for chunk in chunks
+        ]
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO outbox (id, filename, status, questions, created_at, updated_at,"
+                " next_attempt_at, lease_until) VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)",
+                (entry_id, filename, questions, now, now, now, now + OUTBOX_LEASE),
+            )
+            conn.executemany(
+                "INSERT INTO outbox_chunks (entry_id, idx, questions, size, body) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        conn.close()
+        return entry_id
+
+    def _claim(self, entry_id: str) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE outbox SET lease_until = ? WHERE id = ? AND status = 'pending' AND lease_until <= ?",
+                (now + OUTBOX_LEASE, entry_id, now),
+            )
+        conn.close()
+        return cur.rowcount == 1
+
+    def _load(self, entry_id: str) -> Optional[sqlite3.Row]:
+        """Yozuv holati (bo'lak tanalarisiz)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT id, attempts, done_chunks FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        conn.close()
+        return row
+
+    def _load_chunks(self, entry_id: str) -> List[StoredChunk]:
+        """Yozuv bo'laklari (tanalar ``StoredChunk.open`` da o'qiladi)."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, questions, size FROM outbox_chunks WHERE entry_id = ? ORDER BY idx", (entry_id,)
+            ).fetchall()
+        conn.close()
+        return [StoredChunk(self, entry_id, r["idx"], r["questions"], r["size"]) for r in rows]
+
+    def _read_chunk(self, entry_id: str, index: int) -> bytes:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT body FROM outbox_chunks WHERE entry_id = ? AND idx = ?", (entry_id, index)
+            ).fetchone()
+        conn.close()
+        return row["body"]
+
+    def _release(self, entry_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE outbox SET lease_until = 0 WHERE id = ?", (entry_id,))
+        conn.close()
+
+    def _record(self, entry_id: str, status: str, attempts: int, done_chunks: list, error: Optional[str]):
+        now = time.time()
+        with self._connect() as conn:
+            if status == "sent":
+                conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+                conn.execute("DELETE FROM outbox_chunks WHERE entry_id = ?", (entry_id,))
+            else:
+                delay = min(OUTBOX_RETRY_BACKOFF_MAX, OUTBOX_RETRY_BACKOFF * (2 ** max(0, attempts - 1)))
+                conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, done_chunks = ?, last_error = ?,"
+                    " updated_at = ?, next_attempt_at = ?, lease_until = 0 WHERE id = ?",
+                    (status, attempts, json.dumps(sorted(done_chunks)), error, now, now + delay, entry_id),
+                )
+        conn.close()
+
+    def _due(self, limit: int) -> List[str]:
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ?"
+                " ORDER BY created_at LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+        conn.close()
+        return [row["id"] for row in rows]
+
+    def _list(self, status: Optional[str], limit: int) -> dict:
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            query = (
+                "SELECT id, filename, status, questions, done_chunks, attempts, last_error,"
+                " created_at, updated_at, next_attempt_at FROM outbox"
+            )
+            params: tuple = ()
+            if status:
+                query += " WHERE status = ?"
+                params = (status,)
+            rows = conn.execute(query + " ORDER BY created_at LIMIT ?", params + (limit,)).fetchall()
+        conn.close()
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            entry["done_chunks"] = json.loads(entry["done_chunks"])
+            entries.append(entry)
+        return {"counts": counts, "entries": entries}
+
+    def _purge_failed(self, retention: float) -> int:
+        """``retention`` soniyadan beri o'zgarmagan "failed" yozuvlarni bo'laklari bilan o'chirish."""
+        cutoff = time.time() - retention
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM outbox_chunks WHERE entry_id IN"
+                " (SELECT id FROM outbox WHERE status = 'failed' AND updated_at < ?)",
+                (cutoff,),
+            )
+            cur = conn.execute("DELETE FROM outbox WHERE status = 'failed' AND updated_at < ?", (cutoff,))
+        conn.close()
+        return cur.rowcount
+
+    def _delete(self, entry_id: str) -> str:
+        """Yozuvni o'chirish. Qaytaradi: deleted / missing / busy (hozir yuborilmoqda)."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute("DELETE FROM outbox WHERE id = ? AND lease_until <= ?", (entry_id, now))
+            if cur.rowcount == 1:
+                conn.execute("DELETE FROM outbox_chunks WHERE entry_id = ?", (entry_id,))
+                result = "deleted"
+            else:
+                exists = conn.execute("SELECT 1 FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+                result = "busy" if exists else "missing"
+        conn.close()
+        return result
+
+    def _requeue(self, entry_id: str) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ?"
+                " WHERE id = ? AND status = 'failed'",
+                (now, now, entry_id),
+            )
+        conn.close()
+        return cur.rowcount == 1
+
+    async def add(self, filename: str, chunks: List[SubmitChunk], questions: int) -> str:
+        """Payload bo'laklarini navbatga yozish. Yozuv chaqiruvchi tomonidan egallangan (lease) holda qaytadi."""
+        entry_id = await asyncio.to_thread(self._insert, filename, chunks, questions)
+        self.stats["queued"] += 1
+        return entry_id
+
+    async def release(self, entry_id: str):
+        """Egallangan yozuvni yubormasdan drainer'ga qoldirish."""
+        await asyncio.to_thread(self._release, entry_id)
+
+    async def deliver(self, entry_id: str, chunks: Optional[List[SubmitChunk]] = None) -> tuple:
+        """Egallangan yozuvni yuborish. Qaytaradi: (status, report) — status: sent/pending/failed.
+
+        ``chunks`` — yozuv hozirgina ``add`` qilingan bo'lsa xotiradagi bo'laklar
+        (bazadan qayta o'qilmaydi); drainer uchun bo'lak tanalari bazadan oqim bilan o'qiladi.
+        """
+        row = await asyncio.to_thread(self._load, entry_id)
+        done = set(json.loads(row["done_chunks"]))
+        try:
+            if chunks is None:
+                chunks = await asyncio.to_thread(self._load_chunks, entry_id)
+            report = await submit_chunks(chunks, entry_id, done)
+        except BaseException:
+            await asyncio.to_thread(self._release, entry_id)
+            raise
+
+        done.update(chunk["index"] for chunk in report["chunks"] if chunk["success"])
+        attempts = row["attempts"] + 1
+        if report["success"]:
+            status = "sent"
+        elif any(not chunk["success"] and not chunk["retryable"] for chunk in report["chunks"]):
+            status = "failed"  # 4xx/redirect — qayta yuborish yordam bermaydi
+        elif OUTBOX_MAX_ATTEMPTS and attempts >= OUTBOX_MAX_ATTEMPTS:
+            status = "failed"
+        else:
+            status = "pending"
+        await asyncio.to_thread(self._record, entry_id, status, attempts, list(done), report["error"])
+
+        if status == "sent":
+            self.stats["sent"] += 1
+            self.upstream_ok = True
+        elif status == "pending":
+            self.stats["deferred"] += 1
+            self.upstream_ok = False
+        else:
+            self.stats["failed"] += 1
+        return status, report
+
+    async def drain_once(self) -> int:
+        """Vaqti kelgan yozuvlarni OUTBOX_DRAIN_RATE tezligida yuborish. Qaytaradi: yuborishga urinishlar soni."""
+        interval = 1.0 / OUTBOX_DRAIN_RATE if OUTBOX_DRAIN_RATE > 0 else 0.0
+        attempted = 0
+        for entry_id in await asyncio.to_thread(self._due, 50):
+            if not await asyncio.to_thread(self._claim, entry_id):
+                continue  # boshqa yuboruvchi (inline yoki boshqa worker) egallagan
+            started = time.monotonic()
+            status, _ = await self.deliver(entry_id)
+            attempted += 1
+            logger.info(f"📮 Outbox {entry_id}: {status}")
+            if status == "pending":
+                break  # upstream hali tiklanmagan — qolganlarini keyingi aylanishda
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+        return attempted
+
+    async def run_drainer(self):
+        """Fon vazifasi: navbatni davriy ravishda bo'shatish va eskirgan "failed" yozuvlarni tozalash."""
+        while True:
+            try:
+                await self.drain_once()
+                if OUTBOX_FAILED_RETENTION > 0:
+                    purged = await asyncio.to_thread(self._purge_failed, OUTBOX_FAILED_RETENTION)
+                    if purged:
+                        logger.info(f"🧹 Outbox: {purged} ta eskirgan failed yozuv o'chirildi")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Outbox drainer xatolik: {e}")
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    async def list_entries(self, status: Optional[str] = None, limit: int = 100) -> dict:
+        return await asyncio.to_thread(self._list, status, limit)
+
+    async def requeue(self, entry_id: str) -> bool:
+        """"failed" yozuvni qayta navbatga qo'yish (qabul qilingan bo'laklar qayta yuborilmaydi)."""
+        return await asyncio.to_thread(self._requeue, entry_id)
+
+    async def delete(self, entry_id: str) -> str:
+        """Yozuvni payload'i bilan o'chirish (hozir yuborilayotgan yozuv o'chirilmaydi)."""
+        return await asyncio.to_thread(self._delete, entry_id)
+
+
+outbox = Outbox(OUTBOX_PATH) if OUTBOX_ENABLED else None
+
+
+class SpooledUpload:
+    """Diskka yozilgan (spool) yuklangan fayl: yo'li, hajmi va SHA-256."""
+
+    __slots__ = ("filename", "path", "size", "sha256")
+
+    def __init__(self, filename: str, path: Path, size: int, sha256: str):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def cleanup(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Faylni o'chirishda xatolik: {e}")
+
+
+class UploadTooLarge(Exception):
+    """Yuklangan fayl MAX_UPLOAD_FILE_BYTES dan katta."""
+
+
+class UploadFormError(HTTPException):
+    """So'rov tanasi qabul qilinmadi — javob ``{"success": False, "error": ...}`` ko'rinishida.
+
+    HTTPException'dan meros: FastAPI tana o'qishdagi boshqa xatoliklarni 400 ga aylantiradi.
+    """
+
+    def __init__(self, error: str, status_code: int = 422):
+        super().__init__(status_code=status_code, detail=error)
+
+
+class RequestTooLarge(UploadFormError):
+    """So'rov yoki undagi fayl hajm chegarasidan oshdi (413)."""
+
+    def __init__(self, error: str):
+        super().__init__(error, status_code=413)
+
+
+@app.exception_handler(UploadFormError)
+async def upload_form_error_handler(request: Request, exc: UploadFormError):
+    return JSONResponse({"success": False, "error": exc.detail}, status_code=exc.status_code)
+
+
+class SpoolWriter:
+    """Kelayotgan fayl baytlarini SPOOL_DIR ga yozish: hajm chegarasi va SHA-256 yo'l-yo'lakay."""
+
+    def __init__(self, filename: str, max_bytes: int):
+        SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.path = SPOOL_DIR / f"{uuid.uuid4().hex}.docx"
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._out = open(self.path, "wb")
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"Fayl juda katta (chegara: {self.max_bytes / 1024 / 1024:.1f} MB)")
+        self._digest.update(chunk)
+        await asyncio.to_thread(self._out.write, chunk)
+
+    def finish(self) -> SpooledUpload:
+        self._out.close()
+        return SpooledUpload(self.filename, self.path, self.size, self._digest.hexdigest())
+
+    def discard(self):
+        self._out.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadForm:
+    """``read_upload_form`` natijasi: oddiy maydonlar va diskka spool qilingan fayllar."""
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}  # maydon nomi → [SpooledUpload]
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Maydon qiymati; bo'sh satr ham yo'q hisoblanadi (FastAPI ``Form(None)`` kabi)."""
+        value = self.fields.get(name)
+        return value if value else default
+
+    def cleanup(self):
+        for uploads in self.files.values():
+            for upload in uploads:
+                upload.cleanup()
+
+
+FORM_FIELD_MAX_BYTES = 64 * 1024
+
+
+async def read_upload_form(request: Request, limits: dict) -> UploadForm:
+    """multipart/form-data tanasini ``request.stream()`` dan o'qish; fayl qismlari to'g'ridan-to'g'ri
+    SPOOL_DIR ga yoziladi (oraliq vaqtinchalik fayl va ikkinchi nusxasiz).
+
+    ``limits`` — fayl maydoni → baytlardagi chegara; boshqa maydondagi fayllar rad etiladi.
+    Fayl chegaradan oshsa, tananing qolgani o'qilmasdan RequestTooLarge (413);
+    tana multipart bo'lmasa — UploadFormError (422). Xatolikda yozilgan fayllar o'chiriladi.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadFormError("multipart/form-data kutilgan")
+
+    # Parser callback'lari sinxron — hodisalar yig'ilib, har bir bo'lakdan keyin async ishlanadi
+    events = []
+    header_field = bytearray()
+    header_value = bytearray()
+    headers = {}
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        events.append(("part", dict(headers)))
+        headers.clear()
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    form = UploadForm()
+    writer: Optional[SpoolWriter] = None
+    field: Optional[bytearray] = None
+    name = ""
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "part":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    name = options.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" in options:
+                        if name not in limits:
+                            raise UploadFormError(f"Kutilmagan fayl maydoni: {name}")
+                        writer = SpoolWriter(options[b"filename"].decode("utf-8", "replace"), limits[name])
+                    else:
+                        field = bytearray()
+                elif kind == "data":
+                    if writer is not None:
+                        try:
+                            await writer.write(value)
+                        except UploadTooLarge as e:
+                            raise RequestTooLarge(f"{writer.filename}: {e}")
+                    elif field is not None:
+                        field.extend(value)
+                        if len(field) > FORM_FIELD_MAX_BYTES:
+                            raise RequestTooLarge(f"{name}: maydon qiymati juda katta")
+                elif writer is not None:
+                    upload = writer.finish()
+                    writer = None
+                    if upload.filename or upload.size:
+                        form.files.setdefault(name, []).append(upload)
+                    else:
+                        upload.cleanup()  # brauzer fayl tanlanmaganda bo'sh qism yuboradi
+                elif field is not None:
+                    form.fields[name] = field.decode("utf-8", "replace")
+                    field = None
+            events.clear()
+        parser.finalize()
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        form.cleanup()
+        raise
+    return form
+
+
+def multipart_openapi(file_field: str, many: bool, *fields: str) -> dict:
+    """``read_upload_form`` ishlatuvchi endpoint'lar uchun OpenAPI so'rov tanasi tavsifi."""
+    file_schema = {"type": "string", "format": "binary"}
+    properties = {file_field: {"type": "array", "items": file_schema} if many else file_schema}
+    properties.update({field: {"type": "string"} for field in fields})
+    schema = {"type": "object", "properties": properties, "required": [file_field]}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+
+def cleanup_spool_dir():
+    """Oldingi ishga tushirishlardan qolib ketgan spool fayllarni o'chirish.
+
+    Faqat SPOOL_STALE_AFTER soniyadan beri o'zgarmagan fayllar o'chiriladi: boshqa
+    worker'lar hozir yozayotgan yoki ishlayotgan spool'lar (ZIP arxivlar ham) tegilmaydi.
+    """
+    if not SPOOL_DIR.exists():
+        return
+    cutoff = time.time() - SPOOL_STALE_AFTER
+    removed = 0
+    for path in SPOOL_DIR.glob("*.docx"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"🧹 {removed} ta eskirgan spool fayl o'chirildi")
+
+
+class DocxArchive:
+    """Diskka spool qilingan ZIP arxiv ichidagi DOCX fayllar.
+
+    Markaziy katalog bir marta o'qiladi; har bir DOCX navbati kelganda alohida
+    spool faylga bo'laklab chiqariladi, shuning uchun xotira sarfi a'zolar
+    soniga bog'liq emas.
+    """
+
+    def __init__(self, upload: SpooledUpload):
+        self.upload = upload
+        try:
+            self._zf = zipfile.ZipFile(upload.path)
+        except zipfile.BadZipFile:
+            upload.cleanup()
+            raise ValueError(f"{upload.filename}: ZIP arxiv emas")
+
+        self.members = []
+        self.skipped = []
+        for info in self._zf.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename
+            basename = name.rsplit("/", 1)[-1]
+            # macOS metama'lumotlari va Word'ning vaqtinchalik "~$" fayllari
+            if name.startswith("__MACOSX/") or basename.startswith(("._", "~$")):
+                continue
+            if basename.lower().endswith(".docx"):
+                self.members.append(info)
+            else:
+                self.skipped.append(name)
+
+        if len(self.members) > ZIP_MAX_MEMBERS:
+            self.close()
+            raise ValueError(f"{upload.filename}: arxivda juda ko'p DOCX ({len(self.members)}, chegara: {ZIP_MAX_MEMBERS})")
+
+    def _extract(self, info: zipfile.ZipInfo) -> SpooledUpload:
+        """A'zoni SPOOL_DIR ga bo'laklab chiqarish (siqilgan "bomba"lar ham chegarada to'xtaydi)."""
+        SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        path = SPOOL_DIR / f"{uuid.uuid4().hex}.docx"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with self._zf.open(info) as src, open(path, "wb") as out:
+                while True:
+                    chunk = src.read(SPOOL_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_FILE_BYTES:
+                        raise UploadTooLarge(
+                            f"Fayl juda katta (chegara: {MAX_UPLOAD_FILE_BYTES / 1024 / 1024:.1f} MB)"
+                        )
+                    digest.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise
+        return SpooledUpload(info.filename, path, size, digest.hexdigest())
+
+    def loader(self, info: zipfile.ZipInfo) -> Callable[[], Awaitable[SpooledUpload]]:
+        """``_process_one_upload`` uchun: navbati kelganda a'zoni diskka chiqaradi."""
+        async def load():
+            return await asyncio.to_thread(self._extract, info)
+        return load
+
+    def uploads(self) -> list:
+        return [(info.filename, self.loader(info)) for info in self.members]
+
+    def close(self):
+        self._zf.close()
+        self.upload.cleanup()
+
+
+async def read_archive_form(request: Request) -> tuple:
+    """ZIP arxiv formasini o'qib, arxivni ochish. Qaytaradi: (forma, DocxArchive).
+
+    Arxiv ZIP bo'lmasa yoki a'zolar juda ko'p bo'lsa — UploadFormError (422).
+    """
+    form = await read_upload_form(request, {"archive": ZIP_MAX_ARCHIVE_BYTES})
+    uploads = form.files.pop("archive", [])
+    for extra in uploads[1:]:
+        extra.cleanup()
+    if not uploads:
+        raise UploadFormError("ZIP arxivni tanlang")
+    try:
+        return form, await asyncio.to_thread(DocxArchive, uploads[0])
+    except ValueError as e:
+        raise UploadFormError(str(e))
+
+
+class UploadSizeLimitMiddleware:
+    """So'rov tanasini MAX_UPLOAD_REQUEST_BYTES bilan cheklovchi ASGI middleware.
+
+    Content-Length chegaradan katta bo'lsa tana o'qilmasdan 413 qaytadi;
+    Content-Length bo'lmasa (chunked) — o'qish davomida sanaladi va xuddi shu
+    ``{"success": False, "error": ...}`` javobi qaytadi.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        error = f"So'rov hajmi juda katta (chegara: {self.max_bytes / 1024 / 1024:.1f} MB)"
+        headers = dict(scope["headers"])
+        try:
+            content_length = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            content_length = 0
+        if content_length > self.max_bytes:
+            response = JSONResponse({"success": False, "error": error}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise RequestTooLarge(error)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# So'rov tanasi hajmini tana to'liq o'qilishidan oldin cheklash
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_REQUEST_BYTES)
+
+
+class DocumentCache:
+    """Parse natijalari keshi: yuklangan fayl SHA-256 + parser versiyasi bo'yicha.
 
-        for table in doc.tables:
-            for row_idx, row in enumerate(table.rows):
-                if len(row.cells) < 6:  # 6 ustun: savol, tog'ri, noto'g'ri x3, author
-                    continue
+    Xotira qatlami — hajm bo'yicha LRU; umumiy qatlam (``shared``, CACHE_BACKEND) —
+    JSON ko'rinishida, barcha worker'lar uchun. Bir xil fayl bir vaqtda kelsa,
+    parse bir marta bajariladi.
+    """
 
-                # Author faqat ikkinchi qatordan (row_idx == 1)
-                if row_idx == 1 and not author_for_file:
-                    author_for_file = (row.cells[5].text or "").strip()
+    def __init__(self, memory_bytes: int, shared: Optional[CacheBackend]):
+        self._memory = LRUBytesCache(memory_bytes)
+        self.shared = shared
+        self._inflight = {}
+        self.stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "coalesced": 0}
 
-                # Har bir cell uchun data (ustunlar 0–4: savol, correct, wrong1–3)
-                question_data = build_cell_data(row.cells[0], content, image_index)
-                if question_data and question_data.get("image"):
-                    image_index += 1
+    @staticmethod
+    def make_key(content_sha256: str) -> str:
+        """Kontent hash'i + parser versiyasi + natijaga ta'sir qiluvchi sozlamalar."""
+        settings = hashlib.sha256(repr((PARSER_VERSION, IMAGE_SETTINGS)).encode()).hexdigest()[:12]
+        return f"{content_sha256}-{settings}"
 
-                correct_data = build_cell_data(row.cells[1], content, image_index)
-                if correct_data and correct_data.get("image"):
-                    image_index += 1
+    async def store(self, content_sha256: str, result: tuple):
+        """Boshqa yo'l bilan (masalan, preview'da) olingan parse natijasini keshga qo'yish."""
+        key = self.make_key(content_sha256)
+        self._memory.put(key, result, self._result_size(result))
+        if self.shared is not None:
+            await asyncio.to_thread(self._write_shared, key, result)
 
-                wrong1_data = build_cell_data(row.cells[2], content, image_index)
-                if wrong1_data and wrong1_data.get("image"):
-                    image_index += 1
+    @staticmethod
+    def _result_size(result: tuple) -> int:
+        questions, author, images = result
+        text_size = sum(len(q[key]["text"]) for q in questions for key in ANSWER_KEYS)
+        return text_size + len(author) + sum(len(uri) for uri in images.values())
 
-                wrong2_data = build_cell_data(row.cells[3], content, image_index)
-                if wrong2_data and wrong2_data.get("image"):
-                    image_index += 1
+    def _read_shared(self, key: str) -> Optional[tuple]:
+        raw = self.shared.get(key)
+        if raw is None:
+            return None
+        try:
+            data = json.loads(raw)
+            return data["questions"], data["author"], data["images"]
+        except Exception as e:
+            logger.warning(f"⚠️ Kesh yozuvini o'qishda xatolik ({key}): {e}")
+            return None
 
-                wrong3_data = build_cell_data(row.cells[4], content, image_index)
-                if wrong3_data and wrong3_data.get("image"):
-                    image_index += 1
+    def _write_shared(self, key: str, result: tuple):
+        questions, author, images = result
+        self.shared.set(key, _json_bytes({"questions": questions, "author": author, "images": images}))
 
-                # Savol yo'q bo'lsa — butun qatorni tashlaymiz
-                if question_data is None:
-                    continue
+    async def get_or_parse(self, upload: "SpooledUpload", admit: Optional[Callable] = None) -> tuple:
+        """Keshdan olish yoki ``run_parse_stage`` orqali parse qilib saqlash.
 
-                # Javoblarni to'g'ri format qilish (None bo'lsa bo'sh object)
-                def format_answer(answer_data):
-                    """Javobni format qilish - None bo'lsa bo'sh object qaytaradi."""
-                    if answer_data is None:
-                        return {"text": "", "image": None}
-                    return {
-                        "text": answer_data.get("text", "") or "",
-                        "image": answer_data.get("image") or None
-                    }
-
-                # Formatlangan savol (rasm base64 formatida)
-                formatted_question = {
-                    "question": {
-                        "text": question_data.get("text", "") or "",
-                        "image": question_data.get("image") or None
-                    },
-                    "correct": format_answer(correct_data),
-                    "wrong1": format_answer(wrong1_data),
-                    "wrong2": format_answer(wrong2_data),
-                    "wrong3": format_answer(wrong3_data)
-                }
-                
-                # Javoblarni tekshirish - agar bir xil javoblar bo'lsa, ularni takrorlamaslik
-                correct_answer = formatted_question["correct"]
-                wrong_answers = [
-                    ("wrong1", formatted_question["wrong1"]),
-                    ("wrong2", formatted_question["wrong2"]),
-                    ("wrong3", formatted_question["wrong3"])
-                ]
-                
-                # Correct javobni key sifatida saqlash
-                correct_key = f"{correct_answer['text']}|{correct_answer['image']}"
-                seen_answers = [correct_key]
-                
-                # Wrong javoblarni tekshirish
-                for wrong_key, wrong_answer in wrong_answers:
-                    answer_key = f"{wrong_answer['text']}|{wrong_answer['image']}"
-                    
-                    # Agar bu javob allaqachon ko'rilgan bo'lsa (correct yoki boshqa wrong bilan)
-                    if answer_key in seen_answers:
-                        # Agar bo'sh bo'lmasa, uni bo'sh qilish
-                        if wrong_answer['text'] or wrong_answer['image']:
-                            print(f"⚠️ Bir xil javob topildi ({wrong_key}): {answer_key[:50]}... - bo'sh qilindi")
-                            formatted_question[wrong_key] = {"text": "", "image": None}
-                        else:
-                            # Bo'sh bo'lsa ham, key'ni qo'shish (takrorlanishni oldini olish uchun)
-                            seen_answers.append(answer_key)
-                    else:
-                        # Yangi javob, key'ni qo'shish
-                        seen_answers.append(answer_key)
-                
-                questions.append(formatted_question)
+        ``admit(cost)`` — parse'ning o'zini o'rab oluvchi async context manager fabrikasi
+        (admission byudjeti); kesh hit'lari va birlashtirilgan kutishlar uni band qilmaydi,
+        parse narxi (``estimate_parse_cost``) ham faqat kesh miss'da hisoblanadi.
+        Parse'ni boshlagan so'rov bekor qilinsa, kutayotganlardan biri uni o'z fayli
+        bilan qaytadan boshlaydi — qolganlar CancelledError olmaydi.
+        """
+        key = self.make_key(upload.sha256)
 
-        # JSON formatda Laravel API ga yuborish (base64 rasmlar bilan)
-        try:
-            # Vaqtinchalik fayllarni o'chirish (endi kerak emas)
-            for img_path in image_files:
-                try:
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
-                except Exception as e:
-                    print(f"⚠️ Faylni o'chirishda xatolik: {e}")
-
-            async with httpx.AsyncClient(
-                timeout=120.0,  # Base64 katta bo'lishi mumkin
-                follow_redirects=True,  # 302 redirect'larni avtomatik kuzatish
-                verify=False  # SSL sertifikat tekshiruvini o'chirish (kerak bo'lsa)
-            ) as client:
-                # JSON payload — API questions ni array sifatida qabul qiladi
-                payload = {
-                    "test_id": int(test) if test else None,
-                    "language": language or "uz",
-                    "grade_id": int(class_id) if class_id else None,
-                    "subject_id": int(subject) if subject else None,
-                    "author": author_for_file or "",
-                    "questions": questions,
-                }
-
-                # Base64 rasmlar hajmini tekshirish
-                total_size = 0
-                for q in questions:
-                    for key in ['question', 'correct', 'wrong1', 'wrong2', 'wrong3']:
-                        if q.get(key, {}).get('image'):
-                            total_size += len(q[key]['image'])
-                
-                print(f"📤 {len(questions)} ta savol yuborilmoqda...")
-                print(f"📤 Base64 rasmlar umumiy hajmi: {total_size / 1024 / 1024:.2f} MB")
-
-                # POST request (JSON format)
-                response = await client.post(
-                    QUESTIONS_API_URL,
-                    json=payload,
-                    headers={
-                        "Content-Type": "application/json",
-                        "Accept": "application/json",
-                        "User-Agent": "FastAPI-DOCX-Parser/1.0"
-                    }
-                )
-                
-                # Response statusni tekshirish
-                print(f"📡 Response status: {response.status_code}")
-                print(f"📡 Response headers: {dict(response.headers)}")
-                
-                # 302 yoki 3xx status kod bo'lsa
-                if response.status_code in [301, 302, 303, 307, 308]:
-                    print(f"⚠️ Redirect detected: {response.headers.get('Location', 'N/A')}")
-                    return (False, len(questions), f"Server redirect (Status: {response.status_code})")
-                
-                response.raise_for_status()
-                api_response = response.json()
-
-                # Vaqtinchalik fayllarni o'chirish
-                for img_path in image_files:
-                    try:
-                        if os.path.exists(img_path):
-                            os.remove(img_path)
-                    except Exception as e:
-                        print(f"⚠️ Faylni o'chirishda xatolik: {e}")
-
-                return (True, len(questions), None)
-        except httpx.HTTPStatusError as e:
-            # HTTP xatolik (4xx, 5xx)
-            # Xatolik bo'lsa ham fayllarni o'chirish
-            for img_path in image_files:
-                try:
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
-                except:
-                    pass
-            
-            error_detail = f"Status: {e.response.status_code}"
+        while True:
+            result = self._memory.get(key)
+            if result is not None:
+                self.stats["memory_hits"] += 1
+                return result
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.stats["coalesced"] += 1
             try:
-                error_body = e.response.json()
-                error_detail += f", Response: {error_body}"
-            except:
-                error_detail += f", Response: {e.response.text[:500]}"
-            
-            print(f"❌ API HTTP xatolik: {error_detail}")
-            return (False, len(questions), f"API xatolik (Status: {e.response.status_code}): {str(e)}")
-        except httpx.RequestError as e:
-            # Network xatolik
-            for img_path in image_files:
-                try:
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
-                except:
-                    pass
-            
-            print(f"❌ API ga ulanishda xatolik: {e}")
-            return (False, 0, f"API ga ulanishda xatolik: {str(e)}")
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise  # bu so'rovning o'zi bekor qilingan
+                # Boshlagan so'rov bekor qilindi — parse'ni shu so'rov davom ettiradi
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = None
+            if self.shared is not None:
+                result = await asyncio.to_thread(self._read_shared, key)
+                if result is not None:
+                    self.stats["shared_hits"] += 1
+
+            if result is None:
+                self.stats["misses"] += 1
+                if admit is None:
+                    result = await run_parse_stage(str(upload.path))
+                else:
+                    cost = await asyncio.to_thread(estimate_parse_cost, upload)
+                    async with admit(cost):
+                        result = await run_parse_stage(str(upload.path))
+                if self.shared is not None:
+                    await asyncio.to_thread(self._write_shared, key, result)
+
+            self._memory.put(key, result, self._result_size(result))
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
         except Exception as e:
-            # Boshqa xatoliklar
-            for img_path in image_files:
-                try:
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
-                except:
-                    pass
-            
-            print(f"❌ API ga yuborishda noma'lum xatolik: {e}")
-            import traceback
-            traceback.print_exc()
-            return (False, len(questions) if 'questions' in dir() else 0, str(e))
+            future.set_exception(e)
+            # Kutayotganlar bo'lmasa "exception was never retrieved" ogohlantirishi chiqmasin
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
 
-    except Exception as e:
-        for img_path in image_files:
+
+document_cache = DocumentCache(DOC_CACHE_BYTES, open_shared_cache_backend("documents", DOC_CACHE_SHARED_BYTES))
+
+
+def estimate_parse_cost(upload: SpooledUpload) -> int:
+    """Faylni parse qilib yuborish uchun taxminiy xotira (baytlarda) — DOCX markaziy katalogidan.
+
+    XML qismlar lxml/python-docx daraxtida, media esa dekodlangan rasm va base64
+    ko'rinishida bir necha barobar ko'p joy egallaydi.
+    """
+    xml_bytes = 0
+    media_bytes = 0
+    try:
+        with zipfile.ZipFile(upload.path) as zf:
+            for info in zf.infolist():
+                if info.filename.startswith("word/media/"):
+                    media_bytes += info.file_size
+                elif info.filename.endswith((".xml", ".rels")):
+                    xml_bytes += info.file_size
+    except (zipfile.BadZipFile, OSError):
+        return upload.size  # parse baribir tezda xatolik beradi
+    return upload.size + xml_bytes * ADMISSION_XML_FACTOR + media_bytes * ADMISSION_MEDIA_FACTOR
+
+
+class AdmissionRejected(RuntimeError):
+    """Admission navbati to'lgan — ish navbatga qo'yilmadi."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server band — navbat to'lgan, keyinroq urinib ko'ring")
+        self.retry_after = retry_after
+
+
+class _AdmissionWaiter:
+    __slots__ = ("future", "cost")
+
+    def __init__(self, future: asyncio.Future, cost: int):
+        self.future = future
+        self.cost = cost
+
+
+class AdmissionScheduler:
+    """Parse'larni umumiy xotira (bayt) va CPU (bir vaqtdagi parse'lar) byudjeti ostida ishga tushirish.
+
+    Sig'magan ishlar mijoz bo'yicha navbatga qo'yiladi va mijozlar orasida
+    navbatma-navbat (round-robin) ruxsat beriladi; navbat boshidagi ish sig'maguncha
+    keyingilari o'tib ketmaydi, shuning uchun katta fayllar ochlikda qolmaydi.
+    Byudjetdan katta bitta ish hech narsa ishlamayotganda yolg'iz ishga tushadi.
+    """
+
+    def __init__(self, memory_budget: int, max_running: int, max_queued: int, max_queued_per_client: int):
+        self.memory_budget = memory_budget
+        self.max_running = max(1, max_running)
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.running = 0
+        self.memory_in_use = 0
+        self._queues = OrderedDict()  # mijoz → deque[_AdmissionWaiter], tartib — navbat aylanasi
+        self._avg_hold = 1.0  # ish davomiyligining sirg'aluvchi o'rtachasi (Retry-After uchun)
+        self.stats = {"admitted": 0, "waited": 0, "rejected": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def check_capacity(self, client: str) -> Optional[int]:
+        """Navbat to'lgan bo'lsa Retry-After (soniya), aks holda None.
+
+        So'rov boshida (fayllar spool qilinishidan oldin) tezkor rad etish uchun;
+        chegaraning o'zi ``admit`` da, navbatga qo'yish paytida tekshiriladi.
+        """
+        client_queued = len(self._queues.get(client, ()))
+        if self.queued < self.max_queued and client_queued < self.max_queued_per_client:
+            return None
+        self.stats["rejected"] += 1
+        ADMISSION_REJECTED.inc()
+        return self._retry_after()
+
+    def _retry_after(self) -> int:
+        waves = (self.queued + self.running) / self.max_running
+        return max(1, min(300, math.ceil(self._avg_hold * waves)))
+
+    def _fits(self, cost: int) -> bool:
+        if self.running >= self.max_running:
+            return False
+        return self.running == 0 or not self.memory_budget or self.memory_in_use + cost <= self.memory_budget
+
+    def _grant(self, cost: int):
+        self.running += 1
+        self.memory_in_use += cost
+        self.stats["admitted"] += 1
+
+    def _dispatch(self):
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if not self._fits(waiter.cost):
+                return
+            queue.popleft()
+            self._grant(waiter.cost)
+            waiter.future.set_result(None)
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+
+    def _release(self, cost: int, held: float):
+        self.running -= 1
+        self.memory_in_use -= cost
+        self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+        self._dispatch()
+
+    def _remove(self, client: str, waiter: _AdmissionWaiter):
+        queue = self._queues.get(client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[client]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, client: str, cost: int):
+        """Byudjetda joy bo'lguncha kutib, ish davomida uni band qilish.
+
+        Navbat (umumiy yoki mijozniki) to'lgan bo'lsa AdmissionRejected ko'tariladi.
+        """
+        started = time.monotonic()
+        if not self._queues and self._fits(cost):
+            self._grant(cost)
+        else:
+            if self.check_capacity(client) is not None:
+                raise AdmissionRejected(self._retry_after())
+            waiter = _AdmissionWaiter(asyncio.get_running_loop().create_future(), cost)
+            self._queues.setdefault(client, deque()).append(waiter)
+            self.stats["waited"] += 1
             try:
-                if os.path.exists(img_path):
-                    os.remove(img_path)
-            except:
-                pass
-        print(f"❌ Server xatolik: {e}")
-        import traceback
-        traceback.print_exc()
-        return (False, 0, str(e))
-
-
-@app.post("/parse-docx/")
-async def parse_docx(
-    files: List[UploadFile] = File(...),
-    test: Optional[str] = Form(None),
-    language: Optional[str] = Form(None),
-    class_id: Optional[str] = Form(None),
-    subject: Optional[str] = Form(None),
-):
-    """Bir yoki bir nechta DOCX faylni ketma-ket parse qilib, har birini API ga yuboradi."""
-    if not files:
-        return JSONResponse(
-            {"success": False, "error": "Kamida bitta fayl tanlang"},
-            status_code=422,
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release(cost, 0.0)  # ruxsat berilgan, lekin so'rov bekor bo'lgan
+                else:
+                    self._remove(client, waiter)
+                raise
+        ADMISSION_WAIT.observe(time.monotonic() - started)
+
+        admitted = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(cost, time.monotonic() - admitted)
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "max_running": self.max_running,
+            "memory_in_use": self.memory_in_use,
+            "memory_budget": self.memory_budget,
+            "queued": self.queued,
+            "queued_by_client": {client: len(queue) for client, queue in self._queues.items()},
+            "avg_hold_seconds": round(self._avg_hold, 3),
+            **self.stats,
+        }
+
+
+admission = AdmissionScheduler(
+    ADMISSION_MEMORY_BYTES, ADMISSION_MAX_RUNNING, ADMISSION_MAX_QUEUED, ADMISSION_MAX_QUEUED_PER_CLIENT
+)
+
+
+def client_id(request: Request) -> str:
+    """Navbatdagi adolat uchun mijoz identifikatori (ADMISSION_TRUST_FORWARDED bo'lsa X-Forwarded-For)."""
+    if ADMISSION_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def admission_rejected(retry_after: int, report: Optional[dict] = None) -> JSONResponse:
+    """429 + Retry-After. ``report`` — fayllarning bir qismi qayta ishlangan bo'lsa, ularning hisoboti."""
+    return JSONResponse(
+        {
+            **(report or {}),
+            "success": False,
+            "error": "Server band — navbat to'lgan, keyinroq urinib ko'ring",
+            "retry_after": retry_after,
+        },
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def _rejected_delivery(retry_after: int) -> dict:
+    """Admission navbatiga sig'magan (parse qilinmagan) fayl natijasi."""
+    return {"chunks": [], "queued": False, "outbox_id": None, "rejected": True, "retry_after": retry_after}
+
+
+async def _parse_and_send_one_file(
+    upload: SpooledUpload,
+    test: Optional[str],
+    language: Optional[str],
+    class_id: Optional[str],
+    subject: Optional[str],
+    admit: Optional[Callable] = None,
+) -> tuple:
+    """Bitta (diskka spool qilingan) DOCX faylni parse qilib API ga yuboradi.
+
+    ``admit`` faqat parse bosqichini o'raydi — upstream'ga yuborish (qayta urinishlar
+    bilan) admission byudjetini band qilmaydi, keyingi fayl parse'i bilan ustma-ust ketadi.
+    Navbat to'lgan bo'lsa AdmissionRejected chaqiruvchiga o'tkaziladi (fayl xatoligi emas).
+
+    Qaytaradi: (success, count, error_msg, delivery) — delivery: bo'laklar natijasi va
+    payload outbox'da qolgan bo'lsa (``queued``) uning id'si.
+    """
+    try:
+        # Avval yuklangan fayl qayta yuborilsa — parse qilinmaydi, faqat payload qayta tuziladi
+        questions, author_for_file, images = await document_cache.get_or_parse(upload, admit)
+        QUESTIONS_PER_FILE.observe(len(questions))
+
+        # JSON formatda Laravel API ga yuborish (base64 rasmlar bilan)
+        payload = build_questions_payload(
+            questions, images, author_for_file, test, language, class_id, subject
+        )
+
+        logger.info(f"📤 {len(questions)} ta savol yuborilmoqda...")
+
+        chunks = split_payload(payload)
+        if outbox is None:
+            report = await submit_chunks(chunks)
+            delivery = {"chunks": report["chunks"], "queued": False, "outbox_id": None}
+            return (report["success"], report["sent"], report["error"], delivery)
+
+        # Avval outbox'ga yoziladi — yuborish muvaffaqiyatsiz bo'lsa ham payload yo'qolmaydi
+        entry_id = await outbox.add(upload.filename, chunks, len(questions))
+        if not outbox.upstream_ok:
+            await outbox.release(entry_id)
+            logger.info(f"📮 Upstream ishlamayapti — {len(questions)} ta savol navbatga qo'yildi ({entry_id})")
+            delivery = {"chunks": [], "queued": True, "outbox_id": entry_id}
+            return (False, 0, "Upstream hozircha javob bermayapti — savollar navbatga qo'yildi", delivery)
+
+        status, report = await outbox.deliver(entry_id, chunks)
+        delivery = {"chunks": report["chunks"], "queued": status == "pending", "outbox_id": entry_id}
+        if status == "pending":
+            logger.info(f"📮 Yuborilmagan bo'laklar navbatda qoldi ({entry_id})")
+        return (report["success"], report["sent"], report["error"], delivery)
+
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.exception(f"❌ Server xatolik: {e}")
+        return (False, 0, str(e), {"chunks": [], "queued": False, "outbox_id": None})
+
+
+async def _process_one_upload(
+    idx: int,
+    total: int,
+    filename: str,
+    load: Callable[[], Awaitable[SpooledUpload]],
+    test: Optional[str],
+    language: Optional[str],
+    class_id: Optional[str],
+    subject: Optional[str],
+    on_event: Optional[Callable[[dict], None]] = None,
+    client: str = "local",
+    rejected_after: Optional[int] = None,
+) -> tuple:
+    """Bitta yuklangan faylni qayta ishlash. Qaytaradi: (success, count, error_msg, delivery).
+
+    Parse bosqichi admission byudjeti ostida ishlaydi (``client`` — navbatdagi adolat uchun).
+    Navbat to'lgan bo'lsa (yoki ``rejected_after`` berilgan — shu so'rovning oldingi fayli
+    rad etilgan) fayl o'qilmaydi, ``delivery["rejected"]`` bilan qaytadi.
+    """
+    if on_event:
+        on_event({"type": "file_started", "index": idx, "file": filename})
+    upload = None
+    try:
+        if rejected_after is not None:
+            raise AdmissionRejected(rejected_after)
+        upload = await load()
+        success, count, error_msg, delivery = await _parse_and_send_one_file(
+            upload, test, language, class_id, subject, partial(admission.admit, client)
         )
+    except AdmissionRejected as e:
+        success, count, error_msg, delivery = False, 0, str(e), _rejected_delivery(e.retry_after)
+    except Exception as e:
+        success, count, error_msg, delivery = False, 0, str(e), {"chunks": [], "queued": False, "outbox_id": None}
+    finally:
+        if upload is not None:
+            upload.cleanup()
+
+    rejected = delivery.get("rejected", False)
+    FILES_TOTAL.inc(
+        result="success" if success else "queued" if delivery["queued"] else "rejected" if rejected else "failed"
+    )
+    if success:
+        logger.info(f"✅ Fayl {idx + 1}/{total}: {count} ta savol yuborildi")
+    elif rejected:
+        logger.warning(f"🚦 Fayl {idx + 1}/{total} ({filename}): admission navbati to'lgan — rad etildi")
+    elif delivery["queued"]:
+        logger.info(f"📮 Fayl {idx + 1}/{total} ({filename}): navbatga qo'yildi — {error_msg}")
+    else:
+        error_msg = error_msg or "Noma'lum xatolik"
+        logger.error(f"❌ Fayl {idx + 1}/{total} ({filename}): {error_msg}")
+    if on_event:
+        on_event({
+            "type": "file_done", "index": idx, "file": filename,
+            "success": success, "count": count, "error": error_msg,
+            "queued": delivery["queued"], "rejected": rejected, "chunks": delivery["chunks"],
+        })
+    return success, count, error_msg, delivery
+
+
+async def _process_uploads(
+    uploads: list,
+    test: Optional[str],
+    language: Optional[str],
+    class_id: Optional[str],
+    subject: Optional[str],
+    on_event: Optional[Callable[[dict], None]] = None,
+    client: str = "local",
+) -> dict:
+    """Fayllarni parallel (FILE_CONCURRENCY tagacha) qayta ishlab, umumiy hisobot qaytarish.
+
+    ``uploads`` — (fayl nomi, faylni SpooledUpload qilib beruvchi async funksiya) juftliklari.
+    Fayllar navbat bilan olinadi — bir vaqtda faqat FILE_CONCURRENCY tasi diskka
+    chiqariladi va qayta ishlanadi (ZIP arxivdagi yuzlab fayllar uchun ham). Admission
+    navbati to'lib, bir fayl rad etilsa, hali boshlanmagan fayllar ham rad etiladi
+    (``files_rejected``, ``retry_after``) — mijoz faqat ularni qayta yuboradi.
+    """
     total_questions = 0
     files_processed = 0
     files_failed = 0
     errors = []
 
-    for idx, file in enumerate(files):
-        try:
-            content = await file.read()
-            success, count, error_msg = await _parse_and_send_one_file(
-                content, test, language, class_id, subject
+    # Fayllar bir vaqtda qayta ishlanadi: N+1-fayl parse qilinayotganda N-fayl API ga yuborilayotgan bo'ladi
+    results = [None] * len(uploads)
+    pending = enumerate(uploads)
+    rejected_after = None
+
+    async def worker():
+        nonlocal rejected_after
+        for idx, (filename, load) in pending:
+            results[idx] = await _process_one_upload(
+                idx, len(uploads), filename, load, test, language, class_id, subject, on_event, client,
+                rejected_after,
             )
-            if success:
-                total_questions += count
-                files_processed += 1
-                print(f"✅ Fayl {idx + 1}/{len(files)}: {count} ta savol yuborildi")
-            else:
-                files_failed += 1
-                err = error_msg or "Noma'lum xatolik"
-                errors.append({"file": file.filename, "error": err})
-                print(f"❌ Fayl {idx + 1}/{len(files)} ({file.filename}): {err}")
-        except Exception as e:
+            delivery = results[idx][3]
+            if delivery.get("rejected") and rejected_after is None:
+                rejected_after = delivery["retry_after"]
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(FILE_CONCURRENCY, len(uploads))))))
+
+    # Hisobot fayllar yuborilgan tartibda; qisman yuborilgan fayl savollari ham hisoblanadi
+    # Outbox'da qolgan (keyinroq yuboriladigan) fayllar xatolik hisoblanmaydi
+    files = []
+    files_queued = 0
+    files_rejected = 0
+    retry_after = None
+    for (filename, _), (success, count, error_msg, delivery) in zip(uploads, results):
+        total_questions += count
+        if success:
+            files_processed += 1
+        elif delivery["queued"]:
+            files_queued += 1
+        elif delivery.get("rejected"):
+            files_rejected += 1
+            retry_after = max(retry_after or 0, delivery["retry_after"])
+        else:
             files_failed += 1
-            errors.append({"file": file.filename, "error": str(e)})
-            print(f"❌ Fayl {idx + 1}/{len(files)} ({file.filename}): {e}")
+            errors.append({"file": filename, "error": error_msg})
+        files.append({"file": filename, "success": success, "count": count, **delivery})
 
-    return JSONResponse({
-        "success": files_failed == 0,
+    return {
+        "success": files_failed == 0 and files_rejected == 0,
         "total_questions": total_questions,
         "files_processed": files_processed,
         "files_failed": files_failed,
-        "files_total": len(files),
+        "files_queued": files_queued,
+        "files_rejected": files_rejected,
+        "retry_after": retry_after,
+        "files_total": len(uploads),
         "errors": errors if errors else None,
+        "files": files,
         "message": f"{files_processed} ta fayl qayta ishlandi, {total_questions} ta savol yuborildi."
-        + (f" {files_failed} ta faylda xatolik." if files_failed else ""),
-    })
\ No newline at end of file
+        + (f" {files_queued} ta fayl navbatga qo'yildi (keyinroq avtomatik yuboriladi)." if files_queued else "")
+        + (f" {files_failed} ta faylda xatolik." if files_failed else "")
+        + (f" {files_rejected} ta fayl qabul qilinmadi — server band, {retry_after}s dan keyin qayta yuboring."
+           if files_rejected else ""),
+    }
+
+
+UPLOAD_FORM_FIELDS = ("test", "language", "class_id", "subject")
+
+
+def _upload_params(form: UploadForm) -> tuple:
+    """(test, language, class_id, subject) forma maydonlari."""
+    return tuple(form.get(name) for name in UPLOAD_FORM_FIELDS)
+
+
+@app.post("/parse-docx/", openapi_extra=multipart_openapi("files", True, *UPLOAD_FORM_FIELDS))
+async def parse_docx(request: Request):
+    """Bir yoki bir nechta DOCX faylni parallel (FILE_CONCURRENCY tagacha) parse qilib, har birini API ga yuboradi.
+
+    Fayllar tana o'qilayotganda SPOOL_DIR ga yoziladi; MAX_UPLOAD_FILE_BYTES dan katta
+    fayl tananing qolgani o'qilmasdan 413 bilan rad etiladi.
+    """
+    client = client_id(request)
+    retry_after = admission.check_capacity(client)
+    if retry_after is not None:
+        return admission_rejected(retry_after)
+
+    form = await read_upload_form(request, {"files": MAX_UPLOAD_FILE_BYTES})
+    try:
+        uploads = form.files.get("files")
+        if not uploads:
+            return JSONResponse(
+                {"success": False, "error": "Kamida bitta fayl tanlang"},
+                status_code=422,
+            )
+        report = await _process_uploads(
+            [(upload.filename, _ready_loader(upload)) for upload in uploads], *_upload_params(form), client=client
+        )
+    finally:
+        form.cleanup()
+    if report["files_rejected"]:
+        return admission_rejected(report["retry_after"], report)
+    return JSONResponse(report)
+
+
+@app.post("/parse-docx-zip/", openapi_extra=multipart_openapi("archive", False, *UPLOAD_FORM_FIELDS))
+async def parse_docx_zip(request: Request):
+    """DOCX fayllar ZIP arxivini qabul qilib, har bir faylni /parse-docx/ kabi qayta ishlaydi.
+
+    Arxiv diskka spool qilinadi, a'zolar esa navbat bilan (FILE_CONCURRENCY tagacha)
+    chiqariladi. Hisobotda har bir a'zo natijasi va o'tkazib yuborilgan (DOCX bo'lmagan) fayllar.
+    """
+    client = client_id(request)
+    retry_after = admission.check_capacity(client)
+    if retry_after is not None:
+        return admission_rejected(retry_after)
+
+    form, docx_archive = await read_archive_form(request)
+    try:
+        if not docx_archive.members:
+            return JSONResponse(
+                {"success": False, "error": "Arxivda DOCX fayl topilmadi", "skipped": docx_archive.skipped},
+                status_code=422,
+            )
+        report = await _process_uploads(docx_archive.uploads(), *_upload_params(form), client=client)
+    finally:
+        await asyncio.to_thread(docx_archive.close)
+    report["archive"] = docx_archive.upload.filename
+    report["skipped"] = docx_archive.skipped
+    if report["files_rejected"]:
+        return admission_rejected(report["retry_after"], report)
+    return JSONResponse(report)
+
+
+def _ready_loader(upload: SpooledUpload) -> Callable[[], Awaitable[SpooledUpload]]:
+    """Oldindan spool qilingan fayl uchun ``_process_one_upload`` ga mos yuklovchi."""
+    async def load():
+        return upload
+    return load
+
+
+class JobStore:
+    """Fon ishlari holati va hodisalarining SQLite jurnali (barcha worker'lar uchun umumiy).
+
+    Ishni bajarayotgan worker har bir hodisani ishning joriy holati bilan birga
+    yozadi; boshqa worker'lar holatni va hodisalarni shu yerdan o'qiydi.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    snapshot TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+        conn.close()
+
+    def record(self, job_id: str, seq: int, event: dict, snapshot: dict, finished_at: Optional[float]):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, snapshot, updated_at, finished_at) VALUES (?, ?, ?, ?)",
+                (job_id, json.dumps(snapshot, ensure_ascii=False), time.time(), finished_at),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps(event, ensure_ascii=False)),
+            )
+        conn.close()
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT snapshot FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        return json.loads(row["snapshot"]) if row else None
+
+    def events(self, job_id: str, start: int) -> list:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, start)
+            ).fetchall()
+        conn.close()
+        return [json.loads(row["event"]) for row in rows]
+
+    def count_events(self, job_id: str) -> int:
+        with self._connect() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        conn.close()
+        return count
+
+    def purge(self, retention: float, max_jobs: int):
+        """Saqlash muddati o'tgan va soni ``max_jobs`` dan oshgan tugagan ishlarni o'chirish."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND (finished_at < ? OR id NOT IN ("
+                " SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ?))",
+                (time.time() - retention, max_jobs),
+            )
+            conn.execute("DELETE FROM job_events WHERE job_id NOT IN (SELECT id FROM jobs)")
+        conn.close()
+
+
+class StoredJob:
+    """Boshqa worker bajarayotgan (yoki bajargan) ish — ``JobStore`` orqali ``ParseJob`` kabi o'qiladi."""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.id = job_id
+
+    async def events_since(self, seen: int) -> list:
+        return await asyncio.to_thread(self.store.events, self.id, seen)
+
+    async def wait_for_events(self, seen: int, timeout: float) -> bool:
+        """Yangi hodisa paydo bo'lguncha JOB_POLL_INTERVAL bilan so'rash."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if await asyncio.to_thread(self.store.count_events, self.id) > seen:
+                return True
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+        return False
+
+
+class ParseJob:
+    """Fonda bajarilayotgan /parse-docx/ ishi: holat, fayllar bo'yicha progress va hodisalar.
+
+    Hodisalar ``store`` ga tartib bilan yoziladi (boshqa worker'lar uchun); shu
+    worker'dagi SSE obunachilari esa darhol uyg'otiladi.
+    """
+
+    FINISHED_FILE_STATUSES = ("done", "failed", "queued_upstream", "rejected")
+
+    def __init__(self, filenames: List[str], store: Optional[JobStore] = None):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.status = "queued"
+        self.files = [{"file": name, "status": "queued", "count": 0, "error": None} for name in filenames]
+        self.result: Optional[dict] = None
+        self.events = []
+        self.store = store
+        self._changed = asyncio.Condition()
+        self._write_lock = asyncio.Lock()
+        # Fire-and-forget task'lar GC bo'lib ketmasligi uchun havolalar
+        self._tasks = set()
+
+    def emit(self, event: dict):
+        """Hodisani qayd qilish, SSE obunachilarini uyg'otish va store'ga yozish."""
+        if event["type"] == "file_started":
+            self.files[event["index"]]["status"] = "running"
+        elif event["type"] == "file_done":
+            entry = self.files[event["index"]]
+            status = (
+                "done" if event["success"]
+                else "queued_upstream" if event["queued"]
+                else "rejected" if event["rejected"]
+                else "failed"
+            )
+            entry.update(status=status, count=event["count"], error=event["error"])
+            event["completed"] = self.files_completed
+            event["files_total"] = len(self.files)
+        self.events.append(event)
+        task = asyncio.get_running_loop().create_task(self._publish(len(self.events) - 1, event))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _publish(self, seq: int, event: dict):
+        async with self._changed:
+            self._changed.notify_all()
+        if self.store is None:
+            return
+        # Qulf navbati (FIFO) hodisalarni seq tartibida yozadi; holat yozish paytidagisi olinadi
+        async with self._write_lock:
+            try:
+                await asyncio.to_thread(self.store.record, self.id, seq, event, self.snapshot(), self.finished_at)
+            except Exception as e:
+                logger.warning(f"⚠️ Ish ({self.id}) holatini saqlashda xatolik: {e}")
+
+    async def flush(self):
+        """Navbatdagi barcha hodisalar store'ga yozilishini kutish."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def events_since(self, seen: int) -> list:
+        return self.events[seen:]
+
+    async def wait_for_events(self, seen: int, timeout: float) -> bool:
+        """Yangi hodisa (``seen`` dan keyin) paydo bo'lishini kutish."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: len(self.events) > seen), timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    @property
+    def files_completed(self) -> int:
+        return sum(1 for f in self.files if f["status"] in self.FINISHED_FILE_STATUSES)
+
+    def snapshot(self) -> dict:
+        return {
+            "success": True,
+            "job_id": self.id,
+            "status": self.status,
+            "files_total": len(self.files),
+            "files_completed": self.files_completed,
+            "files": self.files,
+            "result": self.result,
+            "retry_after": self.result.get("retry_after") if self.result else None,
+        }
+
+
+class JobManager:
+    """Fondagi parse ishlarini rejalashtirish va tugagan natijalarni cheklangan vaqt saqlash."""
+
+    def __init__(self, max_running: int, retention: float, max_jobs: int, store: Optional[JobStore] = None):
+        self.store = store
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._slots = None
+        self._max_running = max(1, max_running)
+        self._tasks = set()
+
+    def _purge(self):
+        """Saqlash muddati o'tgan (yoki soni oshib ketgan) tugagan ishlarni o'chirish."""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and (
+                now - job.finished_at > self.retention or len(self._jobs) > self.max_jobs
+            ):
+                del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[ParseJob]:
+        self._purge()
+        return self._jobs.get(job_id)
+
+    async def find(self, job_id: str):
+        """Shu worker'dagi ``ParseJob`` yoki store'dagi (boshqa worker'niki) ``StoredJob``, topilmasa None."""
+        job = self.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        snapshot = await asyncio.to_thread(self.store.snapshot, job_id)
+        return StoredJob(self.store, job_id) if snapshot is not None else None
+
+    async def snapshot(self, job_id: str) -> Optional[dict]:
+        job = self.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        if self.store is None:
+            return None
+        return await asyncio.to_thread(self.store.snapshot, job_id)
+
+    def submit(
+        self,
+        uploads: list,
+        test,
+        language,
+        class_id,
+        subject,
+        on_finish: Optional[Callable[[], None]] = None,
+        client: str = "local",
+    ) -> ParseJob:
+        """Yangi ishni yaratib, fonda ishga tushirish. ``on_finish`` — ish tugagach (resurslarni yopish)."""
+        self._purge()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_running)
+        job = ParseJob([filename for filename, _ in uploads], self.store)
+        self._jobs[job.id] = job
+        job.emit({"type": "queued", "files_total": len(uploads)})
+        task = asyncio.create_task(self._run(job, uploads, test, language, class_id, subject, on_finish, client))
+        # Task GC bo'lib ketmasligi uchun havola saqlanadi
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(
+        self, job: ParseJob, uploads: list, test, language, class_id, subject, on_finish=None, client="local"
+    ):
+        cancelled = False
+        async with self._slots:
+            job.status = "running"
+            try:
+                job.result = await _process_uploads(uploads, test, language, class_id, subject, job.emit, client)
+                # Admission navbati to'lgani uchun qayta ishlanmagan fayllar — alohida holat (retry_after bilan)
+                job.status = "rejected" if job.result["files_rejected"] else "done"
+            except asyncio.CancelledError:
+                # Server to'xtatilmoqda — ish "running" holatida osilib qolmasin
+                logger.warning(f"⚠️ Ish ({job.id}) bekor qilindi")
+                job.result = {"success": False, "error": "Ish bekor qilindi (server to'xtatildi)"}
+                job.status = "failed"
+                cancelled = True
+            except Exception as e:
+                logger.error(f"❌ Ish ({job.id}) xatolik bilan tugadi: {e}")
+                job.result = {"success": False, "error": str(e)}
+                job.status = "failed"
+            finally:
+                if on_finish is not None:
+                    on_finish()
+            job.finished_at = time.time()
+            job.emit({"type": "done", "status": job.status, "result": job.result})
+        if cancelled:
+            # Yakuniy holat store'ga yozilib (boshqa worker'lar ko'rishi uchun), so'ng bekor qilish davom etadi
+            await job.flush()
+            raise asyncio.CancelledError
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.purge, self.retention, self.max_jobs)
+            except Exception as e:
+                logger.warning(f"⚠️ Tugagan ishlarni tozalashda xatolik: {e}")
+
+
+job_store = JobStore(JOB_STORE_PATH)
+job_manager = JobManager(JOB_MAX_RUNNING, JOB_RETENTION, JOB_MAX_STORED, job_store)
+
+
+@app.post("/jobs/parse-docx/", status_code=202, openapi_extra=multipart_openapi("files", True, *UPLOAD_FORM_FIELDS))
+async def submit_parse_job(request: Request):
+    """/parse-docx/ ning fon rejimi: darhol job id qaytaradi, progress SSE yoki polling orqali olinadi."""
+    client = client_id(request)
+    retry_after = admission.check_capacity(client)
+    if retry_after is not None:
+        return admission_rejected(retry_after)
+
+    form = await read_upload_form(request, {"files": MAX_UPLOAD_FILE_BYTES})
+    spooled = form.files.get("files")
+    if not spooled:
+        form.cleanup()
+        return JSONResponse(
+            {"success": False, "error": "Kamida bitta fayl tanlang"},
+            status_code=422,
+        )
+    uploads = [(upload.filename, _ready_loader(upload)) for upload in spooled]
+
+    # Fayllar ish tugaguncha diskda qoladi; admission rad etgani uchun o'qilmaganlari ham o'chiriladi
+    job = job_manager.submit(uploads, *_upload_params(form), on_finish=form.cleanup, client=client)
+    return JSONResponse({
+        "success": True,
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }, status_code=202)
+
+
+@app.post("/jobs/parse-docx-zip/", status_code=202, openapi_extra=multipart_openapi("archive", False, *UPLOAD_FORM_FIELDS))
+async def submit_parse_zip_job(request: Request):
+    """/parse-docx-zip/ ning fon rejimi (arxiv ish tugaguncha diskda saqlanadi)."""
+    client = client_id(request)
+    retry_after = admission.check_capacity(client)
+    if retry_after is not None:
+        return admission_rejected(retry_after)
+
+    form, docx_archive = await read_archive_form(request)
+    if not docx_archive.members:
+        await asyncio.to_thread(docx_archive.close)
+        return JSONResponse(
+            {"success": False, "error": "Arxivda DOCX fayl topilmadi", "skipped": docx_archive.skipped},
+            status_code=422,
+        )
+
+    job = job_manager.submit(
+        docx_archive.uploads(), *_upload_params(form), on_finish=docx_archive.close, client=client
+    )
+    return JSONResponse({
+        "success": True,
+        "job_id": job.id,
+        "files_total": len(docx_archive.members),
+        "skipped": docx_archive.skipped,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }, status_code=202)
+
+
+@app.get("/jobs/{job_id}")
+async def get_parse_job(job_id: str):
+    """Ish holati (polling uchun)."""
+    snapshot = await job_manager.snapshot(job_id)
+    if snapshot is None:
+        return JSONResponse({"success": False, "error": "Ish topilmadi"}, status_code=404)
+    return JSONResponse(snapshot)
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_parse_job_events(job_id: str, request: Request):
+    """Ish hodisalari Server-Sent Events ko'rinishida (ulanish qayta tiklansa Last-Event-ID dan davom etadi)."""
+    job = await job_manager.find(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "error": "Ish topilmadi"}, status_code=404)
+
+    try:
+        start = int(request.headers.get("last-event-id", "-1")) + 1
+    except ValueError:
+        start = 0
+
+    async def event_stream():
+        seen = start
+        while True:
+            for event in await job.events_since(seen):
+                yield f"id: {seen}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                seen += 1
+                if event["type"] == "done":
+                    return
+            if await request.is_disconnected():
+                return
+            if not await job.wait_for_events(seen, timeout=15.0):
+                # Proxy'lar ulanishni uzmasligi uchun keep-alive izoh
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/outbox")
+async def list_outbox(status: Optional[str] = None, limit: int = 100):
+    """Outbox'dagi kutilayotgan (pending) va yuborib bo'lmagan (failed) yozuvlar."""
+    if outbox is None:
+        return JSONResponse({"success": False, "error": "Outbox o'chirilgan (OUTBOX_ENABLED=0)"}, status_code=404)
+    if status not in (None, "pending", "failed"):
+        return JSONResponse({"success": False, "error": "status: pending yoki failed"}, status_code=422)
+
+    listing = await outbox.list_entries(status, max(1, min(limit, 1000)))
+    return JSONResponse({
+        "success": True,
+        "upstream_ok": outbox.upstream_ok,
+        "counts": listing["counts"],
+        "stats": outbox.stats,
+        "entries": listing["entries"],
+    })
+
+
+@app.post("/outbox/{entry_id}/retry")
+async def retry_outbox_entry(entry_id: str):
+    """"failed" yozuvni qayta navbatga qo'yish — drainer uni yana yuboradi."""
+    if outbox is None:
+        return JSONResponse({"success": False, "error": "Outbox o'chirilgan (OUTBOX_ENABLED=0)"}, status_code=404)
+    if not await outbox.requeue(entry_id):
+        return JSONResponse({"success": False, "error": "failed holatidagi yozuv topilmadi"}, status_code=404)
+    return JSONResponse({"success": True, "id": entry_id, "status": "pending"})
+
+
+@app.delete("/outbox/{entry_id}")
+async def delete_outbox_entry(entry_id: str):
+    """Yozuvni (masalan, 422 bilan rad etilgan "failed" payload'ni) navbatdan butunlay o'chirish."""
+    if outbox is None:
+        return JSONResponse({"success": False, "error": "Outbox o'chirilgan (OUTBOX_ENABLED=0)"}, status_code=404)
+    result = await outbox.delete(entry_id)
+    if result == "missing":
+        return JSONResponse({"success": False, "error": "Yozuv topilmadi"}, status_code=404)
+    if result == "busy":
+        return JSONResponse({"success": False, "error": "Yozuv hozir yuborilmoqda — keyinroq urinib ko'ring"}, status_code=409)
+    return JSONResponse({"success": True, "id": entry_id, "status": "deleted"})
+
+
+# Preview natijasidagi rasmlar (digest → data URI); digest kontent bo'yicha, shuning uchun o'zgarmaydi.
+# Qatlam worker'lar orasida umumiy: preview bir worker'da, rasm so'rovi boshqasida bo'lishi mumkin
+if PREVIEW_CACHE_BACKEND == "memory" and WEB_CONCURRENCY > 1:
+    logger.warning(
+        f"⚠️ PREVIEW_CACHE_BACKEND=memory {WEB_CONCURRENCY} ta worker bilan ishlamaydi "
+        "(rasm boshqa worker'da topilmaydi) — sqlite ishlatiladi"
+    )
+    PREVIEW_CACHE_BACKEND = "sqlite"
+preview_images = open_cache_backend("preview", PREVIEW_IMAGE_CACHE_BYTES, PREVIEW_CACHE_BACKEND)
+_preview_slots: Optional[asyncio.Semaphore] = None
+PREVIEW_QUEUE_SIZE = 64
+
+
+def _preview_worker(upload: SpooledUpload, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, stop: threading.Event):
+    """Thread'da: savollarni "stream" engine bilan qator-baqator parse qilib navbatga berish.
+
+    Navbat to'lsa kutadi (backpressure); mijoz uzilsa (``stop``) to'xtaydi.
+    Spool fayl shu thread tugaganda o'chiriladi.
+    """
+    def emit(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    try:
+        doc_info = {"author": ""}
+        questions = []
+        with DocxPackage(str(upload.path)) as package:
+            for question in iter_questions(str(upload.path), package, doc_info, engine="stream"):
+                questions.append(question)
+                digests = {question[key]["image"] for key in ANSWER_KEYS if question[key]["image"]}
+                images = {digest: package.images[digest] for digest in digests}
+                if not emit(("question", question, images, doc_info["author"])):
+                    return
+            emit(("done", (questions, doc_info["author"], package.images), package.cache_stats))
+    except Exception as e:
+        logger.exception(f"❌ Preview xatolik ({upload.filename}): {e}")
+        emit(("error", str(e)))
+    finally:
+        upload.cleanup()
+
+
+@app.post("/preview-docx/", openapi_extra=multipart_openapi("file", False, "images"))
+async def preview_docx(request: Request):
+    """DOCX'ni upstream'ga yubormasdan parse qilib, savollarni NDJSON qatorlari sifatida oqim bilan qaytaradi.
+
+    Har bir savol jadval qatori parse qilinishi bilanoq yuboriladi. ``images``:
+    "digest" — savollarda rasm digest'i (rasm ``/preview/images/{digest}`` dan
+    olinadi), "inline" — to'liq data URI. Tugagan preview natijasi parse keshiga
+    yoziladi: shu faylni keyin /parse-docx/ ga yuborish qayta parse qilmaydi. Parse
+    /parse-docx/ bilan bir xil admission byudjeti ostida ishlaydi.
+    """
+    global _preview_slots
+    client = client_id(request)
+    retry_after = admission.check_capacity(client)
+    if retry_after is not None:
+        return admission_rejected(retry_after)
+    form = await read_upload_form(request, {"file": MAX_UPLOAD_FILE_BYTES})
+    images = form.get("images", "digest")
+    uploads = form.files.get("file")
+    if images not in ("digest", "inline") or not uploads:
+        form.cleanup()
+        error = "images: digest yoki inline" if uploads else "DOCX faylni tanlang"
+        return JSONResponse({"success": False, "error": error}, status_code=422)
+    upload = uploads[0]
+    for extra in uploads[1:]:
+        extra.cleanup()
+
+    if _preview_slots is None:
+        _preview_slots = asyncio.Semaphore(max(1, PREVIEW_CONCURRENCY))
+
+    async def ndjson_stream():
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PREVIEW_QUEUE_SIZE)
+        stop = threading.Event()
+        count = 0
+        author = ""
+
+        def line(obj) -> bytes:
+            return _json_bytes(obj) + b"\n"
+
+        cost = await asyncio.to_thread(estimate_parse_cost, upload)
+        async with _preview_slots, AsyncExitStack() as admitted:
+            try:
+                await admitted.enter_async_context(admission.admit(client, cost))
+            except AdmissionRejected as e:
+                # Tekshiruvdan keyin navbat to'lib qolgan — javob boshlangan, xatolik qatori bilan
+                upload.cleanup()
+                yield line({"type": "error", "error": str(e), "retry_after": e.retry_after})
+                return
+            worker = loop.run_in_executor(None, _preview_worker, upload, loop, queue, stop)
+            try:
+                yield line({
+                    "type": "start",
+                    "file": upload.filename,
+                    "images": images,
+                    "image_url": "/preview/images/{digest}" if images == "digest" else None,
+                })
+                while True:
+                    item = await queue.get()
+                    if item[0] == "question":
+                        _, question, question_images, found_author = item
+                        if found_author and found_author != author:
+                            author = found_author
+                            yield line({"type": "author", "author": author})
+                        if images == "inline":
+                            question = {
+                                key: {
+                                    "text": question[key]["text"],
+                                    "image": question_images[question[key]["image"]] if question[key]["image"] else None,
+                                }
+                                for key in ANSWER_KEYS
+                            }
+                        else:
+                            for digest, uri in question_images.items():
+                                await cache_set(preview_images, digest, uri.encode())
+                        yield line({"type": "question", "index": count, "question": question})
+                        count += 1
+                    elif item[0] == "done":
+                        result = item[1]
+                        record_image_cache(item[2])
+                        await document_cache.store(upload.sha256, result)
+                        yield line({
+                            "type": "done",
+                            "count": count,
+                            "author": result[1],
+                            "images": len(result[2]),
+                            "elapsed": round(time.perf_counter() - started, 3),
+                        })
+                        break
+                    else:
+                        yield line({"type": "error", "error": item[1]})
+                        break
+            finally:
+                # Mijoz uzilgan bo'lsa ham worker to'xtab, spool faylni o'chirishi kutiladi
+                stop.set()
+                await worker
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/preview/images/{digest}")
+async def get_preview_image(digest: str):
+    """Preview'dagi rasm (digest bo'yicha). Kontent digest'ga bog'liq — uzoq keshlanadi."""
+    uri = await cache_get(preview_images, digest)
+    if uri is None:
+        return JSONResponse({"success": False, "error": "Rasm topilmadi (preview'ni qayta yuklang)"}, status_code=404)
+    header, _, data = uri.decode().partition(",")
+    mime_type = header[len("data:"):].split(";")[0] or "application/octet-stream"
+    return Response(
+        base64.b64decode(data),
+        media_type=mime_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )